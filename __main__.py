@@ -1,75 +1,370 @@
+import json
 import pulumi
 import pulumi_aws as aws
-from modules.s3 import setup_s3_buckets
+from modules.s3 import bucket_layout, setup_bucket_notification, setup_s3_buckets
 from modules.lambdas import (
-    setup_lambda_roles_and_policies,
+    build_lambda_package,
     create_lambda_function,
+    failure_destination_statements,
+    fast_path_statements,
+    setup_failure_destination,
+    setup_lambda_roles_and_policies,
+    setup_provisioned_concurrency,
+    trigger_statements,
     upload_lambda_code,
 )
 from modules.glue import (
     setup_crawler,
+    setup_crawler_succeeded_rule,
     setup_database,
     setup_job,
     upload_glue_code,
+    upload_glue_library,
+)
+from modules.inventory import (
+    inventory_reader_statements,
+    inventory_writer_statements,
+    setup_inventory_table,
+)
+from modules.monitoring import (
+    setup_alarms,
+    setup_dashboard,
+    setup_glue_job_log_group,
+    setup_glue_metric_filters,
+)
+from modules.sqs import (
+    create_sqs_event_source,
+    queue_consumer_statements,
+    setup_dead_letter_queue,
+    setup_trigger_queue,
 )
+from modules.registry import (
+    fast_path_tables_document,
+    job_tables_argument,
+    lambda_tables_environment,
+    load_table_registry,
+)
+from modules.artifacts import upload_document
 from modules.snowflake import setup_snowflake_resources
 
+config = pulumi.Config()
+
+# Prefixes of the inputs, the output and the rejected rows
+layout = bucket_layout()
+dated_layout = layout["layout"] == "dated"
+
+data_lake_bucket, output_bucket, script_buckets = setup_s3_buckets(layout)
 
-data_lake_bucket, output_bucket, script_buckets = setup_s3_buckets()
+# The buckets are named in the config. Policies, the crawler and the job only
+# name them, so they take the names rather than the buckets' outputs and are
+# created alongside the buckets instead of after them.
+data_lake_bucket_name = config.require("s3_bucket_name")
+output_bucket_name = config.require("output_bucket_name")
+scripts_bucket_name = config.require("scripts_bucket_name")
 
-# Setup SQS and S3 notification
-# sqs_queue = setup_sqs_and_s3_notification(data_lake_bucket)
+# Format the Glue job writes and Snowpipe loads: "json" or "parquet"
+output_format = config.get("output_format") or "json"
+
+# Catalog table the crawler creates for the data lake, named after the bucket
+glue_table_name = config.get("glue_table_name") or (
+    config.require("s3_bucket_name").lower().replace("-", "_").replace(".", "_")
+)
 
-# create_s3_event_source(lambda_handler, data_lake_bucket.bucket)
+# Source tables, output prefixes and Snowflake tables handled by the pipeline
+tables = load_table_registry(glue_table_name, layout)
+
+# With data_quality, the Glue job profiles each batch before writing it and
+# quarantines the batches that fail their table's quality thresholds
+data_quality = config.get_bool("data_quality") or False
+
+# Glue job --tables argument
+job_tables = job_tables_argument(
+    tables,
+    data_lake_bucket.bucket,
+    output_bucket.bucket,
+    script_buckets.bucket,
+    data_quality,
+)
 
 # Setting up AWS Glue resources
 glue_code = upload_glue_code(script_buckets.bucket, "glue/glue_job.py")
+metrics_library = upload_glue_library(script_buckets.bucket, "shared/metrics.py")
+rechunk_library = upload_glue_library(
+    script_buckets.bucket, "shared/rechunk.py", "GlueJobRechunkLibrary"
+)
+inventory_library = upload_glue_library(
+    script_buckets.bucket, "shared/inventory.py", "GlueJobInventoryLibrary"
+)
+
+# The job's EMF lines go to its own log group, where metric filters turn
+# them into metrics
+glue_job_log_group = setup_glue_job_log_group()
+setup_glue_metric_filters(glue_job_log_group)
+
+# Gzip inputs from this size on are re-chunked into parts Spark can split,
+# 0 reads them as they are
+rechunk_min_bytes = config.get_int("rechunk_min_bytes")
+if rechunk_min_bytes is None:
+    rechunk_min_bytes = 128 * 1024 * 1024
+
+# With input_inventory, the trigger Lambda records the uploads in a DynamoDB
+# table and the job's manifest mode takes the pending files from it instead
+# of listing the data lake
+input_inventory = config.get_bool("input_inventory")
+if (
+    input_inventory
+    and (config.get("glue_processing_mode") or "incremental") != "manifest"
+):
+    pulumi.log.warn(
+        "input_inventory needs glue_processing_mode manifest, the inventory is "
+        "turned off"
+    )
+    input_inventory = False
+
+# In the dated layout, the manifest mode can list only the date partitions of
+# the last input_lookback_days days instead of a table's whole input prefix
+input_lookback_days = config.get_int("input_lookback_days") or 0
+if input_lookback_days and not dated_layout:
+    pulumi.log.warn(
+        "input_lookback_days needs bucket_layout dated, the whole input prefix is "
+        "listed"
+    )
+    input_lookback_days = 0
+
+inventory_table = None
+inventory_arguments = {}
+if input_inventory:
+    inventory_table = setup_inventory_table()
+    inventory_arguments = {"--inventory_table": inventory_table.name}
+
+# Snowpipe loads the files a compaction pass writes as new files, so their
+# rows are loaded again unless every table is merged on its key
+compaction_schedule = config.get("compaction_schedule")
+if compaction_schedule and (
+    (config.get("snowflake_load_mode") or "append") != "merge"
+    or not all(t["key"] for t in tables)
+):
+    pulumi.log.warn(
+        "compaction_schedule needs snowflake_load_mode merge and a key for every "
+        "table, the compaction schedule is turned off"
+    )
+    compaction_schedule = None
 
 glue_database = setup_database()
-crawler = setup_crawler(data_lake_bucket.bucket, glue_database)
+# The dated layout crawls each table's input prefix, the flat one the bucket
+crawler, schema_crawler = setup_crawler(
+    data_lake_bucket_name,
+    glue_database,
+    prefixes=[t["input_prefix"] for t in tables] if dated_layout else [""],
+)
 glue_job = setup_job(
-    data_lake_bucket.bucket, output_bucket.bucket, script_buckets.bucket, glue_code.key
+    data_lake_bucket_name,
+    output_bucket_name,
+    scripts_bucket_name,
+    glue_code.key,
+    glue_database.name,
+    extra_arguments={
+        "--database": glue_database.name,
+        "--output_format": output_format,
+        "--extra-py-files": pulumi.Output.all(
+            script_buckets.bucket,
+            metrics_library.key,
+            rechunk_library.key,
+            inventory_library.key,
+        ).apply(lambda args: ",".join(f"s3://{args[0]}/{key}" for key in args[1:])),
+        "--rechunk_min_bytes": str(rechunk_min_bytes),
+        "--enable-continuous-cloudwatch-log": "true",
+        "--continuous-log-logGroup": glue_job_log_group.name,
+        "--tables": job_tables,
+        "--bucket_layout": layout["layout"],
+        "--input_lookback_days": str(input_lookback_days),
+        **inventory_arguments,
+    },
+    extra_statements=(
+        inventory_reader_statements(inventory_table) if inventory_table else ()
+    ),
+    compaction_schedule=compaction_schedule,
 )
 
 # Setting up Lambda resources
-lambda_code = upload_lambda_code(script_buckets.bucket, "lambda/lambda_deployment.zip")
+lambda_package, lambda_package_hash = build_lambda_package(
+    "lambda",
+    "build/lambda_deployment.zip",
+    extra_files=["shared/metrics.py", "shared/inventory.py"],
+)
+lambda_code = upload_lambda_code(script_buckets.bucket, lambda_package)
+
+# Objects up to this size are converted to the output by the trigger Lambda
+# instead of the Glue job. The files it converts are recorded in the job's
+# manifest, so it needs the manifest processing mode, and the Lambda runtime
+# has no Parquet writer.
+fast_path_max_bytes = config.get_int("fast_path_max_bytes") or 0
+if fast_path_max_bytes and (
+    output_format != "json"
+    or (config.get("glue_processing_mode") or "incremental") != "manifest"
+):
+    pulumi.log.warn(
+        "fast_path_max_bytes needs glue_processing_mode manifest and output_format "
+        "json, the fast path is turned off"
+    )
+    fast_path_max_bytes = 0
 
-lambda_role = setup_lambda_roles_and_policies(
-    glue_job.name, crawler.name, data_lake_bucket.bucket
+# Trigger events the Lambda keeps failing on end up in a dead-letter queue
+dead_letter_queue = setup_dead_letter_queue()
+
+trigger_batching = config.get_bool("trigger_batching")
+if trigger_batching:
+    # Upload events go through a queue, so a burst of uploads starts one run
+    sqs_queue, sqs_queue_policy = setup_trigger_queue(
+        data_lake_bucket_name,
+        dead_letter_queue=dead_letter_queue,
+        max_receive_count=config.get_int("trigger_max_receive_count") or 10,
+    )
+
+# The Lambda role's access is collected from each feature into one policy
+lambda_statements = trigger_statements(
+    glue_job.name,
+    [crawler.name, schema_crawler.name],
+    data_lake_bucket_name,
+    glue_database.name,
 )
+lambda_statements += failure_destination_statements(dead_letter_queue)
+if trigger_batching:
+    lambda_statements += queue_consumer_statements(sqs_queue)
+if inventory_table:
+    lambda_statements += inventory_writer_statements(inventory_table)
+
+fast_path_environment = {}
+if fast_path_max_bytes:
+    lambda_statements += fast_path_statements(
+        output_bucket_name, scripts_bucket_name, layout["rejected_prefix"]
+    )
+    # The tables' paths and columns are read from S3, the function's
+    # environment would not hold more than a few tables
+    fast_path_registry = upload_document(
+        "FastPathTables",
+        script_buckets.bucket,
+        fast_path_tables_document(
+            tables,
+            data_lake_bucket.bucket,
+            output_bucket.bucket,
+            script_buckets.bucket,
+            data_quality,
+        ),
+        "registry",
+    )
+    fast_path_environment = {
+        "FAST_PATH": json.dumps({"max_bytes": fast_path_max_bytes}),
+        "FAST_PATH_TABLES": pulumi.Output.concat(
+            "s3://", fast_path_registry.bucket, "/", fast_path_registry.key
+        ),
+    }
+
+lambda_role, lambda_policy = setup_lambda_roles_and_policies(lambda_statements)
 
 lambda_handler = create_lambda_function(
     "myLambdaHandler",
     lambda_role.arn,
-    "lambda_trigger_glue.handler",
+    "trigger_glue.handler",
     lambda_code.bucket,
     lambda_code.key,
     crawler.name,
     glue_job.name,
-    runtime="python3.8",
+    runtime="python3.12",
+    extra_environment={
+        "GLUE_SCHEMA_CRAWLER_NAME": schema_crawler.name,
+        "GLUE_DATABASE_NAME": glue_database.name,
+        "GLUE_TABLES": lambda_tables_environment(tables),
+        "JOB_SIZING": json.dumps(config.get_object("glue_job_sizing") or {}),
+        **({"INVENTORY_TABLE": inventory_table.name} if inventory_table else {}),
+        **fast_path_environment,
+    },
+    architecture="arm64",
+    memory_size=config.get_int("lambda_memory_size") or 128,
+    timeout=config.get_int("lambda_timeout") or 60,
+    source_code_hash=lambda_package_hash,
+    publish=bool(config.get_int("lambda_provisioned_concurrency")),
 )
 
-lambda_permission = aws.lambda_.Permission(
-    "lambdaPermission",
-    action="lambda:InvokeFunction",
-    function=lambda_handler.arn,
-    principal="s3.amazonaws.com",
-    source_arn=data_lake_bucket.bucket.apply(lambda bucket: f"arn:aws:s3:::{bucket}"),
-    source_account=pulumi.Config().require("aws_account_id"),
-)
+# Triggers invoke the alias carrying the provisioned concurrency, if any
+lambda_target = lambda_handler
+lambda_qualifier = None
+if config.get_int("lambda_provisioned_concurrency"):
+    lambda_target = setup_provisioned_concurrency(
+        lambda_handler, config.get_int("lambda_provisioned_concurrency")
+    )
+    lambda_qualifier = lambda_target.name
 
-bucket_notification = aws.s3.BucketNotification(
-    "bucketNotification",
-    bucket=data_lake_bucket.bucket,
-    lambda_functions=[
-        {
-            "lambda_function_arn": lambda_handler.arn,
-            "events": ["s3:ObjectCreated:*"],
-            "filter_suffix": ".csv",
-        }
-    ],
-    opts=pulumi.ResourceOptions(depends_on=[lambda_permission]),
+lambda_retry_attempts = config.get_int("lambda_retry_attempts")
+setup_failure_destination(
+    lambda_handler,
+    lambda_policy,
+    dead_letter_queue,
+    qualifier=lambda_qualifier,
+    maximum_retry_attempts=(
+        2 if lambda_retry_attempts is None else lambda_retry_attempts
+    ),
 )
 
+# Dashboard of the trigger's and the job's metrics, and alarms on failures
+setup_dashboard(lambda_handler, tables)
+setup_alarms(lambda_handler, tables, dead_letter_queue)
+
+# Start the Glue job from the crawlers' completion events
+setup_crawler_succeeded_rule([crawler.name, schema_crawler.name], lambda_target)
+
+# New CSV uploads, in the dated layout only those under the raw prefix
+upload_filters = [
+    {
+        "events": ["s3:ObjectCreated:*"],
+        "filter_suffix": suffix,
+        **({"filter_prefix": layout["raw_prefix"]} if dated_layout else {}),
+    }
+    for suffix in (".csv", ".csv.gz")
+]
+
+if trigger_batching:
+    create_sqs_event_source(
+        lambda_target,
+        lambda_policy,
+        sqs_queue,
+        batch_size=config.get_int("trigger_batch_size") or 1000,
+        maximum_batching_window_in_seconds=config.get_int("trigger_batching_window")
+        or 60,
+    )
 
-snowflake_resources = setup_snowflake_resources(output_bucket.bucket)
+    setup_bucket_notification(
+        "bucketNotification",
+        data_lake_bucket,
+        queues=[{"queue_arn": sqs_queue.arn, **f} for f in upload_filters],
+        depends_on=[sqs_queue_policy],
+    )
+else:
+    lambda_permission = aws.lambda_.Permission(
+        "lambdaPermission",
+        action="lambda:InvokeFunction",
+        function=lambda_target.arn,
+        principal="s3.amazonaws.com",
+        source_arn=f"arn:aws:s3:::{data_lake_bucket_name}",
+        source_account=config.require("aws_account_id"),
+    )
+
+    setup_bucket_notification(
+        "bucketNotification",
+        data_lake_bucket,
+        lambda_functions=[
+            {"lambda_function_arn": lambda_target.arn, **f} for f in upload_filters
+        ],
+        depends_on=[lambda_permission],
+    )
+
+
+snowflake_resources = setup_snowflake_resources(
+    output_bucket_name, tables, output_format
+)
+if snowflake_resources["notifications"]:
+    setup_bucket_notification(
+        "SQSbucketNotification",
+        output_bucket,
+        queues=snowflake_resources["notifications"],
+    )
@@ -0,0 +1,130 @@
+# Checks the content-addressed uploads of the Glue and Lambda code. First the
+# hashing: the Lambda package is built twice from copies of the sources with
+# different timestamps and must hash the same, and the hash throughput is
+# reported. Then the Pulumi program is run against Pulumi's mocks, through
+# benchmarks/pulumi_preview.py, on a copy of the tree: once as deployed,
+# again unchanged, and after editing the Glue job, the trigger Lambda and a
+# shared module. Each run lists the uploads, function updates and job updates
+# it would make; the unchanged run has to make none.
+#
+#   python benchmarks/artifacts.py --hash-mb 256
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pulumi_preview  # noqa: E402
+from modules.artifacts import artifact_key, file_sha256  # noqa: E402
+from modules.lambdas import build_lambda_package  # noqa: E402
+
+# Inputs that change when the code a resource runs changes
+WATCHED = {
+    "aws:s3/bucketObject:BucketObject": ("key",),
+    "aws:lambda/function:Function": ("s3Key", "sourceCodeHash"),
+    "aws:glue/job:Job": ("command", "defaultArguments"),
+}
+
+EDITS = {
+    "Glue job": "glue/glue_job.py",
+    "trigger Lambda": "lambda/trigger_glue.py",
+    "shared module": "shared/metrics.py",
+}
+
+
+def check_hashing(workdir, hash_mb):
+    # Copies of the sources with other timestamps build the same package
+    hashes = []
+    for copy in range(2):
+        directory = os.path.join(workdir, f"sources-{copy}")
+        shutil.copytree(os.path.join(ROOT, "lambda"), os.path.join(directory, "lambda"))
+        shutil.copytree(os.path.join(ROOT, "shared"), os.path.join(directory, "shared"))
+        for base, _, names in os.walk(directory):
+            for name in names:
+                os.utime(os.path.join(base, name), (copy * 86400, copy * 86400))
+        package, _ = build_lambda_package(
+            os.path.join(directory, "lambda"),
+            os.path.join(directory, "lambda_deployment.zip"),
+            [
+                os.path.join(directory, "shared", name)
+                for name in ("metrics.py", "inventory.py")
+            ],
+        )
+        hashes.append(artifact_key("lambda", package))
+    if hashes[0] != hashes[1]:
+        sys.exit(f"Unchanged sources built packages of different hashes: {hashes}")
+    print(f"Lambda package key, stable across builds: {hashes[0]}")
+
+    path = os.path.join(workdir, "blob")
+    with open(path, "wb") as blob:
+        for _ in range(hash_mb):
+            blob.write(os.urandom(1024 * 1024))
+    start = time.perf_counter()
+    file_sha256(path)
+    print(
+        f"SHA-256 of {hash_mb} MB: {hash_mb / (time.perf_counter() - start):.0f} MB/s"
+    )
+
+
+def deploy(program_dir):
+    # Inputs of the resources that carry code, as the mocked program sets them
+    result = pulumi_preview.measure(
+        program_dir, SimpleNamespace(latency_ms=0, config=[])
+    )
+    return {
+        name: (typ, {field: inputs.get(field) for field in WATCHED[typ]})
+        for name, (typ, inputs) in result["inputs"].items()
+        if typ in WATCHED
+    }
+
+
+def changes(before, after):
+    # Uploads, function updates and job updates from one deploy to the next
+    changed = [name for name in after if before.get(name) != after[name]]
+    return tuple([name for name in changed if after[name][0] == typ] for typ in WATCHED)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed code uploads")
+    parser.add_argument("--hash-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="artifacts_")
+    try:
+        check_hashing(workdir, args.hash_mb)
+
+        program_dir = os.path.join(workdir, "program")
+        shutil.copytree(
+            ROOT,
+            program_dir,
+            ignore=shutil.ignore_patterns(".git", "build", "__pycache__", "benchmarks"),
+        )
+        previous = deploy(program_dir)
+        runs = [("unchanged", changes(previous, deploy(program_dir)))]
+        for label, path in EDITS.items():
+            with open(os.path.join(program_dir, path), "a") as source:
+                source.write(f"\n# {label} edited\n")
+            current = deploy(program_dir)
+            runs.append((f"{label} edited", changes(previous, current)))
+            previous = current
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'deploy':<24}{'uploads':<46}{'functions':<18}{'jobs'}")
+    for label, (uploads, functions, jobs) in runs:
+        print(
+            f"{label:<24}{', '.join(uploads) or '-':<46}"
+            f"{', '.join(functions) or '-':<18}{', '.join(jobs) or '-'}"
+        )
+    if any(runs[0][1]):
+        sys.exit("An unchanged deploy would upload or update code")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Checks the bucket layouts and lifecycle rules the Pulumi program declares,
+# by running it against Pulumi's mocks through benchmarks/pulumi_preview.py
+# with bucket_layout flat and dated. Fails unless every bucket aborts
+# incomplete multipart uploads and expires noncurrent versions, and, in the
+# dated layout, unless the upload notifications, the crawler's targets and
+# the job's input, output and rejected paths all fall under the raw,
+# processed and rejected prefixes. Then models a data lake growing by
+# --files-per-day uploads per entity for --days days: keys the manifest
+# mode lists per run (whole bucket, entity prefix, the last
+# --lookback-days date partitions) and the monthly raw storage cost with and
+# without the transition to STANDARD_IA after 30 days.
+#
+#   python benchmarks/bucket_layout.py --entities 5 --files-per-day 200
+import argparse
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pulumi_preview  # noqa: E402
+
+ROOT = pulumi_preview.ROOT
+
+LAYOUTS = {
+    "flat": [],
+    "dated": ["bucket_layout=dated", "input_lookback_days=3"],
+}
+
+# us-east-1 list prices, per GB-month and per 1000 LIST requests
+STANDARD_GB_MONTH = 0.023
+STANDARD_IA_GB_MONTH = 0.0125
+LIST_PER_1000 = 0.005
+
+LIST_PAGE_KEYS = 1000
+
+
+def resources(config):
+    result = pulumi_preview.measure(
+        os.path.abspath(ROOT), SimpleNamespace(latency_ms=0, config=config)
+    )
+    by_type = {}
+    for name, (typ, inputs) in result["inputs"].items():
+        by_type.setdefault(typ.split(":")[-1], {})[name] = inputs
+    return by_type
+
+
+def check(layout, by_type):
+    # Layout problems of one run, empty when it is as declared
+    problems = []
+    for name, bucket in by_type["Bucket"].items():
+        rules = bucket.get("lifecycleRules") or []
+        if not any(r.get("abortIncompleteMultipartUploadDays") for r in rules):
+            problems.append(f"{name} keeps incomplete multipart uploads")
+        if not any(r.get("noncurrentVersionExpiration") for r in rules):
+            problems.append(f"{name} keeps noncurrent versions")
+    if layout != "dated":
+        return problems
+
+    lake = by_type["Bucket"]["dataLakeBucket"]["bucket"]
+    if not any(
+        r.get("prefix") == "raw/" and r.get("transitions")
+        for r in by_type["Bucket"]["dataLakeBucket"]["lifecycleRules"]
+    ):
+        problems.append("raw inputs are not transitioned")
+    notification = by_type["BucketNotification"]["bucketNotification"]
+    for target in notification.get("lambdaFunctions") or notification["queues"]:
+        if target.get("filterPrefix") != "raw/":
+            problems.append(f"upload notification without the raw prefix: {target}")
+    for crawler in by_type["Crawler"].values():
+        for target in crawler["s3Targets"]:
+            if not target["path"].startswith(f"s3://{lake}/raw/"):
+                problems.append(f"crawler target outside raw/: {target['path']}")
+    job = by_type["Job"]["MyGlueJob"]["defaultArguments"]
+    for table in json.loads(job["--tables"]):
+        name = table["name"]
+        for option, prefix in (
+            ("input_path", f"raw/{name}/"),
+            ("output_path", f"processed/{name}/"),
+            ("rejected_path", f"rejected/{name}/"),
+        ):
+            if not table[option].endswith(f"/{prefix}"):
+                problems.append(f"{name}'s {option} is not under {prefix}")
+    return problems
+
+
+def model(args):
+    # Keys listed per manifest run and raw storage cost after args.days days
+    per_entity = args.files_per_day * args.days
+    listed = {
+        "whole bucket": per_entity * args.entities,
+        "entity prefix": per_entity,
+        f"last {args.lookback_days} days": args.files_per_day * args.lookback_days,
+    }
+    print(
+        f"\n{'manifest run lists':<22}{'keys':>12}{'LIST requests':>15}{'$/month':>10}"
+    )
+    for label, keys in listed.items():
+        requests = -(-keys // LIST_PAGE_KEYS)
+        monthly = requests * args.runs_per_day * 30 * LIST_PER_1000 / 1000
+        print(f"{label:<22}{keys:>12}{requests:>15}{monthly:>10.2f}")
+
+    gb_per_day = args.entities * args.files_per_day * args.file_mb / 1024
+    stored = gb_per_day * args.days
+    recent = gb_per_day * min(args.days, 30)
+    standard = stored * STANDARD_GB_MONTH
+    tiered = recent * STANDARD_GB_MONTH + (stored - recent) * STANDARD_IA_GB_MONTH
+    print(f"\n{'raw storage':<22}{'GB':>12}{'$/month':>15}")
+    print(f"{'STANDARD':<22}{stored:>12.0f}{standard:>15.2f}")
+    print(f"{'STANDARD_IA after 30d':<22}{stored:>12.0f}{tiered:>15.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bucket layout and lifecycle")
+    parser.add_argument("--entities", type=int, default=5)
+    parser.add_argument("--files-per-day", type=int, default=200)
+    parser.add_argument("--file-mb", type=float, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--lookback-days", type=int, default=3)
+    parser.add_argument("--runs-per-day", type=int, default=96)
+    args = parser.parse_args()
+
+    failed = False
+    for layout, config in LAYOUTS.items():
+        by_type = resources(config)
+        problems = check(layout, by_type)
+        targets = by_type["Crawler"]["glueCrawler"]["s3Targets"]
+        print(
+            f"{layout:<7}{len(by_type['Bucket'])} buckets with lifecycle rules, "
+            f"crawler targets {', '.join(t['path'] for t in targets)}"
+        )
+        for problem in problems:
+            print(f"  {problem}")
+        failed = failed or bool(problems)
+    if failed:
+        sys.exit("The declared layout does not match")
+    model(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Checks that the columns a table drops are pruned from the Glue job's read
+# and reports the bytes scanned and shuffled with and without the customers
+# table's drop_columns and a row_filter, on generated CSV files read the way
+# the manifest processing mode reads them, with the job's session settings.
+# Fails if a dropped column shows up in the ReadSchema of the physical plan.
+# The CSV parser still splits every field of a line, so that lines with a
+# wrong number of fields are rejected (see configure_session in the job);
+# the savings are in casting, deduplication, shuffles and the output.
+#
+#   python benchmarks/column_pruning.py --rows 1000000
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+
+from pyspark.sql import SparkSession
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "glue"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from generate_customers import generate  # noqa: E402
+from glue_job import (  # noqa: E402
+    DEFAULT_OPTIONS,
+    apply_column_types,
+    configure_session,
+    deduplicate,
+    parse_column_types,
+    project_columns,
+    read_csv,
+)
+from output_formats import COLUMN_TYPES  # noqa: E402
+
+DROP_COLUMNS = ["passwordhash", "passwordsalt"]
+
+
+def stage_totals(spark):
+    # Bytes read and shuffled by all stages so far, from the Spark UI's API
+    url = (
+        f"{spark.sparkContext.uiWebUrl}/api/v1/applications/"
+        f"{spark.sparkContext.applicationId}/stages"
+    )
+    with urllib.request.urlopen(url) as response:
+        stages = json.load(response)
+    return (
+        sum(stage["inputBytes"] for stage in stages),
+        sum(stage["shuffleWriteBytes"] for stage in stages),
+    )
+
+
+def read_schema(df):
+    plan = df._jdf.queryExecution().executedPlan().toString()
+    return re.findall(r"ReadSchema: struct<([^>]*)>", plan)
+
+
+def run(spark, keys, options):
+    column_types = parse_column_types(COLUMN_TYPES)
+    df = project_columns(read_csv(spark, keys, column_types), options)
+    valid, _ = apply_column_types(df, column_types)
+    valid = deduplicate(valid, ["customerid"], "modifieddate")
+
+    before = stage_totals(spark)
+    start = time.perf_counter()
+    valid.write.format("noop").mode("overwrite").save()
+    elapsed = time.perf_counter() - start
+    after = stage_totals(spark)
+    return elapsed, after[0] - before[0], after[1] - before[1], read_schema(valid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Column pruning in the Glue job")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--row-filter", default="modifieddate >= '2006-01-01'")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="column_pruning_")
+    keys = [path for path, _, _ in generate(workdir, args.rows, files=args.files)]
+
+    spark = (
+        SparkSession.builder.master("local[*]")
+        .config("spark.ui.enabled", "true")
+        # Keeps the ReadSchema in the plan string from being shortened
+        .config("spark.sql.maxMetadataStringLength", "10000")
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+    configure_session(spark)
+
+    # Warms up the JVM so the first configuration is not penalized
+    run(spark, keys, DEFAULT_OPTIONS)
+
+    print(f"{'read':<22}{'seconds':>9}{'MB scanned':>12}{'MB shuffled':>13}")
+    results = {}
+    for label, options in (
+        ("all columns", DEFAULT_OPTIONS),
+        ("drop_columns", dict(DEFAULT_OPTIONS, drop_columns=",".join(DROP_COLUMNS))),
+        (
+            "drop_columns + filter",
+            dict(
+                DEFAULT_OPTIONS,
+                drop_columns=",".join(DROP_COLUMNS),
+                row_filter=args.row_filter,
+            ),
+        ),
+    ):
+        elapsed, scanned, shuffled, schemas = run(spark, keys, options)
+        results[label] = schemas
+        print(
+            f"{label:<22}{elapsed:>9.2f}{scanned / 1024 / 1024:>12.1f}"
+            f"{shuffled / 1024 / 1024:>13.1f}"
+        )
+
+    spark.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    # CSV is scanned and split into fields whole either way, so the check is
+    # on the columns the reader passes on
+    for label in ("drop_columns", "drop_columns + filter"):
+        read = [c.split(":")[0] for schema in results[label] for c in schema.split(",")]
+        if not read or set(read) & set(DROP_COLUMNS):
+            sys.exit(f"{label}: dropped columns are still read: {read}")
+    print(f"ReadSchema with drop_columns: {results['drop_columns'][0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Measures what casting costs the Glue job per million rows: the declared
+# casts of apply_column_types (boolean normalization, timestamp parsing,
+# rowguid brace stripping and the rejected-rows check) against plain casts
+# and against no casting, on a generated customers dataset cached in memory
+# so only the transformation is timed.
+#
+#   python benchmarks/column_types.py --rows 5000000
+import argparse
+import os
+import sys
+import time
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "glue"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from glue_job import SPARK_TYPES, apply_column_types, parse_column_types  # noqa: E402
+from output_formats import COLUMN_TYPES, generate_customers  # noqa: E402
+
+
+def no_casts(df, column_types):
+    return df.select([F.col(name).alias(name.lower()) for name in df.columns])
+
+
+def plain_casts(df, column_types):
+    # What the job did before the declared casts
+    return df.select(
+        [
+            F.col(name).cast(SPARK_TYPES[column_types[name.lower()]["type"]])
+            for name in df.columns
+        ]
+    )
+
+
+def declared_casts(df, column_types):
+    valid, _ = apply_column_types(df, column_types)
+    return valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of the Glue job's casts")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+
+    column_types = parse_column_types(COLUMN_TYPES)
+    df = generate_customers(spark, args.rows).cache()
+    df.count()
+
+    print(f"{'casts':<12}{'seconds':>10}{'s per 1M rows':>16}")
+    for label, transform in (
+        ("none", no_casts),
+        ("plain", plain_casts),
+        ("declared", declared_casts),
+    ):
+        # The noop sink runs the whole plan without writing anything
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            transform(df, column_types).write.format("noop").mode("overwrite").save()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"{label:<12}{best:>10.2f}{best / args.rows * 1_000_000:>16.3f}")
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
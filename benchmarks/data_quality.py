@@ -0,0 +1,194 @@
+# Measures what the Glue job's data quality checks cost. Generates a
+# customers CSV with generate_customers.py and a copy of it in which
+# --bad-email-fraction of the email addresses are broken, then runs the job's
+# read, casts and write on local Spark over the clean file without and with
+# the checks of the default customers registry entry, and over the broken
+# one. Reports seconds, Spark SQL queries and jobs, and the bytes read from
+# the source file per run, and fails if the checks read the source again, run
+# more than one query over the rows (the single aggregation pass), or let the
+# broken batch into the output instead of quarantining it with its report.
+# Under adaptive execution the aggregation is two Spark jobs: the pass over
+# the rows and one over its single-row shuffle.
+#
+#   python benchmarks/data_quality.py --rows 1000000 --sample-fraction 0.1
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from pyspark.sql import SparkSession
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "glue"))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+
+import glue_job  # noqa: E402
+from generate_customers import generate  # noqa: E402
+from output_formats import COLUMN_TYPES  # noqa: E402
+
+# The checks of the default customers entry, as the Pulumi program renders
+# them into the job's --tables argument
+QUALITY = {
+    "patterns": {"emailaddress": "email", "phone": "phone", "rowguid": "guid"},
+    "max_null_rate": {"customerid": 0, "modifieddate": 0},
+    "min_conformance": {"*": 0.95},
+}
+
+
+def break_emails(source, target, fraction):
+    rng = random.Random(0)
+    with open(source, newline="") as reader, open(target, "w", newline="") as writer:
+        rows = csv.reader(reader)
+        out = csv.writer(writer)
+        header = next(rows)
+        out.writerow(header)
+        email = header.index("EmailAddress")
+        for row in rows:
+            if rng.random() < fraction:
+                row[email] = row[email].replace("@", " at ")
+            out.writerow(row)
+
+
+def source_bytes_read(spark):
+    statistics = spark.sparkContext._jvm.org.apache.hadoop.fs.FileSystem
+    return sum(
+        s.getBytesRead()
+        for s in statistics.getAllStatistics()
+        if s.getScheme() == "file"
+    )
+
+
+def sql_queries(spark):
+    return spark._jsparkSession.sharedState().statusStore().executionsCount()
+
+
+def run(spark, workdir, label, path, quality):
+    options = dict(
+        glue_job.DEFAULT_OPTIONS,
+        name="customers",
+        output_path=os.path.join(workdir, label, "output") + "/",
+        rejected_path=os.path.join(workdir, label, "rejected") + "/",
+        quarantine_path=os.path.join(workdir, label, "quarantine") + "/",
+        quality_path=os.path.join(workdir, label, "quality") + "/",
+        quality=json.dumps(quality) if quality is not None else "",
+        column_types=COLUMN_TYPES,
+        drop_columns="passwordhash,passwordsalt",
+        correlation_id=label,
+    )
+    column_types = glue_job.parse_column_types(COLUMN_TYPES)
+
+    sc = spark.sparkContext
+    sc.setJobGroup(label, label)
+    bytes_before = source_bytes_read(spark)
+    queries_before = sql_queries(spark)
+    start = time.perf_counter()
+    df = glue_job.project_columns(
+        glue_job.read_csv(spark, [path], column_types), options
+    )
+    metrics = {}
+    glue_job.write_typed(df, column_types, options, "append", 1, metrics)
+    seconds = time.perf_counter() - start
+    jobs = len(sc.statusTracker().getJobIdsForGroup(label))
+
+    reports = []
+    if os.path.isdir(options["quality_path"]):
+        for name in os.listdir(options["quality_path"]):
+            if name.endswith(".json"):
+                with open(os.path.join(options["quality_path"], name)) as report:
+                    reports.append(json.load(report))
+    return {
+        "seconds": seconds,
+        "queries": sql_queries(spark) - queries_before,
+        "jobs": jobs,
+        "source_reads": (source_bytes_read(spark) - bytes_before)
+        / os.path.getsize(path),
+        "metrics": metrics,
+        "reports": reports,
+        "quarantined": os.path.isdir(os.path.join(workdir, label, "quarantine")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data quality check cost")
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--bad-email-fraction", type=float, default=0.2)
+    parser.add_argument("--sample-fraction", type=float, default=0.1)
+    parser.add_argument("--cores", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    spark = (
+        SparkSession.builder.master(f"local[{args.cores}]")
+        .config("spark.ui.enabled", False)
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+    glue_job.configure_session(spark)
+    workdir = tempfile.mkdtemp(prefix="data_quality_")
+    try:
+        generate(os.path.join(workdir, "clean"), args.rows, files=1)
+        clean = os.path.join(workdir, "clean", os.listdir(workdir + "/clean")[0])
+        broken = os.path.join(workdir, "broken.csv")
+        break_emails(clean, broken, args.bad_email_fraction)
+
+        # The first run warms up the JVM and the checks, and is not reported
+        run(spark, workdir, "warmup", clean, QUALITY)
+        runs = {
+            "no checks": run(spark, workdir, "plain", clean, None),
+            "checks": run(spark, workdir, "checked", clean, QUALITY),
+            f"checks, {args.sample_fraction:.0%} sample": run(
+                spark,
+                workdir,
+                "sampled",
+                clean,
+                dict(QUALITY, sample_fraction=args.sample_fraction),
+            ),
+            "checks, broken emails": run(spark, workdir, "broken", broken, QUALITY),
+        }
+    finally:
+        spark.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(
+        f"{'run':<28}{'seconds':>9}{'queries':>9}{'jobs':>6}{'source reads':>14}"
+        f"{'quality ms':>12}{'quarantined':>13}"
+    )
+    for label, result in runs.items():
+        quality_ms = result["metrics"].get("QualityMilliseconds")
+        print(
+            f"{label:<28}{result['seconds']:>9.2f}{result['queries']:>9}"
+            f"{result['jobs']:>6}"
+            f"{result['source_reads']:>14.2f}"
+            f"{quality_ms if quality_ms is not None else '-':>12}"
+            f"{'yes' if result['quarantined'] else 'no':>13}"
+        )
+
+    plain, checked = runs["no checks"], runs["checks"]
+    print("\nViolations of the broken batch:")
+    for violation in runs["checks, broken emails"]["reports"][0]["violations"]:
+        print(f"  {violation}")
+
+    failures = []
+    if checked["source_reads"] > plain["source_reads"] + 0.01:
+        failures.append("the checks read the source files again")
+    if checked["queries"] > plain["queries"] + 1:
+        failures.append(
+            f"the checks added {checked['queries'] - plain['queries']} queries, not one"
+        )
+    if checked["quarantined"] or checked["reports"][0]["violations"]:
+        failures.append(
+            f"the clean batch failed: {checked['reports'][0]['violations']}"
+        )
+    broken_run = runs["checks, broken emails"]
+    if not broken_run["quarantined"] or broken_run["metrics"]["FilesWritten"]:
+        failures.append("the broken batch was not quarantined")
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
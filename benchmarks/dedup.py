@@ -0,0 +1,137 @@
+# Loads two batches of customers, the second re-uploading part of the first
+# with newer ModifiedDate values and some rows twice, and compares the
+# Snowflake table they leave behind when appended to and when merged through
+# a staging table. The Glue job's dedup stage runs on a local Spark session
+# and DuckDB stands in for Snowflake, running the MERGE the task in
+# modules/snowflake.py runs.
+#
+#   python benchmarks/dedup.py --rows 1000000 --overlap 0.2
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import duckdb
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "glue"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from glue_job import apply_column_types, deduplicate, parse_column_types  # noqa: E402
+from output_formats import COLUMN_TYPES, generate_customers  # noqa: E402
+
+COLUMNS = [item.split(":")[0] for item in COLUMN_TYPES.split(",")]
+
+# Same shape as modules/snowflake.py's merge_statement for the customers table
+MERGE = f"""
+    MERGE INTO customers AS target
+    USING (
+        SELECT * FROM staging
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY customerid ORDER BY modifieddate DESC NULLS LAST
+        ) = 1
+    ) AS source
+    ON target.customerid = source.customerid
+    WHEN MATCHED AND source.modifieddate >= target.modifieddate
+        THEN UPDATE SET {", ".join(f"{c} = source.{c}" for c in COLUMNS)}
+    WHEN NOT MATCHED THEN INSERT ({", ".join(COLUMNS)})
+        VALUES ({", ".join(f"source.{c}" for c in COLUMNS)})
+"""
+
+
+def second_batch(first, overlap_rows):
+    # Rows of the first batch modified a year later, with every tenth row
+    # uploaded twice as overlapping files would
+    updated = first.filter(F.col("CustomerID").cast("long") <= overlap_rows).withColumn(
+        "ModifiedDate",
+        F.date_format(
+            F.to_timestamp("ModifiedDate") + F.expr("INTERVAL 365 DAYS"),
+            "yyyy-MM-dd HH:mm:ss",
+        ),
+    )
+    return updated.unionByName(
+        updated.filter(F.col("CustomerID").cast("long") % 10 == 0)
+    )
+
+
+def transform(df, path, column_types, dedup):
+    # What the Glue job writes for one batch, returning its row count
+    typed, _ = apply_column_types(df, column_types)
+    if dedup:
+        typed = deduplicate(typed, ["customerid"], "modifieddate")
+    typed.write.mode("overwrite").parquet(path)
+    return typed.sparkSession.read.parquet(path).count()
+
+
+def load(connection, paths, merge):
+    connection.execute("DROP TABLE IF EXISTS customers")
+    connection.execute(
+        f"CREATE TABLE customers AS SELECT {', '.join(COLUMNS)} "
+        f"FROM read_parquet('{paths[0]}/*.parquet') LIMIT 0"
+    )
+    start = time.perf_counter()
+    for path in paths:
+        source = f"SELECT {', '.join(COLUMNS)} FROM read_parquet('{path}/*.parquet')"
+        if merge:
+            # The stream hands the task only the rows loaded since its last run
+            connection.execute(f"CREATE OR REPLACE TABLE staging AS {source}")
+            connection.execute(MERGE)
+        else:
+            connection.execute(f"INSERT INTO customers {source}")
+    elapsed = time.perf_counter() - start
+    rows, distinct = connection.execute(
+        "SELECT count(*), count(DISTINCT customerid) FROM customers"
+    ).fetchone()
+    return rows, rows - distinct, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append against dedup and MERGE")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--overlap", type=float, default=0.2)
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+    workdir = tempfile.mkdtemp(prefix="dedup_")
+    column_types = parse_column_types(COLUMN_TYPES)
+
+    first = generate_customers(spark, args.rows).cache()
+    batches = [first, second_batch(first, int(args.rows * args.overlap))]
+
+    connection = duckdb.connect()
+    print(
+        f"{'':<18}{'rows written':>14}{'job s':>8}{'table rows':>12}"
+        f"{'duplicates':>12}{'load s':>8}"
+    )
+    for label, dedup, merge in (
+        ("append", False, False),
+        ("dedup + append", True, False),
+        ("dedup + merge", True, True),
+    ):
+        paths = []
+        written = 0
+        start = time.perf_counter()
+        for index, batch in enumerate(batches):
+            path = os.path.join(workdir, f"{label.replace(' ', '')}_{index}")
+            written += transform(batch, path, column_types, dedup)
+            paths.append(path)
+        job_seconds = time.perf_counter() - start
+
+        rows, duplicates, load_seconds = load(connection, paths, merge)
+        print(
+            f"{label:<18}{written:>14,}{job_seconds:>8.1f}{rows:>12,}"
+            f"{duplicates:>12,}{load_seconds:>8.2f}"
+        )
+
+    connection.close()
+    spark.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
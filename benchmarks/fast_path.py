@@ -0,0 +1,220 @@
+# Measures the per-file latency of the trigger Lambda's fast path, from the
+# upload event to the JSON output written, against moto's S3 for CSV files
+# from 1 KB up to the fast path threshold. Each file is converted --repeat
+# times through the handler. With --compare-glue, the output of one file is
+# checked against what the Glue job writes for it on a local Spark session.
+#
+#   python benchmarks/fast_path.py --max-bytes 8388608 --repeat 5
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import boto3
+from moto import mock_aws
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "lambda"))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+
+import trigger_glue  # noqa: E402
+from generate_customers import generate, load_profile  # noqa: E402
+from output_formats import COLUMN_TYPES  # noqa: E402
+
+LAKE_BUCKET = "local-data-lake"
+OUTPUT_BUCKET = "local-output"
+SCRIPTS_BUCKET = "local-scripts"
+
+TABLE = {
+    "name": "customers",
+    "input_path": f"s3://{LAKE_BUCKET}/customers/",
+    "output_path": f"s3://{OUTPUT_BUCKET}/customers/",
+    "manifest_path": f"s3://{SCRIPTS_BUCKET}/state/manifest/customers/",
+    "rejected_path": f"s3://{SCRIPTS_BUCKET}/rejected/customers/",
+    "column_types": COLUMN_TYPES,
+    "dedup_keys": "customerid",
+    "dedup_order": "modifieddate",
+    "drop_columns": "passwordhash,passwordsalt",
+    "row_filter": "",
+}
+
+
+def file_sizes(max_bytes):
+    # 1 KB, then every power of ten up to the threshold, and the threshold
+    sizes = []
+    size = 1024
+    while size < max_bytes:
+        sizes.append(size)
+        size *= 10
+    return sizes + [max_bytes]
+
+
+def upload_event(key, size):
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "s3": {
+                    "bucket": {"name": LAKE_BUCKET},
+                    "object": {"key": key, "size": size},
+                },
+            }
+        ]
+    }
+
+
+def read_rows(s3, bucket, prefix):
+    rows = []
+    for item in s3.list_objects_v2(Bucket=bucket, Prefix=prefix).get("Contents", []):
+        body = s3.get_object(Bucket=bucket, Key=item["Key"])["Body"].read()
+        rows += [json.loads(line) for line in body.splitlines()]
+    return rows
+
+
+def clear(s3, bucket):
+    for item in s3.list_objects_v2(Bucket=bucket).get("Contents", []):
+        s3.delete_object(Bucket=bucket, Key=item["Key"])
+
+
+def glue_rows(path):
+    # What the Glue job writes for the file, as JSON records
+    from pyspark.sql import SparkSession
+
+    sys.path.insert(0, os.path.join(ROOT, "glue"))
+    import glue_job
+
+    # Glue runs in UTC
+    spark = (
+        SparkSession.builder.master("local[1]")
+        .config("spark.sql.session.timeZone", "UTC")
+        .getOrCreate()
+    )
+    spark.sparkContext.setLogLevel("ERROR")
+    glue_job.configure_session(spark)
+    column_types = glue_job.parse_column_types(TABLE["column_types"])
+    options = dict(glue_job.DEFAULT_OPTIONS, **TABLE)
+    df = glue_job.project_columns(
+        glue_job.read_csv(spark, [path], column_types), options
+    )
+    valid, _ = glue_job.apply_column_types(df, column_types)
+    valid = glue_job.deduplicate(valid, ["customerid"], "modifieddate")
+    rows = [json.loads(line) for line in valid.toJSON().collect()]
+    spark.stop()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of the Lambda fast path")
+    parser.add_argument("--max-bytes", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dirty-fraction", type=float, default=0.01)
+    parser.add_argument("--compare-glue", action="store_true")
+    args = parser.parse_args()
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "testing")
+    os.environ.update(
+        AWS_DEFAULT_REGION="us-east-1",
+        GLUE_CRAWLER_NAME="crawler",
+        GLUE_JOB_NAME="job",
+        FAST_PATH=json.dumps({"max_bytes": args.max_bytes}),
+        FAST_PATH_TABLES=f"s3://{SCRIPTS_BUCKET}/registry/fast_path_tables.json",
+    )
+    workdir = tempfile.mkdtemp(prefix="fast_path_")
+    bytes_per_row = load_profile()["bytes_per_row"]
+
+    print(
+        f"{'file':>10}{'rows':>9}{'p50 ms':>9}{'max ms':>9}{'rows/s':>11}"
+        f"{'MB/s':>7}{'rejected':>10}"
+    )
+    with mock_aws():
+        s3 = boto3.client("s3")
+        for bucket in (LAKE_BUCKET, OUTPUT_BUCKET, SCRIPTS_BUCKET):
+            s3.create_bucket(Bucket=bucket)
+        # The tables document the Pulumi program uploads
+        s3.put_object(
+            Bucket=SCRIPTS_BUCKET,
+            Key="registry/fast_path_tables.json",
+            Body=json.dumps(
+                {
+                    "data_lake_bucket": LAKE_BUCKET,
+                    "output_bucket": OUTPUT_BUCKET,
+                    "scripts_bucket": SCRIPTS_BUCKET,
+                    "tables": {
+                        "customers": {
+                            "input_prefix": "customers/",
+                            "output_prefix": "customers/",
+                            "rejected_prefix": "rejected/customers/",
+                            **{
+                                name: TABLE[name]
+                                for name in (
+                                    "column_types",
+                                    "drop_columns",
+                                    "dedup_keys",
+                                    "dedup_order",
+                                )
+                            },
+                        }
+                    },
+                }
+            ),
+        )
+        trigger_glue._clients.clear()
+        trigger_glue.get_settings.cache_clear()
+        trigger_glue.load_fast_path_tables.cache_clear()
+
+        for size in file_sizes(args.max_bytes):
+            # Rows vary in length, so the files are sized a little under
+            rows = max(1, int(size * 0.95 / bytes_per_row))
+            directory = os.path.join(workdir, str(size))
+            (path, _, _), *_ = generate(
+                directory, rows, files=1, workers=1, dirty_fraction=args.dirty_fraction
+            )
+            key = f"customers/{size}/{os.path.basename(path)}"
+            with open(path, "rb") as source:
+                s3.put_object(Bucket=LAKE_BUCKET, Key=key, Body=source.read())
+            actual_size = os.path.getsize(path)
+
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = trigger_glue.handler(
+                        upload_event(key, actual_size), None
+                    )
+                timings.append(time.perf_counter() - start)
+                if response.get("statusCode") != 200:
+                    sys.exit(f"{key} was not converted: {response}")
+
+            # Retries overwrite the same files, so these are one conversion's
+            rejected = read_rows(s3, SCRIPTS_BUCKET, "rejected/")
+            median = statistics.median(timings)
+            print(
+                f"{actual_size / 1024:>8.0f}KB{rows:>9,}{median * 1000:>9.1f}"
+                f"{max(timings) * 1000:>9.1f}{rows / median:>11,.0f}"
+                f"{actual_size / 1024 / 1024 / median:>7.1f}{len(rejected):>10,}"
+            )
+            clear(s3, OUTPUT_BUCKET)
+            clear(s3, SCRIPTS_BUCKET)
+
+        if args.compare_glue:
+            expected = glue_rows(path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                trigger_glue.handler(upload_event(key, actual_size), None)
+            actual = read_rows(s3, OUTPUT_BUCKET, "customers/")
+            key_of = lambda row: row["customerid"]  # noqa: E731
+            if sorted(actual, key=key_of) != sorted(expected, key=key_of):
+                sys.exit("The fast path output differs from the Glue job's")
+            print(f"Fast path output matches the Glue job's on {len(actual):,} rows")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Reports the number and size distribution of the files the Glue job writes
+# for a target file size, before and after the compaction pass, on synthetic
+# inputs in local directories standing in for the S3 buckets.
+#
+#   python benchmarks/file_sizes.py --rows 1000000 --target-mb 8
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+
+from pyspark.sql import SparkSession
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "glue"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from glue_job import (
+    DEFAULT_OPTIONS,
+    compact_output,
+    configure_session,
+    run_manifest,
+    write_output,
+)  # noqa: E402
+from output_formats import COLUMN_TYPES, generate_customers  # noqa: E402
+
+
+def file_sizes(path, suffix):
+    sizes = []
+    for root, _, files in os.walk(path):
+        sizes.extend(
+            os.path.getsize(os.path.join(root, name))
+            for name in files
+            if name.endswith(suffix)
+        )
+    return sizes
+
+
+def report(label, sizes, target_bytes):
+    mb = [size / 1024 / 1024 for size in sizes]
+    within = sum(
+        1 for size in sizes if target_bytes * 0.5 <= size <= target_bytes * 1.5
+    )
+    print(
+        f"{label:<28}{len(sizes):>7}{min(mb):>9.2f}{statistics.median(mb):>9.2f}"
+        f"{max(mb):>9.2f}{within:>10}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="File count and size distribution of the Glue job output"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--input-files", type=int, default=20)
+    parser.add_argument("--target-mb", type=float, default=8)
+    parser.add_argument("--output-format", default="parquet")
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+    configure_session(spark)
+    workdir = tempfile.mkdtemp(prefix="file_sizes_")
+    suffix = ".parquet" if args.output_format == "parquet" else ".json"
+    target_bytes = int(args.target_mb * 1024 * 1024)
+
+    generate_customers(spark, args.rows).repartition(args.input_files).write.csv(
+        os.path.join(workdir, "lake"), header=True
+    )
+    options = dict(
+        DEFAULT_OPTIONS,
+        input_path=os.path.join(workdir, "lake"),
+        output_path=os.path.join(workdir, "sized"),
+        manifest_path=os.path.join(workdir, "manifest"),
+        output_format=args.output_format,
+        column_types=COLUMN_TYPES,
+        target_file_size_mb=str(args.target_mb),
+    )
+
+    print(
+        f"{'':<28}{'files':>7}{'min MB':>9}{'median':>9}{'max MB':>9}"
+        f"{'on target':>10}"
+    )
+    report("csv input", file_sizes(options["input_path"], ".csv"), target_bytes)
+
+    run_manifest(spark, options)
+    report("sized output", file_sizes(options["output_path"], suffix), target_bytes)
+
+    # Many small files, as written by runs that could not be sized upfront
+    unsized = os.path.join(workdir, "unsized")
+    df = spark.read.format(args.output_format).load(options["output_path"])
+    write_output(
+        df.drop("modified_date").repartition(200),
+        unsized,
+        "overwrite",
+        args.output_format,
+    )
+    report("unsized output", file_sizes(unsized, suffix), target_bytes)
+
+    compact_output(
+        spark,
+        unsized,
+        os.path.join(workdir, "compaction"),
+        target_bytes,
+        args.output_format,
+    )
+    report("after compaction", file_sizes(unsized, suffix), target_bytes)
+
+    spark.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
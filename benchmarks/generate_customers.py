@@ -0,0 +1,220 @@
+# Generates customers datasets of any size for load tests. Rows have the
+# columns of data/customers.csv and draw their values from the distributions
+# in it, nulls in MiddleName/Suffix included, with fresh CustomerIDs, rowguids
+# and password hashes. Files are streamed row by row, so memory use does not
+# grow with the dataset, and written by a pool of worker processes.
+#
+#   python benchmarks/generate_customers.py /tmp/customers --rows 10000000 --file-size-mb 128
+#
+# --drift-fraction writes that share of the files with a changed schema and
+# --dirty-fraction injects malformed rows, to benchmark how the pipeline copes.
+import argparse
+import base64
+import csv
+import math
+import multiprocessing
+import os
+import random
+import re
+import time
+import uuid
+
+CUSTOMERS_CSV = os.path.join(os.path.dirname(__file__), "..", "data", "customers.csv")
+
+# Columns whose values are drawn as they appear in data/customers.csv, which
+# keeps their frequencies and share of empty values
+SAMPLED_COLUMNS = [
+    "NameStyle",
+    "Title",
+    "FirstName",
+    "MiddleName",
+    "LastName",
+    "Suffix",
+    "CompanyName",
+    "SalesPerson",
+    "ModifiedDate",
+]
+
+# Schema changes a drifted file gets, applied to its header and every row
+DRIFTS = {
+    "add_column": lambda header, row: (header + ["LoyaltyTier"], row + ["Gold"]),
+    "drop_column": lambda header, row: (header[:6] + header[7:], row[:6] + row[7:]),
+    "rename_column": lambda header, row: (
+        [("PhoneNumber" if c == "Phone" else c) for c in header],
+        row,
+    ),
+    "reorder_columns": lambda header, row: (header[1:] + header[:1], row[1:] + row[:1]),
+}
+
+# Malformed rows as they show up in real exports. Each returns the CSV line
+# to write in place of a valid row.
+DIRTY_ROWS = {
+    "bad_number": lambda row: ["CUST-" + row[0]] + row[1:],
+    "bad_timestamp": lambda row: row[:-1] + ["2006-13-45 25:61:00"],
+    "missing_fields": lambda row: row[:-3],
+    "extra_fields": lambda row: row + ["unexpected", "values"],
+    "unbalanced_quote": lambda row: row[:7] + ['"' + row[7]] + row[8:],
+    "blank": lambda row: [],
+}
+
+
+def load_profile(path=CUSTOMERS_CSV):
+    with open(path, newline="", encoding="utf-8-sig") as source:
+        rows = list(csv.DictReader(source))
+    return {
+        "header": list(rows[0]),
+        "values": {column: [row[column] for row in rows] for column in SAMPLED_COLUMNS},
+        # Phone numbers keep the local and international formats of the sample
+        # and their 555 exchange
+        "phone_formats": [
+            re.sub(r"\d", "#", row["Phone"].replace("555-", "@")).replace("@", "555-")
+            for row in rows
+        ],
+        "bytes_per_row": os.path.getsize(path) / len(rows),
+    }
+
+
+def customer_row(rng, profile, customer_id):
+    values = {c: rng.choice(profile["values"][c]) for c in SAMPLED_COLUMNS}
+    phone = re.sub(
+        "#",
+        lambda _: str(rng.randrange(10)),
+        rng.choice(profile["phone_formats"]),
+    )
+    email = f"{values['FirstName'].lower().replace(' ', '')}{customer_id % 10}@adventure-works.com"
+    return [
+        str(customer_id),
+        values["NameStyle"],
+        values["Title"],
+        values["FirstName"],
+        values["MiddleName"],
+        values["LastName"],
+        values["Suffix"],
+        values["CompanyName"],
+        values["SalesPerson"],
+        email,
+        phone,
+        base64.b64encode(rng.randbytes(32)).decode(),
+        base64.b64encode(rng.randbytes(5)).decode(),
+        "{" + str(uuid.UUID(int=rng.getrandbits(128), version=4)).upper() + "}",
+        values["ModifiedDate"],
+    ]
+
+
+def write_file(spec):
+    # Writes one file and returns (path, rows, bytes)
+    rng = random.Random(spec["seed"])
+    profile = spec["profile"]
+    drift = DRIFTS.get(spec["drift"])
+    dirty_kinds = sorted(DIRTY_ROWS)
+
+    header = profile["header"]
+    if drift:
+        header, _ = drift(header, [])
+
+    with open(spec["path"], "w", newline="", encoding="utf-8") as target:
+        writer = csv.writer(target)
+        writer.writerow(header)
+        for customer_id in range(spec["first_id"], spec["first_id"] + spec["rows"]):
+            row = customer_row(rng, profile, customer_id)
+            if drift:
+                _, row = drift(profile["header"], row)
+            if rng.random() < spec["dirty_fraction"]:
+                row = DIRTY_ROWS[rng.choice(dirty_kinds)](row)
+                # Written as is, bypassing the writer's quoting
+                target.write(",".join(row) + "\r\n")
+            else:
+                writer.writerow(row)
+    return spec["path"], spec["rows"], os.path.getsize(spec["path"])
+
+
+def file_specs(
+    output_dir,
+    rows,
+    files=None,
+    file_size_mb=None,
+    seed=0,
+    drift=None,
+    drift_fraction=0.5,
+    dirty_fraction=0.0,
+    first_id=1,
+):
+    profile = load_profile()
+    if files is None:
+        # Estimated from the average row size of the sample
+        target_bytes = (file_size_mb or 128) * 1024 * 1024
+        files = math.ceil(rows * profile["bytes_per_row"] / target_bytes)
+    files = max(1, min(files, rows))
+
+    drifted = round(files * drift_fraction) if drift else 0
+    specs = []
+    for index in range(files):
+        file_rows = rows // files + (1 if index < rows % files else 0)
+        specs.append(
+            {
+                "path": os.path.join(output_dir, f"customers_{index:05d}.csv"),
+                "rows": file_rows,
+                "first_id": first_id,
+                "seed": seed * 1_000_003 + index,
+                "profile": profile,
+                # The last files of the dataset carry the drifted schema
+                "drift": drift if index >= files - drifted else None,
+                "dirty_fraction": dirty_fraction,
+            }
+        )
+        first_id += file_rows
+    return specs
+
+
+def generate(output_dir, rows, workers=None, **options):
+    # Returns the (path, rows, bytes) of each file written
+    os.makedirs(output_dir, exist_ok=True)
+    specs = file_specs(output_dir, rows, **options)
+    # Spawned rather than forked, so callers holding a Spark session do not
+    # hand its gateway connection to the workers
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(min(workers or os.cpu_count(), len(specs))) as pool:
+        return sorted(pool.imap_unordered(write_file, specs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate customers CSV files")
+    parser.add_argument("output_dir")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--files", type=int)
+    size.add_argument("--file-size-mb", type=float)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-id", type=int, default=1)
+    parser.add_argument("--drift", choices=sorted(DRIFTS))
+    parser.add_argument("--drift-fraction", type=float, default=0.5)
+    parser.add_argument("--dirty-fraction", type=float, default=0.0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    written = generate(
+        args.output_dir,
+        args.rows,
+        workers=args.workers,
+        files=args.files,
+        file_size_mb=args.file_size_mb,
+        seed=args.seed,
+        drift=args.drift,
+        drift_fraction=args.drift_fraction,
+        dirty_fraction=args.dirty_fraction,
+        first_id=args.first_id,
+    )
+    elapsed = time.perf_counter() - start
+
+    total_bytes = sum(size for _, _, size in written)
+    print(
+        f"Wrote {args.rows:,} rows in {len(written)} files, "
+        f"{total_bytes / 1024 / 1024:.1f} MB in {elapsed:.1f} s "
+        f"({args.rows / elapsed:,.0f} rows/s, "
+        f"{total_bytes / 1024 / 1024 / elapsed:.1f} MB/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# Compares how the Glue job's manifest mode finds the files a run has to
+# process as the data lake grows. Listing: every object is listed, 1000 keys
+# per ListObjectsV2 page at --list-latency-ms each, and matched against a
+# manifest of all the files processed before. Inventory: the pending files
+# are queried from shared/inventory.py's index, one page per MB of items at
+# --query-latency-ms each, timed on SqliteInventory. Both must find the same
+# files. A correctness pass then runs DynamoInventory against moto's DynamoDB
+# with the table and sparse index of modules/inventory.py, and fails if its
+# pending files differ from SqliteInventory's, a re-uploaded file is taken
+# out of the index by a run that read the earlier upload, or an event
+# delivered again puts processed files back into it.
+#
+#   python benchmarks/inventory_benchmark.py --objects 10000 100000 1000000 --pending 100
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+
+import boto3
+from moto import mock_aws
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "glue"))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+
+from glue_job import select_new_files  # noqa: E402
+from inventory import (  # noqa: E402
+    PENDING_ATTRIBUTE,
+    PENDING_INDEX,
+    PROCESSED,
+    DynamoInventory,
+    SqliteInventory,
+    new_file,
+)
+
+TABLE = "customers"
+
+# Keys per ListObjectsV2 page and bytes per Query page, S3's and DynamoDB's
+LIST_PAGE_KEYS = 1000
+QUERY_PAGE_BYTES = 1024 * 1024
+
+# Size of one inventory item as DynamoDB counts it, roughly
+ITEM_BYTES = 200
+
+
+def lake_files(objects):
+    # Input files in upload order, the last ones not processed yet
+    return [
+        new_file(
+            f"s3://data-lake/raw/customers/part-{i:08d}.csv",
+            TABLE,
+            1024 + i % 4096,
+            f"etag-{i}",
+            1_700_000_000_000 + i,
+        )
+        for i in range(objects)
+    ]
+
+
+def discover_by_listing(files, processed, list_latency_ms):
+    # Pages of the listing, then the files not in the manifest
+    start = time.perf_counter()
+    manifest = {(f["key"], f["size"], f["modified"]) for f in processed}
+    listed = []
+    for page in range(0, len(files), LIST_PAGE_KEYS):
+        listed += [
+            {"key": f["key"], "size": f["size"], "modified": f["modified"]}
+            for f in files[page : page + LIST_PAGE_KEYS]
+        ]
+    found = select_new_files(listed, manifest)
+    pages = math.ceil(len(files) / LIST_PAGE_KEYS)
+    return found, pages, time.perf_counter() - start + pages * list_latency_ms / 1000
+
+
+def discover_by_inventory(inventory, query_latency_ms):
+    start = time.perf_counter()
+    found = inventory.pending(TABLE)
+    pages = max(1, math.ceil(len(found) * ITEM_BYTES / QUERY_PAGE_BYTES))
+    return found, pages, time.perf_counter() - start + pages * query_latency_ms / 1000
+
+
+def compare(objects, pending, args, workdir):
+    files = lake_files(objects)
+    processed = files[: objects - pending]
+    inventory = SqliteInventory(os.path.join(workdir, f"inventory-{objects}.db"))
+    inventory.record(files)
+    inventory.mark(processed, PROCESSED)
+
+    listed, list_pages, list_seconds = discover_by_listing(
+        files, processed, args.list_latency_ms
+    )
+    queried, query_pages, query_seconds = discover_by_inventory(
+        inventory, args.query_latency_ms
+    )
+    if [f["key"] for f in listed] != [f["key"] for f in queried]:
+        sys.exit(f"Listing and inventory found different files at {objects} objects")
+    print(
+        f"{objects:>10}{len(listed):>9}{list_pages:>12}{list_seconds:>14.3f}"
+        f"{query_pages:>13}{query_seconds:>17.3f}{list_seconds / query_seconds:>10.0f}x"
+    )
+
+
+def check_dynamodb(workdir):
+    with mock_aws():
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName="inputInventory",
+            BillingMode="PAY_PER_REQUEST",
+            KeySchema=[{"AttributeName": "key", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "key", "AttributeType": "S"},
+                {"AttributeName": PENDING_ATTRIBUTE, "AttributeType": "S"},
+                {"AttributeName": "arrived_at", "AttributeType": "N"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": PENDING_INDEX,
+                    "KeySchema": [
+                        {"AttributeName": PENDING_ATTRIBUTE, "KeyType": "HASH"},
+                        {"AttributeName": "arrived_at", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+        )
+        stores = [
+            DynamoInventory(client, "inputInventory"),
+            SqliteInventory(os.path.join(workdir, "check.db")),
+        ]
+        # A third of the files processed, one re-uploaded after the run read
+        # it, and the events of the processed ones delivered again
+        files = lake_files(60)
+        reuploaded = dict(files[0], etag="etag-new")
+        for store in stores:
+            store.record(files)
+            store.record([reuploaded])
+            store.mark(files[:20], PROCESSED)
+            store.record(files[1:20])
+        dynamo, sqlite = ([f["key"] for f in store.pending(TABLE)] for store in stores)
+    if dynamo != sqlite:
+        sys.exit(f"DynamoDB and SQLite inventories differ:\n{dynamo}\n{sqlite}")
+    if files[0]["key"] not in dynamo:
+        sys.exit("A re-uploaded file was taken out of the pending index")
+    if len(dynamo) != 41:
+        sys.exit("Events delivered again put processed files back in the index")
+    print(f"DynamoDB inventory matches SQLite: {len(dynamo)} pending of 60 files")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Input discovery by inventory")
+    parser.add_argument(
+        "--objects", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--pending", type=int, default=100)
+    parser.add_argument("--list-latency-ms", type=float, default=30)
+    parser.add_argument("--query-latency-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="inventory_") as workdir:
+        print(
+            f"{'objects':>10}{'pending':>9}{'list pages':>12}{'listing (s)':>14}"
+            f"{'query pages':>13}{'inventory (s)':>17}{'speedup':>11}"
+        )
+        for objects in args.objects:
+            compare(objects, min(args.pending, objects), args, workdir)
+        check_dynamodb(workdir)
+
+
+if __name__ == "__main__":
+    main()
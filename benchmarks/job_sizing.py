@@ -0,0 +1,69 @@
+# Prints the Glue capacity the trigger Lambda picks for representative input
+# sizes, with estimated cost and latency against the previous fixed
+# max_capacity=2.0 job. Runtime is modelled from a per-DPU throughput and a
+# startup time per execution class; adjust them to measured values.
+#
+#   python benchmarks/job_sizing.py --mb-per-dpu-second 25
+import argparse
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+
+from job_sizing import DPUS_PER_WORKER, GB, MB, size_job_run  # noqa: E402
+
+SIZES = [1 * MB, 100 * MB, 1 * GB, 10 * GB, 100 * GB, 500 * GB]
+
+PRICE_PER_DPU_HOUR = {"STANDARD": 0.44, "FLEX": 0.29}
+
+
+def estimate(total_bytes, dpus, execution_class, args):
+    startup = args.flex_startup if execution_class == "FLEX" else args.startup
+    runtime = total_bytes / MB / (dpus * args.mb_per_dpu_second)
+    # Glue 4.0 bills per second with a one minute minimum
+    billed_hours = max(runtime, 60) / 3600
+    cost = dpus * billed_hours * PRICE_PER_DPU_HOUR[execution_class]
+    return startup + runtime, cost
+
+
+def label(total_bytes):
+    return (
+        f"{total_bytes / GB:g} GB" if total_bytes >= GB else f"{total_bytes / MB:g} MB"
+    )
+
+
+def duration(seconds):
+    if seconds < 120:
+        return f"{math.ceil(seconds)} s"
+    return f"{seconds / 60:.0f} min"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Glue capacity, cost and latency per input size"
+    )
+    parser.add_argument("--mb-per-dpu-second", type=float, default=25)
+    parser.add_argument("--startup", type=float, default=15, help="seconds")
+    parser.add_argument("--flex-startup", type=float, default=120, help="seconds")
+    args = parser.parse_args()
+
+    print(
+        f"| input | worker type | workers | class | est. latency | est. cost "
+        f"| fixed 2 DPU latency | fixed 2 DPU cost |"
+    )
+    print("|---|---|---|---|---|---|---|---|")
+    for total_bytes in SIZES:
+        run = size_job_run(total_bytes)
+        dpus = DPUS_PER_WORKER[run["WorkerType"]] * run["NumberOfWorkers"]
+        latency, cost = estimate(total_bytes, dpus, run["ExecutionClass"], args)
+        fixed_latency, fixed_cost = estimate(total_bytes, 2, "STANDARD", args)
+        print(
+            f"| {label(total_bytes)} | {run['WorkerType']} | {run['NumberOfWorkers']} "
+            f"| {run['ExecutionClass']} | {duration(latency)} | ${cost:.3f} "
+            f"| {duration(fixed_latency)} | ${fixed_cost:.3f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
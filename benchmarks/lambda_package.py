@@ -0,0 +1,71 @@
+# Builds the trigger Lambda package the way the Pulumi program does and
+# reports its size and the cold import time of the handler module, to track
+# cold-start regressions.
+#
+#   python benchmarks/lambda_package.py --runs 10
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from modules.lambdas import build_lambda_package  # noqa: E402
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "..", "lambda")
+SHARED_FILES = [
+    os.path.join(os.path.dirname(__file__), "..", "shared", name)
+    for name in ("metrics.py", "inventory.py")
+]
+
+
+def cold_import_ms(package_dir, statement, runs):
+    # A fresh interpreter per run, as in a new execution environment
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", statement],
+            cwd=package_dir,
+            check=True,
+            env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Size and import time of the trigger Lambda package"
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--handler-module", default="trigger_glue")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="lambda_package_")
+    package, code_hash = build_lambda_package(
+        LAMBDA_DIR, os.path.join(workdir, "lambda_deployment.zip"), SHARED_FILES
+    )
+    with zipfile.ZipFile(package) as archive:
+        entries = archive.infolist()
+        archive.extractall(os.path.join(workdir, "package"))
+
+    interpreter = cold_import_ms(workdir, "pass", args.runs)
+    handler = cold_import_ms(
+        os.path.join(workdir, "package"), f"import {args.handler_module}", args.runs
+    )
+
+    print(f"files in package       {len(entries):>10}")
+    print(f"package size (bytes)   {os.path.getsize(package):>10}")
+    print(f"unpacked size (bytes)  {sum(e.file_size for e in entries):>10}")
+    print(f"code hash              {code_hash}")
+    print(f"interpreter start (ms) {interpreter:>10.1f}")
+    print(f"handler import (ms)    {handler - interpreter:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Prints per-file load latency, credits per GB and the ingestion mode
+# recommended by modules/load_telemetry.py for CSV exports of COPY_HISTORY
+# and PIPE_USAGE_HISTORY, e.g. from
+#
+#   SELECT * FROM TABLE(INFORMATION_SCHEMA.COPY_HISTORY(
+#       TABLE_NAME => 'CUSTOMERS', START_TIME => DATEADD(DAY, -1, CURRENT_TIMESTAMP())));
+#   SELECT * FROM TABLE(INFORMATION_SCHEMA.PIPE_USAGE_HISTORY(
+#       DATE_RANGE_START => DATEADD(DAY, -1, CURRENT_TIMESTAMP())));
+#
+# Without arguments it reads the sample result sets in benchmarks/fixtures/.
+#
+#   python benchmarks/load_telemetry.py copy_history.csv pipe_usage_history.csv --schedule-minutes 30
+import argparse
+import csv
+import os
+import sys
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from modules.load_telemetry import (  # noqa: E402
+    DEFAULT_COPY_GB_PER_CREDIT,
+    WAREHOUSE_CREDITS_PER_HOUR,
+    file_loads,
+    load_metrics,
+    pipe_usage,
+    recommend_ingestion,
+)
+
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as source:
+        return [
+            {name.upper(): value for name, value in row.items()}
+            for row in csv.DictReader(source)
+        ]
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:,.4f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snowflake load telemetry")
+    parser.add_argument(
+        "copy_history", nargs="?", default=os.path.join(FIXTURES, "copy_history.csv")
+    )
+    parser.add_argument(
+        "pipe_usage_history",
+        nargs="?",
+        default=os.path.join(FIXTURES, "pipe_usage_history.csv"),
+    )
+    parser.add_argument("--schedule-minutes", type=int, default=60)
+    parser.add_argument(
+        "--warehouse-size", default="X-SMALL", choices=list(WAREHOUSE_CREDITS_PER_HOUR)
+    )
+    parser.add_argument("--auto-suspend", type=int, default=120)
+    parser.add_argument(
+        "--gb-per-credit", type=float, default=DEFAULT_COPY_GB_PER_CREDIT
+    )
+    parser.add_argument("--max-latency-seconds", type=int)
+    args = parser.parse_args()
+
+    files = file_loads(read_rows(args.copy_history))
+    pipes = pipe_usage(read_rows(args.pipe_usage_history))
+
+    print(f"{'file':<48}{'MB':>9}{'rows':>10}{'latency s':>11}  status")
+    for f in sorted(files, key=lambda f: f["received"] or f["loaded"]):
+        print(
+            f"{f['file'][-48:]:<48}{f['bytes'] / 1024 / 1024:>9.1f}{f['rows']:>10,}"
+            f"{format_value(f['latency_seconds']):>11}  {f['status']}"
+        )
+
+    print()
+    for pipe, usage in pipes.items():
+        print(
+            f"{pipe}: {usage['credits']:.4f} credits, {usage['files']:,} files, "
+            f"{format_value(usage['credits_per_gb'])} credits per GB"
+        )
+
+    metrics = load_metrics(files, pipes)
+    print()
+    for name, value in metrics.items():
+        print(f"{name:<26}{format_value(value)}")
+
+    recommendation = recommend_ingestion(
+        metrics,
+        args.schedule_minutes,
+        args.warehouse_size,
+        args.auto_suspend,
+        args.gb_per_credit,
+        args.max_latency_seconds,
+    )
+    print()
+    for name, value in recommendation.items():
+        print(f"{name:<26}{format_value(value)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# Checks the metrics the pipeline prints: runs the trigger Lambda's handler
+# for an upload and the crawler's completion, with Glue stubbed by
+# botocore's Stubber, and the Glue job on a local Spark session, captures
+# their stdout and validates every Embedded Metric Format line in it. Fails
+# if a line is not valid EMF or the job run does not carry the correlation
+# ID the trigger handed it.
+#
+#   python benchmarks/metrics_output.py --rows 100000
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import boto3
+from botocore.stub import Stubber
+from pyspark.sql import SparkSession
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "glue"))
+sys.path.insert(0, os.path.join(ROOT, "lambda"))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+
+import glue_job  # noqa: E402
+import trigger_glue  # noqa: E402
+from generate_customers import generate  # noqa: E402
+from output_formats import COLUMN_TYPES  # noqa: E402
+
+UPLOAD_EVENT = {
+    "Records": [
+        {
+            "eventSource": "aws:s3",
+            "responseElements": {"x-amz-request-id": "EXAMPLE123456789"},
+            "s3": {
+                "bucket": {"name": "lake"},
+                "object": {"key": "customers/customers_00000.csv", "size": 1024},
+            },
+        }
+    ]
+}
+CRAWLER_EVENT = {
+    "source": "aws.glue",
+    "id": "7bf73129-1428-4cd3-a780-95db273d1602",
+    "detail": {"crawlerName": "crawler", "runningTime (sec)": "26"},
+}
+
+
+class LocalCatalog:
+    # The manifest processing mode only needs the Spark session
+    def __init__(self, spark):
+        self.spark_session = spark
+
+
+def emf_lines(output):
+    return [json.loads(line) for line in output.splitlines() if '"_aws"' in line]
+
+
+def emf_errors(record):
+    # The structure CloudWatch needs to extract metrics from a log line
+    errors = []
+    metadata = record.get("_aws", {})
+    if not isinstance(metadata.get("Timestamp"), int):
+        errors.append("_aws.Timestamp is not an integer")
+    for directive in metadata.get("CloudWatchMetrics") or [None]:
+        if not directive or not isinstance(directive.get("Namespace"), str):
+            errors.append("missing CloudWatchMetrics namespace")
+            continue
+        for dimension_set in directive.get("Dimensions", []):
+            if len(dimension_set) > 30:
+                errors.append("more than 30 dimensions")
+            for name in dimension_set:
+                if not isinstance(record.get(name), str) or not record[name]:
+                    errors.append(f"dimension {name} is not a non-empty string")
+        if len(directive.get("Metrics", [])) > 100:
+            errors.append("more than 100 metrics")
+        for metric in directive.get("Metrics", []):
+            value = record.get(metric["Name"])
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"metric {metric['Name']} has no numeric value")
+    return errors
+
+
+def run_trigger():
+    # Returns the stdout of the handler for an upload and for the crawler's
+    # completion event
+    os.environ.update(
+        GLUE_CRAWLER_NAME="crawler", GLUE_JOB_NAME="job", AWS_DEFAULT_REGION="us-east-1"
+    )
+    trigger_glue.get_settings.cache_clear()
+    glue = boto3.client("glue")
+    trigger_glue._clients["glue"] = glue
+    trigger_glue._crawler_state_cache.clear()
+
+    stubber = Stubber(glue)
+    stubber.add_response("get_crawler", {"Crawler": {"State": "READY"}})
+    stubber.add_response("start_crawler", {})
+    # Fails unless the run is started with the event's correlation ID
+    stubber.add_response(
+        "start_job_run",
+        {"JobRunId": "jr_stubbed"},
+        {"JobName": "job", "Arguments": {"--correlation_id": CRAWLER_EVENT["id"]}},
+    )
+
+    output = io.StringIO()
+    with stubber, contextlib.redirect_stdout(output):
+        trigger_glue.handler(UPLOAD_EVENT, None)
+        trigger_glue.handler(CRAWLER_EVENT, None)
+    return output.getvalue()
+
+
+def run_job(spark, workdir, rows, correlation_id):
+    generate(os.path.join(workdir, "lake"), rows, files=2, dirty_fraction=0.01)
+    options = dict(
+        glue_job.DEFAULT_OPTIONS,
+        processing_mode="manifest",
+        name="customers",
+        input_path=os.path.join(workdir, "lake") + "/",
+        output_path=os.path.join(workdir, "output") + "/",
+        manifest_path=os.path.join(workdir, "manifest") + "/",
+        rejected_path=os.path.join(workdir, "rejected") + "/",
+        column_types=COLUMN_TYPES,
+        correlation_id=correlation_id,
+    )
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        glue_job.run_table(LocalCatalog(spark), options)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the EMF metrics output")
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    records = emf_lines(run_trigger())
+
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+    glue_job.configure_session(spark)
+    workdir = tempfile.mkdtemp(prefix="metrics_output_")
+    records += emf_lines(run_job(spark, workdir, args.rows, CRAWLER_EVENT["id"]))
+    spark.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    failures = []
+    for record in records:
+        names = [m["Name"] for m in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]]
+        print(
+            f"{record['Component']:<10}{record.get('CorrelationId', ''):<40}"
+            + ", ".join(f"{name}={record[name]}" for name in names)
+        )
+        failures += emf_errors(record)
+
+    job_ids = {r["CorrelationId"] for r in records if r["Component"] == "glue_job"}
+    if job_ids != {CRAWLER_EVENT["id"]}:
+        failures.append(f"job records carry correlation IDs {job_ids}")
+    if len(records) != 3:
+        failures.append(f"expected 3 EMF lines, got {len(records)}")
+    if failures:
+        sys.exit("\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
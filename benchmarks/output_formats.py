@@ -0,0 +1,101 @@
+# Compares bytes written and write time of the Glue job's JSON and Parquet
+# output on a generated customers dataset, using a local Spark session.
+#
+#   python benchmarks/output_formats.py --rows 5000000
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "glue"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from glue_job import apply_column_types, parse_column_types, write_output  # noqa: E402
+
+# The Snowflake column list lives in modules/snowflake.py, which needs the
+# Pulumi SDKs to import, so the argument it renders is spelled out here
+COLUMN_TYPES = (
+    "customerid:NUMBER,namestyle:BOOLEAN,title:STRING,firstname:STRING,"
+    "middlename:STRING,lastname:STRING,suffix:STRING,companyname:STRING,"
+    "salesperson:STRING,emailaddress:STRING,phone:STRING,passwordhash:STRING,"
+    "passwordsalt:STRING,rowguid:STRING:strip_braces,modifieddate:TIMESTAMP"
+)
+
+
+def generate_customers(spark, rows):
+    # Same columns and string representation as data/customers.csv, i.e. what
+    # the crawler hands to the job before any casting
+    id_ = F.col("id")
+    return spark.range(1, rows + 1).select(
+        id_.cast("string").alias("CustomerID"),
+        F.lit("FALSE").alias("NameStyle"),
+        F.when(id_ % 2 == 0, "Mr.").otherwise("Ms.").alias("Title"),
+        F.concat(F.lit("First"), id_ % 5000).alias("FirstName"),
+        F.when(id_ % 3 == 0, "N.").alias("MiddleName"),
+        F.concat(F.lit("Last"), id_ % 20000).alias("LastName"),
+        F.when(id_ % 50 == 0, "Jr.").alias("Suffix"),
+        F.concat(F.lit("Company "), id_ % 1000).alias("CompanyName"),
+        F.concat(F.lit("adventure-works\\sales"), id_ % 10).alias("SalesPerson"),
+        F.concat(F.lit("customer"), id_, F.lit("@adventure-works.com")).alias(
+            "EmailAddress"
+        ),
+        F.format_string("%03d-555-%04d", id_ % 1000, id_ % 10000).alias("Phone"),
+        F.sha2(id_.cast("string"), 256).substr(1, 44).alias("PasswordHash"),
+        F.md5(id_.cast("string")).substr(1, 8).alias("PasswordSalt"),
+        F.concat(F.lit("{"), F.upper(F.expr("uuid()")), F.lit("}")).alias("rowguid"),
+        F.date_format(
+            F.timestamp_seconds(F.lit(1104537600) + (id_ % 30) * 86400),
+            "yyyy-MM-dd HH:mm:ss",
+        ).alias("ModifiedDate"),
+    )
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(
+            os.path.getsize(os.path.join(root, name))
+            for name in files
+            if not name.startswith((".", "_"))
+        )
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare JSON and Parquet output of the Glue job"
+    )
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--output-dir", default=None)
+    args = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+
+    # Materialise the input once so both formats time only the write
+    df, _ = apply_column_types(
+        generate_customers(spark, args.rows), parse_column_types(COLUMN_TYPES)
+    )
+    df = df.cache()
+    df.count()
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="output_formats_")
+    print(f"{'format':<10}{'rows':>12}{'MB written':>14}{'seconds':>10}")
+    for output_format in ("json", "parquet"):
+        path = os.path.join(output_dir, output_format)
+        start = time.perf_counter()
+        write_output(df, path, "overwrite", output_format)
+        elapsed = time.perf_counter() - start
+        size_mb = directory_size(path) / 1024 / 1024
+        print(f"{output_format:<10}{args.rows:>12}{size_mb:>14.1f}{elapsed:>10.2f}")
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
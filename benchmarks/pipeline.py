@@ -0,0 +1,269 @@
+# Runs the pipeline end to end on one machine and reports latency and
+# throughput per stage for datasets from benchmarks/generate_customers.py:
+#
+#   trigger   - lambda/trigger_glue.py's handler against moto S3 and Glue
+#   transform - glue/glue_job.py on a local Spark session, reading the data
+#               lake from a local directory
+#   load      - the job output loaded into DuckDB, standing in for Snowflake
+#
+#   python benchmarks/pipeline.py --rows 1000 100000 1000000 --output-format parquet
+#
+# Needs the packages in benchmarks/requirements.txt.
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import boto3
+import duckdb
+from moto import mock_aws
+from pyspark.sql import SparkSession
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "glue"))
+sys.path.insert(0, os.path.join(ROOT, "lambda"))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+
+import glue_job  # noqa: E402
+import trigger_glue  # noqa: E402
+from generate_customers import generate  # noqa: E402
+from output_formats import COLUMN_TYPES  # noqa: E402
+
+LAKE_BUCKET = "local-data-lake"
+DATABASE = "metadata_db"
+TABLE = "customers"
+JOB = "local-glue-job"
+CRAWLER = "local-crawler"
+
+DUCKDB_TYPES = {
+    "NUMBER": "BIGINT",
+    "BOOLEAN": "BOOLEAN",
+    "STRING": "VARCHAR",
+    "TIMESTAMP": "TIMESTAMP",
+}
+
+
+class LocalCatalog:
+    # Stand-in for glue_job.GlueCatalog that reads catalog tables as CSV
+    # from their local data lake directory
+    def __init__(self, spark, locations):
+        self.spark_session = spark
+        self.locations = locations
+
+    def read_table(self, options):
+        return self.spark_session.read.csv(
+            self.locations[options["table_name"]], header=True
+        )
+
+
+def csv_files(path):
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path) if name.endswith(".csv")
+    )
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+        if not name.startswith((".", "_"))
+    )
+
+
+def run_trigger(lake_dir):
+    # Returns the seconds the handler took, the input keys of the job run it
+    # started, mapped back to the local data lake, and its correlation ID
+    files = csv_files(os.path.join(lake_dir, TABLE))
+    with mock_aws():
+        s3 = boto3.client("s3")
+        glue = boto3.client("glue")
+        s3.create_bucket(Bucket=LAKE_BUCKET)
+        for path in files:
+            # The handler only reads the header, so moto holds the start of
+            # each object while the event carries its real size
+            with open(path, "rb") as source:
+                s3.put_object(
+                    Bucket=LAKE_BUCKET,
+                    Key=f"{TABLE}/{os.path.basename(path)}",
+                    Body=source.read(trigger_glue.HEADER_RANGE_BYTES),
+                )
+        with open(files[0]) as source:
+            header = source.readline().strip().lower().split(",")
+        glue.create_database(DatabaseInput={"Name": DATABASE})
+        glue.create_table(
+            DatabaseName=DATABASE,
+            TableInput={
+                "Name": TABLE,
+                "StorageDescriptor": {
+                    "Columns": [{"Name": name, "Type": "string"} for name in header]
+                },
+            },
+        )
+        glue.create_crawler(
+            Name=CRAWLER,
+            Role="local",
+            DatabaseName=DATABASE,
+            Targets={"S3Targets": [{"Path": f"s3://{LAKE_BUCKET}/"}]},
+        )
+        glue.create_job(
+            Name=JOB, Role="local", Command={"Name": "glueetl", "ScriptLocation": ""}
+        )
+
+        os.environ.update(
+            GLUE_CRAWLER_NAME=CRAWLER,
+            GLUE_JOB_NAME=JOB,
+            GLUE_DATABASE_NAME=DATABASE,
+            GLUE_TABLES=json.dumps([{"input_prefix": "", "table_name": TABLE}]),
+        )
+        trigger_glue._clients.clear()
+        trigger_glue._schema_cache.clear()
+        trigger_glue.get_settings.cache_clear()
+
+        event = {
+            "Records": [
+                {
+                    "eventSource": "aws:s3",
+                    "s3": {
+                        "bucket": {"name": LAKE_BUCKET},
+                        "object": {
+                            "key": f"{TABLE}/{os.path.basename(path)}",
+                            "size": os.path.getsize(path),
+                        },
+                    },
+                }
+                for path in files
+            ]
+        }
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = trigger_glue.handler(event, None)
+        elapsed = time.perf_counter() - start
+
+        if response.get("statusCode") != 200:
+            raise RuntimeError(f"The trigger did not start the job: {response}")
+        arguments = glue.get_job_runs(JobName=JOB)["JobRuns"][-1].get("Arguments", {})
+
+    input_keys = json.loads(arguments.get("--input_keys", "[]"))
+    input_keys = [
+        key.replace(f"s3://{LAKE_BUCKET}/", f"{lake_dir}/", 1) for key in input_keys
+    ]
+    return elapsed, input_keys, arguments.get("--correlation_id", "")
+
+
+def run_transform(spark, workdir, input_keys, output_format, correlation_id=""):
+    lake_dir = os.path.join(workdir, "lake")
+    output_dir = os.path.join(workdir, "output")
+    options = dict(
+        glue_job.DEFAULT_OPTIONS,
+        processing_mode="manifest",
+        output_format=output_format,
+        input_keys=json.dumps(input_keys) if input_keys else "",
+        correlation_id=correlation_id,
+        tables=json.dumps(
+            [
+                {
+                    "name": TABLE,
+                    "table_name": TABLE,
+                    "input_path": f"{lake_dir}/{TABLE}/",
+                    "output_path": f"{output_dir}/{TABLE}/",
+                    "manifest_path": f"{workdir}/manifest/{TABLE}/",
+                    "column_types": COLUMN_TYPES,
+                }
+            ]
+        ),
+    )
+    catalog = LocalCatalog(spark, {TABLE: f"{lake_dir}/{TABLE}/"})
+
+    start = time.perf_counter()
+    glue_job.run_tables(catalog, glue_job.table_options(options), 4)
+    return time.perf_counter() - start, directory_size(output_dir)
+
+
+def run_load(workdir, output_format):
+    columns = [item.split(":")[:2] for item in COLUMN_TYPES.split(",")]
+    output_dir = os.path.join(workdir, "output", TABLE)
+    connection = duckdb.connect()
+    connection.execute(
+        f"CREATE TABLE {TABLE} ("
+        + ", ".join(f"{name} {DUCKDB_TYPES[sf_type]}" for name, sf_type in columns)
+        + ")"
+    )
+
+    # Loads by column name, as the Snowpipe COPY statement does
+    names = ", ".join(name for name, _ in columns)
+    if output_format == "parquet":
+        source = f"read_parquet('{output_dir}/**/*.parquet', hive_partitioning = false)"
+    else:
+        types = ", ".join(
+            f"'{name}': '{DUCKDB_TYPES[sf_type]}'" for name, sf_type in columns
+        )
+        source = f"read_json('{output_dir}/*.json', columns = {{{types}}})"
+
+    start = time.perf_counter()
+    connection.execute(f"INSERT INTO {TABLE} SELECT {names} FROM {source}")
+    elapsed = time.perf_counter() - start
+    rows = connection.execute(f"SELECT count(*) FROM {TABLE}").fetchone()[0]
+    connection.close()
+    return elapsed, rows
+
+
+def report(stage, seconds, rows, size):
+    print(
+        f"  {stage:<10}{seconds:>10.3f}{rows / seconds:>14,.0f}"
+        f"{size / 1024 / 1024 / seconds:>10.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local end-to-end pipeline throughput")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--output-format", default="parquet")
+    args = parser.parse_args()
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "testing")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+    glue_job.configure_session(spark)
+
+    for rows in args.rows:
+        workdir = tempfile.mkdtemp(prefix="pipeline_")
+        lake_dir = os.path.join(workdir, "lake")
+        generate(os.path.join(lake_dir, TABLE), rows, files=args.files)
+        input_bytes = directory_size(lake_dir)
+
+        trigger_seconds, input_keys, correlation_id = run_trigger(lake_dir)
+        transform_seconds, output_bytes = run_transform(
+            spark, workdir, input_keys, args.output_format, correlation_id
+        )
+        load_seconds, loaded = run_load(workdir, args.output_format)
+        if loaded != rows:
+            raise RuntimeError(f"Loaded {loaded} of {rows} rows")
+
+        print(f"{rows:,} rows, {input_bytes / 1024 / 1024:.1f} MB of CSV")
+        print(f"  {'stage':<10}{'seconds':>10}{'rows/s':>14}{'MB/s':>10}")
+        report("trigger", trigger_seconds, rows, input_bytes)
+        report("transform", transform_seconds, rows, input_bytes)
+        report("load", load_seconds, rows, output_bytes)
+        report(
+            "total",
+            trigger_seconds + transform_seconds + load_seconds,
+            rows,
+            input_bytes,
+        )
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# Measures how many resources the Pulumi program declares and how long a
+# preview of it takes, by running __main__.py against Pulumi's mocks
+# (pulumi.runtime.set_mocks) with each resource's provider call taking
+# --latency-ms. Registrations whose inputs are resolved run at the same time,
+# as the engine's do, so the time is bounded by the longest chain of
+# resources waiting on each other's outputs, reported as steps. With
+# --baseline the same runs are made on a git revision of the program, e.g.
+# the commit before a change to the resource graph.
+#
+#   python benchmarks/pulumi_preview.py --baseline HEAD~1 --latency-ms 1000
+import argparse
+import asyncio
+import collections
+import json
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+PROJECT = "aws_etl_pipeline"
+
+# The settings the program requires, for a stack that deploys nowhere
+CONFIG = {
+    "aws_account_id": "123456789012",
+    "s3_bucket_name": "local-data-lake",
+    "output_bucket_name": "local-output",
+    "scripts_bucket_name": "local-scripts",
+    "environment": "dev",
+    "aws_glue_database_name": "metadata_db",
+    "snowflake_account": "account",
+    "snowflake_user": "user",
+    "snowflake_password": "password",
+}
+
+RESULT_PREFIX = "RESULT "
+
+
+def run_program(program_dir, latency_ms, config):
+    # Runs in a process of its own, the Pulumi runtime's state is global
+    import pulumi
+
+    os.chdir(program_dir)
+    sys.path.insert(0, program_dir)
+    os.environ["PULUMI_CONFIG"] = json.dumps(
+        {f"{PROJECT}:{key}": value for key, value in config.items()}
+        | {"aws:region": "us-east-1"}
+    )
+
+    registrations = []
+    resources = {}
+    lock = threading.Lock()
+
+    class Mocks(pulumi.runtime.Mocks):
+        def new_resource(self, args):
+            begin = time.perf_counter() - start
+            time.sleep(latency_ms / 1000)
+            with lock:
+                registrations.append((args.typ, begin, time.perf_counter() - start))
+                resources[args.name] = (args.typ, args.inputs)
+            outputs = dict(args.inputs)
+            outputs.setdefault("arn", f"arn:mock:{args.name}")
+            outputs.setdefault("name", args.name)
+            return f"{args.name}-id", outputs
+
+        def call(self, args):
+            return {}
+
+    # One thread per registration in flight, the engine does not cap them
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=256))
+    asyncio.set_event_loop(loop)
+    start = time.perf_counter()
+    pulumi.runtime.set_mocks(Mocks(), project=PROJECT, stack="dev", preview=True)
+    runpy.run_path(os.path.join(program_dir, "__main__.py"), run_name="__main__")
+    loop.run_until_complete(pulumi.runtime.stack.wait_for_rpcs())
+    elapsed = time.perf_counter() - start
+
+    # Registrations that had to wait for one another, from the first one on
+    # after the program's imports
+    first = min(begin for _, begin, _ in registrations)
+    last = max(end for _, _, end in registrations)
+    return {
+        "resources": len(registrations),
+        "types": collections.Counter(typ for typ, _, _ in registrations),
+        "steps": round((last - first) / (latency_ms / 1000)) if latency_ms else None,
+        "seconds": elapsed,
+        "inputs": resources,
+    }
+
+
+def export_revision(revision, directory):
+    archive = subprocess.run(
+        ["git", "archive", revision], cwd=ROOT, capture_output=True, check=True
+    ).stdout
+    subprocess.run(["tar", "-x", "-C", directory], input=archive, check=True)
+
+
+def measure(program_dir, args):
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--program-dir",
+        program_dir,
+        "--latency-ms",
+        str(args.latency_ms),
+    ]
+    for item in args.config:
+        command += ["--config", item]
+    output = subprocess.run(
+        command, capture_output=True, text=True, check=False
+    ).stdout.splitlines()
+    results = [line for line in output if line.startswith(RESULT_PREFIX)]
+    if not results:
+        sys.exit(f"The program in {program_dir} did not run:\n" + "\n".join(output))
+    return json.loads(results[-1][len(RESULT_PREFIX) :])
+
+
+def summary(label, result):
+    types = result["types"]
+    policies = sum(
+        count
+        for typ, count in types.items()
+        if typ.split(":")[-1] in ("Policy", "RolePolicy", "UserPolicy")
+    )
+    attachments = sum(
+        count for typ, count in types.items() if "PolicyAttachment" in typ
+    )
+    notifications = types.get("aws:s3/bucketNotification:BucketNotification", 0)
+    print(
+        f"{label:<14}{result['resources']:>10}{policies:>10}{attachments:>13}"
+        f"{notifications:>15}{result['steps']:>7}{result['seconds']:>9.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resources and preview time")
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--latency-ms", type=float, default=1000)
+    parser.add_argument(
+        "--config",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="stack setting, e.g. trigger_batching=true",
+    )
+    parser.add_argument("--program-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    config = dict(CONFIG, **dict(item.split("=", 1) for item in args.config))
+    if args.program_dir:
+        result = run_program(args.program_dir, args.latency_ms, config)
+        print(RESULT_PREFIX + json.dumps(result, default=str))
+        return
+
+    print(
+        f"{'program':<14}{'resources':>10}{'policies':>10}{'attachments':>13}"
+        f"{'notifications':>15}{'steps':>7}{'seconds':>9}"
+    )
+    if args.baseline:
+        workdir = tempfile.mkdtemp(prefix="pulumi_preview_")
+        try:
+            export_revision(args.baseline, workdir)
+            summary(args.baseline, measure(workdir, args))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    summary("working tree", measure(os.path.abspath(ROOT), args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# Measures what re-chunking a large gzip upload buys the Glue job. Gzips one
+# generated customers CSV into a local directory standing in for S3, with
+# per-request latency and per-connection bandwidth simulated, re-chunks it
+# with shared/rechunk.py for each number of parallel ranged GETs, then runs
+# the Glue job's read, casts and write on local Spark over the .csv.gz and
+# over the parts, reporting tasks and seconds. Fails if the two reads do not
+# yield the same rows.
+#
+#   python benchmarks/rechunk_benchmark.py --rows 2000000 --part-mb 32 --cores 4
+import argparse
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from pyspark.sql import SparkSession
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "glue"))
+sys.path.insert(0, os.path.join(ROOT, "shared"))
+
+import glue_job  # noqa: E402
+from generate_customers import generate  # noqa: E402
+from output_formats import COLUMN_TYPES  # noqa: E402
+from rechunk import DEFAULT_SETTINGS, rechunk_object, split_url  # noqa: E402
+
+
+class LocalS3:
+    # The calls rechunk_object makes, against files under root/<bucket>/<key>.
+    # Each request waits latency_ms before its first byte and then moves
+    # mb_per_second, roughly what one connection to S3 gets from EC2.
+    def __init__(self, root, latency_ms, mb_per_second):
+        self.root = root
+        self.latency = latency_ms / 1000
+        self.bytes_per_second = mb_per_second * 1024 * 1024
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def wait(self, size):
+        time.sleep(self.latency + size / self.bytes_per_second)
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": os.path.getsize(self.path(Bucket, Key))}
+
+    def get_object(self, Bucket, Key, Range=None):
+        with open(self.path(Bucket, Key), "rb") as source:
+            if Range:
+                start, end = Range[len("bytes=") :].split("-")
+                source.seek(int(start))
+                body = source.read(int(end) - int(start) + 1)
+            else:
+                body = source.read()
+        self.wait(len(body))
+        return {"Body": io.BytesIO(body), "ContentLength": len(body)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key):
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as target:
+            shutil.copyfileobj(Fileobj, target)
+        self.wait(os.path.getsize(path))
+
+
+def transform(spark, keys, workdir, label):
+    # The manifest processing mode's read, casts and write; returns seconds,
+    # tasks of the read and the write metrics
+    column_types = glue_job.parse_column_types(COLUMN_TYPES)
+    options = dict(
+        glue_job.DEFAULT_OPTIONS,
+        output_path=os.path.join(workdir, "output", label) + "/",
+        rejected_path=os.path.join(workdir, "rejected", label) + "/",
+        dedup_keys="customerid",
+        dedup_order="modifieddate",
+    )
+    start = time.perf_counter()
+    df = glue_job.read_csv(spark, keys, column_types)
+    tasks = df.rdd.getNumPartitions()
+    metrics = {}
+    glue_job.write_typed(df, column_types, options, "overwrite", None, metrics)
+    return time.perf_counter() - start, tasks, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-chunking of large gzip inputs")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--part-mb", type=int, default=32)
+    parser.add_argument("--range-mb", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--mb-per-second", type=float, default=90)
+    parser.add_argument("--cores", type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rechunk_")
+    s3 = LocalS3(workdir, args.latency_ms, args.mb_per_second)
+    (path, _, _), *_ = generate(os.path.join(workdir, "csv"), args.rows, files=1)
+    url = "s3://lake/customers/customers.csv.gz"
+    os.makedirs(os.path.dirname(s3.path(*split_url(url))))
+    with open(path, "rb") as source, gzip.open(s3.path(*split_url(url)), "wb") as gz:
+        shutil.copyfileobj(source, gz)
+    size = os.path.getsize(path)
+    compressed = s3.head_object(*split_url(url))["ContentLength"]
+    print(
+        f"{args.rows:,} rows, {size / 1024 / 1024:.0f} MB of CSV, "
+        f"{compressed / 1024 / 1024:.0f} MB gzipped ({size / compressed:.1f}x)"
+    )
+
+    print(f"{'workers':>8}{'seconds':>9}{'MB/s in':>9}{'parts':>7}")
+    for workers in args.workers:
+        shutil.rmtree(os.path.join(workdir, "staging"), ignore_errors=True)
+        settings = dict(
+            DEFAULT_SETTINGS,
+            range_bytes=args.range_mb * 1024 * 1024,
+            part_bytes=args.part_mb * 1024 * 1024,
+            max_workers=workers,
+        )
+        start = time.perf_counter()
+        result = rechunk_object(s3, url, "s3://staging/customers/", settings)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{workers:>8}{elapsed:>9.2f}{compressed / 1024 / 1024 / elapsed:>9.1f}"
+            f"{len(result['keys']):>7}"
+        )
+
+    spark = SparkSession.builder.master(f"local[{args.cores}]").getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+    glue_job.configure_session(spark)
+    spark.conf.set("spark.sql.session.timeZone", "UTC")
+    print(f"{'input':<10}{'tasks':>7}{'seconds':>9}{'rows out':>12}{'rejected':>10}")
+    runs = {}
+    for label, keys in (
+        ("gzip", [s3.path(*split_url(url))]),
+        ("parts", [s3.path(*split_url(key)) for key in result["keys"]]),
+    ):
+        elapsed, tasks, metrics = transform(spark, keys, workdir, label)
+        runs[label] = metrics
+        print(
+            f"{label:<10}{tasks:>7}{elapsed:>9.2f}{metrics['RowsOut']:>12,}"
+            f"{metrics['RowsRejected']:>10,}"
+        )
+    spark.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    counts = {
+        label: (m["RowsIn"], m["RowsOut"], m["RowsRejected"])
+        for label, m in runs.items()
+    }
+    if counts["gzip"] != counts["parts"]:
+        sys.exit(f"The parts do not read as the gzip file does: {counts}")
+
+
+if __name__ == "__main__":
+    main()
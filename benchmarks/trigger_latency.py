@@ -0,0 +1,117 @@
+# Measures the per-invocation latency of the trigger Lambda with boto3
+# clients and settings created on every invocation (the previous handler)
+# against the module-level clients and crawler state cache. Glue responses
+# are stubbed with botocore's Stubber, so only client-side cost is measured.
+#
+#   python benchmarks/trigger_latency.py --invocations 200
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+import boto3
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+
+import trigger_glue  # noqa: E402
+
+CRAWLER_EVENT = {"source": "aws.glue", "detail": {"crawlerName": "crawler"}}
+UPLOAD_EVENT = {
+    "Records": [
+        {
+            "eventSource": "aws:s3",
+            "s3": {"bucket": {"name": "lake"}, "object": {"key": "customers.csv"}},
+        }
+    ]
+}
+
+
+def stub_responses(stubber, count):
+    for _ in range(count):
+        stubber.add_response("get_crawler", {"Crawler": {"State": "READY"}})
+        stubber.add_response("start_crawler", {})
+        stubber.add_response("start_job_run", {"JobRunId": "jr_stubbed"})
+
+
+def per_invocation_clients():
+    # What the previous handler did on every invocation
+    glue_client = boto3.client("glue")
+    os.getenv("GLUE_CRAWLER_NAME")
+    os.getenv("GLUE_JOB_NAME")
+    with Stubber(glue_client) as stubber:
+        stub_responses(stubber, 1)
+        glue_client.get_crawler(Name="crawler")
+        glue_client.start_crawler(Name="crawler")
+        glue_client.start_job_run(JobName="job")
+
+
+def timed(function, invocations):
+    latencies = []
+    for _ in range(invocations):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{label:<34}{statistics.mean(latencies):>9.2f}"
+        f"{statistics.median(latencies):>9.2f}{p99:>9.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-invocation latency of the trigger Lambda with stubbed Glue"
+    )
+    parser.add_argument("--invocations", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("GLUE_CRAWLER_NAME", "crawler")
+    os.environ.setdefault("GLUE_JOB_NAME", "job")
+
+    print(f"{'':<34}{'mean ms':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    report("client per invocation", timed(per_invocation_clients, args.invocations))
+
+    # The first invocation of an execution environment creates the client
+    trigger_glue._clients.clear()
+    start = time.perf_counter()
+    glue_client = trigger_glue.get_client("glue")
+    print(
+        f"{'module client creation (once)':<34}{(time.perf_counter() - start) * 1000:>9.2f}"
+    )
+
+    with Stubber(glue_client) as stubber:
+        stub_responses(stubber, args.invocations * 2)
+
+        def warm_invocation():
+            trigger_glue.handler(UPLOAD_EVENT, None)
+            trigger_glue.handler(CRAWLER_EVENT, None)
+
+        report("module client, warm", timed(warm_invocation, args.invocations))
+
+    # A burst of uploads while the crawler runs only queries it once
+    trigger_glue._crawler_state_cache.clear()
+    with Stubber(glue_client) as stubber:
+        stubber.add_response("get_crawler", {"Crawler": {"State": "READY"}})
+        stubber.add_response("start_crawler", {})
+        report(
+            "module client, upload burst",
+            timed(lambda: trigger_glue.handler(UPLOAD_EVENT, None), args.invocations),
+        )
+
+
+if __name__ == "__main__":
+    main()
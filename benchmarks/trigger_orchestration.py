@@ -0,0 +1,143 @@
+# Simulates the trigger Lambda against a stubbed Glue API on a virtual clock
+# and reports, per crawler runtime, the end-to-end latency from upload to job
+# start and the billed Lambda time of the previous polling handler and the
+# event-driven one.
+#
+#   python benchmarks/trigger_orchestration.py --api-latency-ms 30
+import argparse
+import contextlib
+import io
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "shared"))
+
+import trigger_glue  # noqa: E402
+
+POLL_INTERVAL_SECONDS = 60
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class StubGlue:
+    # Crawler that runs for crawl_seconds once started; every call costs
+    # api_latency seconds of virtual time
+    def __init__(self, clock, crawl_seconds, api_latency):
+        self.clock = clock
+        self.crawl_seconds = crawl_seconds
+        self.api_latency = api_latency
+        self.crawl_started = None
+        self.job_started = None
+
+    def _call(self):
+        self.clock.sleep(self.api_latency)
+
+    def get_crawler(self, Name):
+        self._call()
+        running = (
+            self.crawl_started is not None
+            and self.clock.now < self.crawl_started + self.crawl_seconds
+        )
+        return {"Crawler": {"State": "RUNNING" if running else "READY"}}
+
+    def start_crawler(self, Name):
+        self._call()
+        self.crawl_started = self.clock.now
+
+    def start_job_run(self, JobName, Arguments=None):
+        self._call()
+        self.job_started = self.clock.now
+        return {"JobRunId": "jr_simulated"}
+
+
+def polling_handler(glue, clock):
+    # The previous handler, with the wait loop applied on every invocation as
+    # intended: start the crawler, poll it every minute, then start the job
+    glue.start_crawler(Name="crawler")
+    while glue.get_crawler(Name="crawler")["Crawler"]["State"] == "RUNNING":
+        clock.sleep(POLL_INTERVAL_SECONDS)
+    glue.start_job_run(JobName="job")
+
+
+def simulate_polling(crawl_seconds, api_latency):
+    clock = Clock()
+    glue = StubGlue(clock, crawl_seconds, api_latency)
+    polling_handler(glue, clock)
+    return glue.job_started, clock.now
+
+
+def simulate_event_driven(crawl_seconds, api_latency, event_delay):
+    clock = Clock()
+    glue = StubGlue(clock, crawl_seconds, api_latency)
+    trigger_glue._clients.update(glue=glue, s3=glue)
+    trigger_glue._crawler_state_cache.clear()
+    upload_event = {
+        "Records": [
+            {
+                "eventSource": "aws:s3",
+                "s3": {"bucket": {"name": "lake"}, "object": {"key": "a.csv"}},
+            }
+        ]
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        trigger_glue.handler(upload_event, None)
+    billed = clock.now
+
+    # EventBridge delivers the "Succeeded" state change once the crawler ends
+    clock.now = glue.crawl_started + crawl_seconds + event_delay
+    invoked = clock.now
+    crawler_event = {
+        "source": "aws.glue",
+        "detail": {"crawlerName": "crawler", "state": "Succeeded"},
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        trigger_glue.handler(crawler_event, None)
+    billed += clock.now - invoked
+    return glue.job_started, billed
+
+
+def billed_ms(seconds):
+    # Lambda bills per started millisecond
+    return math.ceil(seconds * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Latency and billed time of the trigger Lambda orchestration"
+    )
+    parser.add_argument("--api-latency-ms", type=float, default=30)
+    parser.add_argument("--event-delay-ms", type=float, default=500)
+    parser.add_argument(
+        "--crawl-seconds", type=int, nargs="+", default=[45, 90, 180, 600]
+    )
+    args = parser.parse_args()
+    api_latency = args.api_latency_ms / 1000
+    event_delay = args.event_delay_ms / 1000
+
+    os.environ.setdefault("GLUE_CRAWLER_NAME", "crawler")
+    os.environ.setdefault("GLUE_JOB_NAME", "job")
+    print(
+        f"{'crawl s':>8}{'poll latency s':>16}{'poll billed ms':>16}"
+        f"{'event latency s':>17}{'event billed ms':>17}"
+    )
+    for crawl_seconds in args.crawl_seconds:
+        poll_latency, poll_billed = simulate_polling(crawl_seconds, api_latency)
+        event_latency, event_billed = simulate_event_driven(
+            crawl_seconds, api_latency, event_delay
+        )
+        print(
+            f"{crawl_seconds:>8}{poll_latency:>16.1f}{billed_ms(poll_billed):>16}"
+            f"{event_latency:>17.1f}{billed_ms(event_billed):>17}"
+        )
+
+
+if __name__ == "__main__":
+    main()
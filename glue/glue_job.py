@@ -1,37 +1,1277 @@
+import re
 import sys
+import json
+import math
+import hashlib
+import datetime
+import time
+import uuid
 import logging
-from awsglue.transforms import *
-from awsglue.context import GlueContext
-from awsglue.job import Job
-from pyspark.context import SparkContext
-from awsglue.utils import getResolvedOptions
+import threading
+import boto3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pyspark import StorageLevel
+from pyspark.java_gateway import ensure_callback_server_started
+from pyspark.sql import Observation, Window
+from pyspark.sql import functions as F
+from pyspark.sql.types import StringType, StructField, StructType
+from inventory import PROCESSED, QUARANTINED, SKIPPED, DynamoInventory
+from metrics import new_correlation_id, span
+from rechunk import DEFAULT_SETTINGS as RECHUNK_DEFAULTS
+from rechunk import is_compressed, rechunk_object
 
 logging.basicConfig(level=logging.INFO)
 
-try:
+# Processing modes:
+#   full        - read the whole catalog table and overwrite the output
+#   incremental - read the catalog table through Glue job bookmarks and
+#                 append only the data that arrived since the last run
+#   manifest    - list the input path, skip the files already recorded in
+#                 the manifest and append only the new ones, or with an
+#                 inventory_table read the pending files from the inventory
+#   compact     - merge small files already sitting in the output path
+PROCESSING_MODES = ("full", "incremental", "manifest", "compact")
+
+OUTPUT_FORMATS = ("json", "parquet")
+
+# Snowflake column types (as declared in modules/snowflake.py) mapped to the
+# Spark types the output is cast to before it is written
+SPARK_TYPES = {
+    "NUMBER": "bigint",
+    "BOOLEAN": "boolean",
+    "TIMESTAMP": "timestamp",
+    "STRING": "string",
+}
+
+# Spellings accepted for BOOLEAN columns, compared trimmed and upper-cased
+TRUE_VALUES = ("TRUE", "T", "YES", "Y", "1")
+FALSE_VALUES = ("FALSE", "F", "NO", "N", "0")
+
+# Transforms a column can declare after its type, e.g. "rowguid:STRING:strip_braces"
+COLUMN_TRANSFORMS = {
+    "strip_braces": lambda column: F.when(
+        column.startswith("{") & column.endswith("}"),
+        column.substr(F.lit(2), F.length(column) - 2),
+    ).otherwise(column),
+}
+
+# Lines of the CSV input that do not parse into the declared columns
+CORRUPT_RECORD_COLUMN = "_corrupt_record"
+
+# Columns that failed to cast, set on the rejected rows
+REJECT_REASON_COLUMN = "reject_reason"
+
+# Formats the quality checks' patterns can name, matched against the whole
+# value. Any other pattern is taken as a regular expression of its own.
+QUALITY_PATTERNS = {
+    "email": r"^[^@\s]+@[^@\s]+\.[^@\s]+$",
+    "phone": r"^\+?[0-9][0-9 ().-]{5,23}$",
+    "guid": r"^[0-9A-Fa-f]{8}(-[0-9A-Fa-f]{4}){3}-[0-9A-Fa-f]{12}$",
+}
+
+# Parquet output is partitioned by the day each record was last modified
+PARTITION_COLUMN = "modified_date"
+
+# Output bytes per byte of CSV input, used to turn the input size into a
+# number of output files. Measured with benchmarks/file_sizes.py.
+OUTPUT_SIZE_RATIO = {"json": 1.8, "parquet": 0.35}
+
+# Longest wait for Spark to report the counts of a finished write, see
+# WriteStatistics
+WRITE_STATISTICS_TIMEOUT_SECONDS = 30
+
+# Data lake files the manifest processing mode picks up, plain and gzip CSV
+INPUT_SUFFIXES = (".csv", ".csv.gz")
+
+# Where the dated bucket layout puts a table's inputs, relative to its input
+# path: raw/<entity>/dt=YYYY-MM-DD/, optionally in subfolders
+DATE_PARTITION = re.compile(r"dt=\d{4}-\d{2}-\d{2}/.+")
+
+# Large gzip files re-chunked at the same time on the driver, each takes a
+# core to decompress
+RECHUNK_PARALLEL_FILES = 4
+
+# Characters of a file's error kept in the error manifest
+ERROR_MESSAGE_CHARS = 2000
+
+# A run fails instead of quarantining its files when at least this many
+# failed, all of them, with the same exception class: a cause in the job or
+# its environment rather than in the files
+SYSTEMIC_FAILURE_MIN_FILES = 3
+
+# Output files below this fraction of the target size are merged by the
+# compaction pass
+SMALL_FILE_FRACTION = 0.5
+
+DEFAULT_OPTIONS = {
+    "processing_mode": "full",
+    "database": "metadata_db",
+    "table_name": "data_lake_costumers",
+    "input_path": "",
+    "output_path": "s3://customers-output-bucket/output/",
+    "manifest_path": "",
+    "output_format": "json",
+    "column_types": "",
+    "target_file_size_mb": "128",
+    "compaction_temp_path": "",
+    "input_keys": "",
+    "transformation_ctx": "datasource0",
+    "name": "default",
+    "tables": "",
+    "max_parallel_tables": "4",
+    "rejected_path": "",
+    "dedup_keys": "",
+    "dedup_order": "",
+    "drop_columns": "",
+    "row_filter": "",
+    "push_down_predicate": "",
+    "correlation_id": "",
+    "rechunk_min_bytes": "0",
+    "rechunk_part_mb": "128",
+    "staging_path": "",
+    "quarantine_path": "",
+    "inventory_table": "",
+    "bucket_layout": "flat",
+    "input_lookback_days": "0",
+    "quality": "",
+    "quality_path": "",
+}
+
+MANIFEST_SCHEMA = "key STRING, size LONG, modified LONG, processed_at TIMESTAMP"
+
+# Records of the error manifest, next to the files quarantined by a run
+ERROR_MANIFEST_SCHEMA = (
+    "key STRING, size LONG, modified LONG, quarantined_key STRING, error STRING, "
+    "correlation_id STRING"
+)
+
+
+def resolve_optional_args(argv, defaults):
+    # getResolvedOptions fails on missing arguments, so the optional ones are
+    # picked up by hand and fall back to their defaults
+    resolved = dict(defaults)
+    for i, arg in enumerate(argv):
+        if not arg.startswith("--"):
+            continue
+        name, _, value = arg[2:].partition("=")
+        if name not in defaults:
+            continue
+        if not value and i + 1 < len(argv):
+            value = argv[i + 1]
+        resolved[name] = value
+    return resolved
+
+
+def _hadoop_path(spark, path):
+    jvm = spark.sparkContext._jvm
+    hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+    fs = hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    return fs, hadoop_path
+
+
+def list_input_files(spark, input_path, suffix=".csv"):
+    # Uses the Hadoop FileSystem API so the same code lists s3:// prefixes on
+    # Glue and plain directories on a local Spark session
+    fs, path = _hadoop_path(spark, input_path)
+    if not fs.exists(path):
+        return []
+
+    files = []
+    iterator = fs.listFiles(path, True)
+    while iterator.hasNext():
+        status = iterator.next()
+        key = status.getPath().toString()
+        if key.endswith(suffix):
+            files.append(
+                {
+                    "key": key,
+                    "size": status.getLen(),
+                    "modified": status.getModificationTime(),
+                }
+            )
+    return files
+
+
+def dated_input_paths(input_path, lookback_days, today=None):
+    # The date partitions of the last lookback_days days, today's first
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    return [
+        f"{input_path}dt={today - datetime.timedelta(days=days):%Y-%m-%d}/"
+        for days in range(lookback_days)
+    ]
+
+
+def in_dated_layout(key, input_path):
+    return key.startswith(input_path) and bool(
+        DATE_PARTITION.fullmatch(key[len(input_path) :])
+    )
+
+
+def describe_input_files(spark, keys):
+    # Same records as list_input_files for a known list of objects, e.g. the
+    # batch of new keys handed over by the trigger Lambda
+    files = []
+    for key in keys:
+        fs, path = _hadoop_path(spark, key)
+        if not fs.exists(path):
+            logging.warning("Input file %s no longer exists", key)
+            continue
+        status = fs.getFileStatus(path)
+        files.append(
+            {
+                "key": status.getPath().toString(),
+                "size": status.getLen(),
+                "modified": status.getModificationTime(),
+            }
+        )
+    return files
+
+
+def load_manifest(spark, manifest_path):
+    fs, path = _hadoop_path(spark, manifest_path)
+    if not fs.exists(path):
+        return set()
+
+    rows = (
+        spark.read.schema(MANIFEST_SCHEMA)
+        .json(manifest_path)
+        .select("key", "size", "modified")
+        .collect()
+    )
+    return {(row.key, row.size, row.modified) for row in rows}
+
+
+def select_new_files(files, manifest):
+    # A file is identified by key, size and modification time, so an object
+    # re-uploaded under the same key is picked up again
+    return [f for f in files if (f["key"], f["size"], f["modified"]) not in manifest]
+
+
+def record_manifest(spark, manifest_path, files):
+    manifest = spark.createDataFrame(
+        [(f["key"], f["size"], f["modified"]) for f in files],
+        "key STRING, size LONG, modified LONG",
+    ).withColumn("processed_at", F.current_timestamp())
+    manifest.coalesce(1).write.mode("append").json(manifest_path)
+
+
+def parse_column_types(value):
+    # "customerid:NUMBER,...,rowguid:STRING:strip_braces,..." as rendered by
+    # the Pulumi program, in the order of the CSV columns
+    if not value:
+        return {}
+    column_types = {}
+    for item in value.split(","):
+        name, _, spec = item.partition(":")
+        sf_type, _, transform = spec.partition(":")
+        if transform and transform not in COLUMN_TRANSFORMS:
+            raise ValueError(f"Unknown transform {transform} of column {name}")
+        column_types[name.strip().lower()] = {
+            "type": sf_type.strip().upper(),
+            "transform": transform or None,
+        }
+    return column_types
+
+
+def configure_session(spark):
+    # Spark stops flagging CSV lines with too few or too many fields once the
+    # columns a table drops are pruned from the parse, and loads them with
+    # nulls instead of rejecting them. The parser's pruning is a session-wide
+    # setting, so it is turned off once here rather than by each table's read,
+    # which run concurrently. Dropped columns are still left out of everything
+    # after the parse.
+    spark.conf.set("spark.sql.csv.parser.columnPruning.enabled", False)
+    # Counts the files and bytes of each write, see write_statistics
+    ensure_callback_server_started(spark.sparkContext._gateway)
+    statistics = WriteStatistics()
+    spark._jsparkSession.listenerManager().register(statistics)
+    _write_statistics[spark.sparkContext.applicationId] = statistics
+
+
+class WriteStatistics:
+    # Files and bytes of the session's file writes as Spark counts them while
+    # committing a write (numFiles and numOutputBytes of the write command),
+    # by output path. Spark reports each finished query to its listeners on a
+    # thread of its own, after save() returns, so a write waits for its own.
+
+    class Java:
+        implements = ["org.apache.spark.sql.util.QueryExecutionListener"]
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._writes = {}
+
+    def expect(self, path):
+        # Called before the write, so that only its report is kept
+        with self._condition:
+            self._writes[path] = None
+
+    def wait(self, path, timeout=WRITE_STATISTICS_TIMEOUT_SECONDS):
+        with self._condition:
+            self._condition.wait_for(lambda: self._writes.get(path), timeout)
+            return self._writes.pop(path, None)
+
+    def onSuccess(self, funcName, qe, durationNs):
+        plan = qe.executedPlan()
+        # Writes of shuffled rows are planned under adaptive execution
+        if plan.getClass().getSimpleName() == "AdaptiveSparkPlanExec":
+            plan = plan.executedPlan()
+        if plan.getClass().getSimpleName() != "DataWritingCommandExec":
+            return
+        command = plan.cmd()
+        if command.getClass().getSimpleName() != "InsertIntoHadoopFsRelationCommand":
+            return
+        path = command.outputPath().toString()
+        with self._condition:
+            if path in self._writes:
+                metrics = command.metrics()
+                self._writes[path] = {
+                    "files": metrics.apply("numFiles").value(),
+                    "bytes": metrics.apply("numOutputBytes").value(),
+                }
+                self._condition.notify_all()
+
+    def onFailure(self, funcName, qe, exception):
+        pass
+
+
+_write_statistics = {}
+
+
+def write_statistics(spark, output_path, write):
+    # Calls write and returns the files and bytes it wrote, or None if the
+    # session was not set up with configure_session or Spark did not report
+    # them in time. Writes of concurrent runs to the same path are not
+    # counted, unlike with a listing of the path.
+    statistics = _write_statistics.get(spark.sparkContext.applicationId)
+    if statistics is None:
+        write()
+        return None
+    fs, path = _hadoop_path(spark, output_path)
+    path = fs.makeQualified(path).toString()
+    statistics.expect(path)
+    write()
+    counts = statistics.wait(path)
+    if counts is None:
+        logging.warning("Spark did not report the files written to %s", output_path)
+    return counts
+
+
+def read_csv(spark, keys, column_types):
+    reader = spark.read.option("header", True)
+    if column_types:
+        # The declared columns are read as strings instead of inferring a
+        # schema, and lines that do not parse into them are kept aside (see
+        # configure_session)
+        schema = StructType(
+            [StructField(name, StringType()) for name in column_types]
+            + [StructField(CORRUPT_RECORD_COLUMN, StringType())]
+        )
+        # A file whose header names other columns, or the same ones in another
+        # order, fails the read instead of being loaded into the wrong columns
+        reader = (
+            reader.schema(schema)
+            .option("enforceSchema", False)
+            .option("mode", "PERMISSIVE")
+            .option("columnNameOfCorruptRecord", CORRUPT_RECORD_COLUMN)
+        )
+    return reader.csv(keys)
+
+
+def project_columns(df, options):
+    # Drops the table's excluded columns and the rows outside its filter
+    # right after the read, before casting or any shuffle. Spark leaves the
+    # dropped columns out of the scan's output and pushes the filter into it;
+    # the CSV parser still splits every field, see configure_session.
+    drop_columns = {c.strip().lower() for c in options["drop_columns"].split(",")}
+    df = df.select(
+        [F.col(f"`{name}`") for name in df.columns if name.lower() not in drop_columns]
+    )
+    if options["row_filter"]:
+        df = df.filter(F.expr(options["row_filter"]))
+    return df
+
+
+def cast_column(column, sf_type, source_type):
+    # Native column expressions only, so casting runs in the JVM rather than
+    # shipping rows to Python
+    spark_type = SPARK_TYPES.get(sf_type, "string")
+    if sf_type == "STRING" or source_type == spark_type:
+        return column.cast(spark_type)
+
+    value = F.trim(column.cast("string"))
+    if sf_type == "BOOLEAN":
+        value = F.upper(value)
+        return F.when(value.isin(*TRUE_VALUES), True).when(
+            value.isin(*FALSE_VALUES), False
+        )
+    # Timestamps are parsed by the cast itself, which takes "yyyy-MM-dd",
+    # "yyyy-MM-dd HH:mm:ss" and a "T" separator, with fractional seconds, and
+    # yields null for anything else rather than failing like to_timestamp
+    # does on strings the pre-3.0 parser accepted
+    return value.cast(spark_type)
+
+
+def apply_column_types(df, column_types):
+    # Lower-cases the column names to match the Snowflake table and casts the
+    # declared columns, leaving undeclared ones as they are. Returns the typed
+    # rows and, separately, the rows with a value that did not cast or a line
+    # that did not parse, with their original values and a reject_reason.
+    if not column_types:
+        return df, None
+
+    typed = []
+    raw = {}
+    for name in df.columns:
+        if name == CORRUPT_RECORD_COLUMN:
+            continue
+        source = F.col(f"`{name}`")
+        spec = column_types.get(name.lower())
+        if not spec:
+            typed.append(source.alias(name.lower()))
+            continue
+        column = cast_column(
+            source, spec["type"], df.schema[name].dataType.simpleString()
+        )
+        if spec["transform"]:
+            column = COLUMN_TRANSFORMS[spec["transform"]](column)
+        typed.append(column.alias(name.lower()))
+        if spec["type"] != "STRING":
+            raw[name.lower()] = source.cast("string").alias(f"_raw_{name.lower()}")
+
+    corrupt = []
+    if CORRUPT_RECORD_COLUMN in df.columns:
+        corrupt = [F.col(CORRUPT_RECORD_COLUMN)]
+    staged = df.select(*typed, *raw.values(), *corrupt)
+
+    # A value is rejected when it was set but its cast came out null
+    checks = [
+        F.when(
+            F.col(f"_raw_{name}").isNotNull()
+            & (F.trim(F.col(f"_raw_{name}")) != "")
+            & F.col(name).isNull(),
+            F.lit(name),
+        )
+        for name in raw
+    ]
+    if corrupt:
+        checks.insert(
+            0, F.when(F.col(CORRUPT_RECORD_COLUMN).isNotNull(), F.lit("malformed"))
+        )
+    staged = staged.withColumn(REJECT_REASON_COLUMN, F.concat_ws(",", *checks))
+
+    names = staged.columns[: len(typed)]
+    valid = staged.filter(F.col(REJECT_REASON_COLUMN) == "").select(*names)
+    rejected = staged.filter(F.col(REJECT_REASON_COLUMN) != "").select(
+        *[
+            (
+                F.col(f"_raw_{name}").alias(name)
+                if name in raw
+                else F.col(name).cast("string")
+            )
+            for name in names
+        ],
+        # Renamed so JSON readers do not take it for their own corrupt
+        # record column
+        *[column.alias("source_line") for column in corrupt],
+        REJECT_REASON_COLUMN,
+    )
+    return valid, rejected
+
+
+def write_rejected(rejected, rejected_path):
+    # Rejected rows are set aside instead of failing the run
+    if rejected is None:
+        return 0
+    count = rejected.count()
+    if not count:
+        return 0
+    if rejected_path:
+        rejected.withColumn("rejected_at", F.current_timestamp()).coalesce(
+            1
+        ).write.mode("append").json(rejected_path)
+        logging.warning("Wrote %d rejected rows to %s", count, rejected_path)
+    else:
+        logging.warning("Dropped %d rejected rows, no rejected_path is set", count)
+    return count
+
+
+def quality_expressions(df, patterns):
+    # Aggregates of every column for one pass over the rows: non-null and
+    # approximate distinct counts, min and max, and for the columns with a
+    # pattern the number of non-null values that match it
+    expressions = [F.count(F.lit(1)).alias("rows")]
+    for i, name in enumerate(df.columns):
+        column = F.col(f"`{name}`")
+        expressions += [
+            F.count(column).alias(f"{i}_values"),
+            F.approx_count_distinct(column).alias(f"{i}_distinct"),
+            F.min(column).cast("string").alias(f"{i}_min"),
+            F.max(column).cast("string").alias(f"{i}_max"),
+        ]
+        if name in patterns:
+            pattern = QUALITY_PATTERNS.get(patterns[name], patterns[name])
+            expressions.append(
+                F.count(F.when(column.cast("string").rlike(pattern), True)).alias(
+                    f"{i}_matches"
+                )
+            )
+    return expressions
+
+
+def _threshold(thresholds, name):
+    # A column's own threshold, or the "*" one that applies to all columns
+    return thresholds.get(name, thresholds.get("*"))
+
+
+def check_quality(df, quality):
+    # Profiles the rows in a single aggregation, on a sample when
+    # sample_fraction is below 1, and checks the profile against the
+    # thresholds of the table's quality option. Returns the report with its
+    # violations; the batch is quarantined when there are any.
+    patterns = {k.lower(): v for k, v in quality.get("patterns", {}).items()}
+    fraction = float(quality.get("sample_fraction", 1))
+    if fraction < 1:
+        df = df.sample(fraction=fraction, seed=0)
+    row = df.agg(*quality_expressions(df, patterns)).first()
+
+    rows = row["rows"]
+    columns = {}
+    violations = []
+    for i, name in enumerate(df.columns):
+        values = row[f"{i}_values"]
+        profile = {
+            "null_rate": round(1 - values / rows, 6) if rows else 0.0,
+            "distinct": row[f"{i}_distinct"],
+            "min": row[f"{i}_min"],
+            "max": row[f"{i}_max"],
+        }
+        if name in patterns:
+            profile["conformance"] = (
+                round(row[f"{i}_matches"] / values, 6) if values else 1.0
+            )
+        columns[name] = profile
+
+        checks = [
+            ("max_null_rate", "null_rate", lambda v, t: v > t),
+            ("min_conformance", "conformance", lambda v, t: v < t),
+        ]
+        for option, measure, breached in checks:
+            threshold = _threshold(quality.get(option, {}), name)
+            if threshold is not None and measure in profile:
+                if breached(profile[measure], threshold):
+                    violations.append(
+                        f"{name} {measure} {profile[measure]} "
+                        f"{'above' if option.startswith('max') else 'below'} "
+                        f"{threshold}"
+                    )
+        threshold = _threshold(quality.get("min_distinct_ratio", {}), name)
+        if threshold is not None and rows and profile["distinct"] / rows < threshold:
+            violations.append(
+                f"{name} distinct ratio {profile['distinct'] / rows:.4f} below "
+                f"{threshold}"
+            )
+    if rows < int(quality.get("min_rows", 0)):
+        violations.append(f"{rows} rows below {quality['min_rows']}")
+
+    return {
+        "rows": rows,
+        "sample_fraction": fraction,
+        "columns": columns,
+        "violations": violations,
+    }
+
+
+def write_quality_report(spark, quality_path, batch_id, report):
+    # One small JSON file per batch, outside the output prefix Snowflake loads
+    if not quality_path:
+        return None
+    fs, path = _hadoop_path(spark, f"{quality_path}{batch_id}.json")
+    stream = fs.create(path, True)
+    try:
+        stream.write(bytearray(json.dumps(report, default=str).encode("utf-8")))
+    finally:
+        stream.close()
+    return path.toString()
+
+
+def output_file_count(input_bytes, target_bytes, output_format="json"):
+    estimated = input_bytes * OUTPUT_SIZE_RATIO.get(output_format, 1.0)
+    return max(1, math.ceil(estimated / target_bytes))
+
+
+def size_output(df, num_files, partitioned=False):
+    # Range partitioning on the partition column keeps each day in as few
+    # tasks as possible, so a day is written as a handful of files close to
+    # the target size instead of one small file per task. The hash of the
+    # row orders the rows within a day, so that a day larger than the target
+    # is split across tasks rather than written as one file by one task.
+    if partitioned:
+        row_hash = F.xxhash64(*[F.col(f"`{name}`") for name in df.columns])
+        return df.repartitionByRange(num_files, F.col(PARTITION_COLUMN), row_hash)
+    if num_files < df.rdd.getNumPartitions():
+        return df.coalesce(num_files)
+    return df.repartition(num_files)
+
+
+def write_output(df, output_path, mode, output_format="json", num_files=None):
+    partitioned = output_format == "parquet"
+    if partitioned:
+        df = df.withColumn(PARTITION_COLUMN, F.to_date(F.col("modifieddate")))
+    if num_files:
+        df = size_output(df, num_files, partitioned)
+
+    if partitioned:
+        writer = (
+            df.write.mode(mode)
+            .partitionBy(PARTITION_COLUMN)
+            .option("compression", "snappy")
+        )
+    else:
+        writer = df.write.mode(mode)
+    writer.format(output_format).save(output_path)
+
+
+def deduplicate(df, keys, order_column=None):
+    # Keeps one row per key within the batch, the one with the latest
+    # order_column when given. Rows already loaded by earlier runs are
+    # handled by the MERGE loading mode in Snowflake.
+    if not keys:
+        return df
+    if not order_column:
+        return df.dropDuplicates(keys)
+    window = Window.partitionBy(*keys).orderBy(F.col(order_column).desc_nulls_last())
+    return (
+        df.withColumn("_row_number", F.row_number().over(window))
+        .filter(F.col("_row_number") == 1)
+        .drop("_row_number")
+    )
+
+
+def write_typed(df, column_types, options, mode, num_files=None, metrics=None):
+    # Row, file and byte counts of the write are added to metrics, if given
+    quality = json.loads(options["quality"] or "{}") or None
+    if column_types or quality is not None:
+        # Both outputs, and the quality checks, come from one read of the input
+        df.persist(StorageLevel.MEMORY_AND_DISK)
+
+    # Rows are counted by observing the writes rather than by extra passes.
+    # The input is observed above the cache, so its count is reported by
+    # whichever write reads it first.
+    rows_in, rows_out = Observation(), Observation()
+    valid, rejected = apply_column_types(
+        df.observe(rows_in, F.count(F.lit(1)).alias("rows")), column_types
+    )
+    output_path = options["output_path"]
+    quarantined = False
+    try:
+        if quality is not None:
+            # One aggregation over the cached rows before any of them is
+            # written, so a batch that fails its checks never reaches the
+            # output Snowflake loads
+            start = time.perf_counter()
+            batch_id = f"{options['correlation_id'] or 'run'}-{uuid.uuid4().hex[:8]}"
+            report = check_quality(valid, quality)
+            quarantined = bool(report["violations"])
+            if quarantined:
+                output_path = f"{options['quarantine_path']}batches/{batch_id}/"
+                logging.error(
+                    "Batch %s of %s failed its quality checks, writing it to %s: %s",
+                    batch_id,
+                    options["name"],
+                    output_path,
+                    "; ".join(report["violations"]),
+                )
+            report.update(
+                table=options["name"],
+                correlation_id=options["correlation_id"],
+                quarantined_path=output_path if quarantined else None,
+                checked_at=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            )
+            write_quality_report(
+                df.sparkSession, options["quality_path"], batch_id, report
+            )
+            if metrics is not None:
+                metrics.update(
+                    QualityMilliseconds=round((time.perf_counter() - start) * 1000, 3),
+                    BatchesQuarantined=int(quarantined),
+                )
+
+        valid = deduplicate(
+            valid,
+            [key for key in options["dedup_keys"].split(",") if key],
+            options["dedup_order"],
+        ).observe(rows_out, F.count(F.lit(1)).alias("rows"))
+        written = write_statistics(
+            df.sparkSession,
+            output_path,
+            lambda: write_output(
+                valid, output_path, mode, options["output_format"], num_files
+            ),
+        )
+        rejected_rows = write_rejected(rejected, options["rejected_path"])
+    finally:
+        df.unpersist()
+
+    if metrics is not None:
+        # A quarantined batch adds nothing to the output Snowflake loads
+        rows_written = rows_out.get["rows"]
+        if quarantined:
+            rows_written, written = 0, {"files": 0, "bytes": 0}
+        metrics.update(
+            RowsIn=rows_in.get["rows"],
+            RowsOut=rows_written,
+            RowsRejected=rejected_rows,
+        )
+        if written is not None:
+            metrics.update(FilesWritten=written["files"], BytesWritten=written["bytes"])
+
+
+def _target_bytes(options):
+    return int(float(options["target_file_size_mb"]) * 1024 * 1024)
+
+
+def compact_output(spark, output_path, temp_path, target_bytes, output_format="json"):
+    # Snowpipe loads every new object it is notified about, so compacting
+    # files it has already loaded loads their rows again unless the table is
+    # loaded with a deduplicating MERGE. Compacted files are written to
+    # temp_path, which must be outside the bucket Snowpipe watches.
+    suffix = ".parquet" if output_format == "parquet" else ".json"
+    directories = {}
+    for f in list_input_files(spark, output_path, suffix=suffix):
+        directories.setdefault(f["key"].rsplit("/", 1)[0], []).append(f)
+
+    jvm = spark.sparkContext._jvm
+    conf = spark.sparkContext._jsc.hadoopConfiguration()
+    compacted = 0
+    for directory, files in sorted(directories.items()):
+        small_files = [
+            f for f in files if f["size"] < target_bytes * SMALL_FILE_FRACTION
+        ]
+        num_files = max(
+            1, math.ceil(sum(f["size"] for f in small_files) / target_bytes)
+        )
+        if len(small_files) < 2 or num_files >= len(small_files):
+            continue
+
+        staging = f"{temp_path.rstrip('/')}/{uuid.uuid4()}"
+        df = spark.read.format(output_format).load([f["key"] for f in small_files])
+        # The small files may be read into fewer partitions than num_files
+        writer = size_output(df, num_files).write.mode("overwrite")
+        if output_format == "parquet":
+            writer = writer.option("compression", "snappy")
+        writer.format(output_format).save(staging)
+
+        # Move the merged files in first and only then drop the originals, so
+        # an interrupted pass leaves duplicates rather than losing rows
+        staging_fs, _ = _hadoop_path(spark, staging)
+        output_fs, _ = _hadoop_path(spark, directory)
+        for f in list_input_files(spark, staging, suffix=suffix):
+            source = jvm.org.apache.hadoop.fs.Path(f["key"])
+            target = jvm.org.apache.hadoop.fs.Path(f"{directory}/{source.getName()}")
+            jvm.org.apache.hadoop.fs.FileUtil.copy(
+                staging_fs, source, output_fs, target, True, conf
+            )
+        for f in small_files:
+            output_fs.delete(jvm.org.apache.hadoop.fs.Path(f["key"]), False)
+        staging_fs.delete(jvm.org.apache.hadoop.fs.Path(staging), True)
+
+        logging.info(
+            "Compacted %d files in %s into %d", len(small_files), directory, num_files
+        )
+        compacted += len(small_files)
+    return compacted
+
+
+def rechunk_inputs(files, options, staging, metrics=None):
+    # Replaces the gzip files from rechunk_min_bytes up by uncompressed parts
+    # under staging, so Spark splits them across executors instead of reading
+    # each on a single core. Returns one {"file", "keys", "bytes"} input per
+    # file to read, and (file, error) for the files that failed to re-chunk.
+    large = []
+    if staging:
+        large = [
+            f
+            for f in files
+            if is_compressed(f["key"])
+            and f["size"] >= int(options["rechunk_min_bytes"])
+        ]
+    inputs = [
+        {"file": f, "keys": [f["key"]], "bytes": f["size"]}
+        for f in files
+        if f not in large
+    ]
+    if not large:
+        return inputs, []
+
+    settings = dict(
+        RECHUNK_DEFAULTS, part_bytes=int(options["rechunk_part_mb"]) * 1024 * 1024
+    )
+    s3_client = boto3.client("s3")
+
+    def rechunk(f):
+        # Each file gets a folder of its own, named after its whole key, as
+        # uploads of the same name under different prefixes (one per day in
+        # the dated layout) would otherwise overwrite each other's parts
+        folder = f"{staging}{hashlib.sha1(f['key'].encode()).hexdigest()}/"
+        try:
+            return f, rechunk_object(s3_client, f["key"], folder, settings), None
+        except Exception as e:
+            return f, None, error_message(e)
+
+    start = time.perf_counter()
+    failures = []
+    with ThreadPoolExecutor(max_workers=RECHUNK_PARALLEL_FILES) as pool:
+        for f, result, error in pool.map(rechunk, large):
+            if error:
+                logging.error("Could not re-chunk %s: %s", f["key"], error)
+                failures.append((f, error))
+                continue
+            inputs.append({"file": f, "keys": result["keys"], "bytes": result["bytes"]})
+    logging.info("Re-chunked %d gzip files", len(large) - len(failures))
+    if metrics is not None:
+        metrics.update(
+            FilesRechunked=len(large) - len(failures),
+            RechunkedBytes=sum(f["size"] for f in large),
+            RechunkMilliseconds=round((time.perf_counter() - start) * 1000, 3),
+        )
+    return inputs, failures
+
+
+def error_message(error):
+    # The root cause of a Spark error, e.g. "java.io.EOFException: Unexpected
+    # end of input stream", rather than the Py4J call it surfaced through
+    cause = getattr(error, "java_exception", None)
+    if cause is None:
+        return f"{type(error).__name__}: {error}"[:ERROR_MESSAGE_CHARS]
+    while cause.getCause() is not None:
+        cause = cause.getCause()
+    return cause.toString()[:ERROR_MESSAGE_CHARS]
+
+
+def systemic_failure(files, failures):
+    # Errors read "java.io.EOFException: Unexpected end of input stream"
+    classes = {error.split(":", 1)[0] for _, error in failures}
+    return (
+        len(failures) == len(files) >= SYSTEMIC_FAILURE_MIN_FILES and len(classes) == 1
+    )
+
+
+def write_inputs(spark, inputs, column_types, options, metrics=None):
+    keys = [key for i in inputs for key in i["keys"]]
+    df = project_columns(read_csv(spark, keys, column_types), options)
+    num_files = output_file_count(
+        sum(i["bytes"] for i in inputs),
+        _target_bytes(options),
+        options["output_format"],
+    )
+    write_typed(df, column_types, options, "append", num_files, metrics)
+
+
+def delete_path(spark, path):
+    fs, hadoop_path = _hadoop_path(spark, path)
+    fs.delete(hadoop_path, True)
+
+
+def move_output(spark, source, target):
+    # Moves the files written under source to the same paths under target,
+    # renamed within a file system and copied across them
+    jvm = spark.sparkContext._jvm
+    conf = spark.sparkContext._jsc.hadoopConfiguration()
+    source_fs, source_path = _hadoop_path(spark, source)
+    target_fs, _ = _hadoop_path(spark, target)
+    prefix = source_fs.makeQualified(source_path).toString().rstrip("/") + "/"
+    for f in list_input_files(spark, source, suffix=(".json", ".parquet")):
+        path = jvm.org.apache.hadoop.fs.Path(f["key"])
+        destination = jvm.org.apache.hadoop.fs.Path(
+            f"{target.rstrip('/')}/{f['key'][len(prefix):]}"
+        )
+        if source_fs.getUri().equals(target_fs.getUri()):
+            target_fs.mkdirs(destination.getParent())
+            if not target_fs.rename(path, destination):
+                raise IOError(f"Could not move {f['key']} to {destination}")
+        else:
+            jvm.org.apache.hadoop.fs.FileUtil.copy(
+                source_fs, path, target_fs, destination, True, conf
+            )
+
+
+def staged_options(options, staging):
+    # The options of a write to staging instead of the table's paths, moved
+    # into place by publish_staged
+    return dict(
+        options,
+        output_path=f"{staging}output/",
+        rejected_path=f"{staging}rejected/" if options["rejected_path"] else "",
+    )
+
+
+def publish_staged(spark, options, staging):
+    move_output(spark, f"{staging}output/", options["output_path"])
+    if options["rejected_path"]:
+        move_output(spark, f"{staging}rejected/", options["rejected_path"])
+
+
+def write_isolated(spark, inputs, column_types, options, metrics=None):
+    # Writes the inputs in one pass. When that fails they are retried in
+    # halves, so a file that cannot be read, e.g. a truncated gzip or a
+    # header that does not match the declared columns, costs a few extra
+    # passes over its neighbours instead of the run. Returns (file, error)
+    # for the files that still fail on their own.
+    written = {}
+    attempt, staging = options, None
+    if options["staging_path"]:
+        # Each attempt writes under a staging path of its own that is moved
+        # to the output once it succeeded, so the files a failed attempt
+        # committed before failing are not written again by its retries
+        staging = f"{options['staging_path']}attempts/{uuid.uuid4().hex}/"
+        attempt = staged_options(options, staging)
+    try:
+        write_inputs(spark, inputs, column_types, attempt, written)
+    except Exception as e:
+        if staging:
+            delete_path(spark, staging)
+        if len(inputs) == 1:
+            error = error_message(e)
+            logging.error("Could not process %s: %s", inputs[0]["file"]["key"], error)
+            return [(inputs[0]["file"], error)]
+        logging.warning(
+            "Processing %d files failed, retrying them in halves: %s",
+            len(inputs),
+            error_message(e),
+        )
+        middle = len(inputs) // 2
+        return write_isolated(
+            spark, inputs[:middle], column_types, options, metrics
+        ) + write_isolated(spark, inputs[middle:], column_types, options, metrics)
+
+    if staging:
+        publish_staged(spark, options, staging)
+        delete_path(spark, staging)
+    if metrics is not None:
+        for name, value in written.items():
+            metrics[name] = metrics.get(name, 0) + value
+    return []
+
+
+def quarantine_files(spark, options, failures):
+    # Copies the files that could not be processed under the table's
+    # quarantine path and appends their errors to its error manifest. The
+    # data lake keeps the originals; a fixed file uploaded again gets a new
+    # modification time and is picked up by the next run.
+    quarantine_path = options["quarantine_path"]
+    if not quarantine_path:
+        logging.warning(
+            "No quarantine_path is set, not copying %d files", len(failures)
+        )
+        return
+
+    jvm = spark.sparkContext._jvm
+    conf = spark.sparkContext._jsc.hadoopConfiguration()
+    records = []
+    for f, error in failures:
+        key = f["key"]
+        if key.startswith(options["input_path"]):
+            name = key[len(options["input_path"]) :]
+        else:
+            name = key.rsplit("/", 1)[-1]
+        target = f"{quarantine_path}files/{name}"
+        try:
+            source_fs, source_path = _hadoop_path(spark, key)
+            target_fs, target_path = _hadoop_path(spark, target)
+            jvm.org.apache.hadoop.fs.FileUtil.copy(
+                source_fs, source_path, target_fs, target_path, False, conf
+            )
+        except Exception as e:
+            logging.error("Could not copy %s to %s: %s", key, target, e)
+            target = None
+        records.append(
+            (key, f["size"], f["modified"], target, error, options["correlation_id"])
+        )
+
+    spark.createDataFrame(records, ERROR_MANIFEST_SCHEMA).withColumn(
+        "quarantined_at", F.current_timestamp()
+    ).coalesce(1).write.mode("append").json(f"{quarantine_path}errors/")
+
+
+def open_inventory(options):
+    # The inventory the trigger Lambda records uploads in, see
+    # shared/inventory.py. Local runs pass a SqliteInventory to run_manifest.
+    if not options["inventory_table"]:
+        return None
+    return DynamoInventory(boto3.client("dynamodb"), options["inventory_table"])
+
+
+def run_manifest(spark, options, metrics=None, inventory=None):
+    input_path = options["input_path"]
+    manifest_path = options["manifest_path"]
+    inventory = inventory or open_inventory(options)
+    start = time.perf_counter()
+    if inventory:
+        # The table's pending files make up the run's work list, with no
+        # listing of the input path and no read of the whole manifest. A file
+        # recorded after the query is left to the next run.
+        files = inventory.pending(options["name"])
+    else:
+        if options["input_keys"]:
+            # Keys of the batch that belong to this table's input path
+            candidates = describe_input_files(
+                spark,
+                [
+                    k
+                    for k in json.loads(options["input_keys"])
+                    if k.startswith(input_path)
+                ],
+            )
+        elif int(options["input_lookback_days"]):
+            # Only the recent date partitions of the dated layout are listed
+            candidates = [
+                f
+                for path in dated_input_paths(
+                    input_path, int(options["input_lookback_days"])
+                )
+                for f in list_input_files(spark, path, suffix=INPUT_SUFFIXES)
+            ]
+        else:
+            candidates = list_input_files(spark, input_path, suffix=INPUT_SUFFIXES)
+        files = select_new_files(candidates, load_manifest(spark, manifest_path))
+    if options["bucket_layout"] == "dated":
+        # Files outside the table's date partitions are left where they are
+        outside = [f for f in files if not in_dated_layout(f["key"], input_path)]
+        files = [f for f in files if in_dated_layout(f["key"], input_path)]
+        if outside:
+            logging.warning(
+                "Skipping %d input files outside the dt=YYYY-MM-DD/ partitions of "
+                "%s, e.g. %s",
+                len(outside),
+                input_path,
+                outside[0]["key"],
+            )
+            if inventory:
+                inventory.mark(outside, SKIPPED)
+    if metrics is not None:
+        metrics["DiscoveryMilliseconds"] = round(
+            (time.perf_counter() - start) * 1000, 3
+        )
+    if not files:
+        logging.info("No new input files under %s", input_path)
+        return 0
+
+    staging = None
+    if int(options["rechunk_min_bytes"]) and options["staging_path"]:
+        staging = f"{options['staging_path']}{uuid.uuid4().hex}/"
+    try:
+        inputs, failures = rechunk_inputs(files, options, staging, metrics)
+        column_types = parse_column_types(options["column_types"])
+        if inputs:
+            failures += write_isolated(spark, inputs, column_types, options, metrics)
+    finally:
+        if staging:
+            delete_path(spark, staging)
+
+    # Bad files are quarantined whatever the size of the run, a single
+    # upload included. Only several files all failing alike fail the run,
+    # they are then retried by the next one.
+    if systemic_failure(files, failures):
+        raise RuntimeError(
+            f"None of the {len(files)} new input files was processed: "
+            f"{failures[0][1]}"
+        )
+    if failures:
+        quarantine_files(spark, options, failures)
+
+    # Only record the files once their output has been written, so a failed
+    # run is retried in full on the next invocation. Quarantined files are
+    # recorded too, so they are not retried until they are uploaded again.
+    record_manifest(spark, manifest_path, files)
+    if inventory:
+        failed = [f for f, _ in failures]
+        inventory.mark([f for f in files if f not in failed], PROCESSED)
+        inventory.mark(failed, QUARANTINED)
+    logging.info(
+        "Processed %d new input files, quarantined %d", len(files), len(failures)
+    )
+    if metrics is not None:
+        metrics.update(
+            InputFiles=len(files),
+            InputBytes=sum(f["size"] for f in files),
+            FilesQuarantined=len(failures),
+        )
+    return len(files)
+
+
+class GlueCatalog:
+    # The awsglue-specific part of the job: catalog reads through dynamic
+    # frames. Local runs substitute any object with the same spark_session
+    # attribute and read_table method.
+    def __init__(self, glue_context):
+        self.glue_context = glue_context
+        self.spark_session = glue_context.spark_session
+
+    def read_table(self, options):
+        # DataSource: Read from Glue Catalog. With job bookmarks enabled the
+        # transformation_ctx makes Glue skip files processed by earlier runs,
+        # and on partitioned tables push_down_predicate skips whole partitions
+        datasource0 = self.glue_context.create_dynamic_frame.from_catalog(
+            database=options["database"],
+            table_name=options["table_name"],
+            transformation_ctx=options["transformation_ctx"],
+            push_down_predicate=options["push_down_predicate"],
+        )
+
+        # Convert to Spark DataFrame to utilize DataFrame operations
+        return datasource0.toDF()
+
+
+def run_catalog(catalog, options, metrics=None):
+    incremental = options["processing_mode"] == "incremental"
+
+    df = project_columns(catalog.read_table(options), options)
+    if incremental and not df.head(1):
+        logging.info("No new data since the last bookmarked run")
+        return
+
+    # A full run reads the whole input path, so its size is known from a
+    # listing. The size of what the bookmarks let through is not, so those
+    # runs keep Spark's partitioning and rely on the compaction pass.
+    num_files = None
+    if not incremental and options["input_path"]:
+        input_bytes = sum(
+            f["size"]
+            for f in list_input_files(catalog.spark_session, options["input_path"])
+        )
+        num_files = output_file_count(
+            input_bytes, _target_bytes(options), options["output_format"]
+        )
+
+    write_typed(
+        df,
+        parse_column_types(options["column_types"]),
+        options,
+        "append" if incremental else "overwrite",
+        num_files,
+        metrics,
+    )
+
+
+def table_options(options):
+    # One set of options per table of the registry passed as --tables, each
+    # entry overriding the job-wide options, or the job-wide options alone
+    if not options["tables"]:
+        return [options]
+    return [dict(options, **table) for table in json.loads(options["tables"])]
+
+
+def run_table(catalog, options):
+    # One metrics record per table and run, see shared/metrics.py
+    with span(
+        "Table",
+        {"Component": "glue_job", "Table": options["name"]},
+        {
+            "CorrelationId": options["correlation_id"],
+            "ProcessingMode": options["processing_mode"],
+        },
+    ) as metrics:
+        if options["processing_mode"] == "manifest":
+            run_manifest(catalog.spark_session, options, metrics)
+        elif options["processing_mode"] == "compact":
+            metrics["FilesCompacted"] = compact_output(
+                catalog.spark_session,
+                options["output_path"],
+                options["compaction_temp_path"],
+                _target_bytes(options),
+                options["output_format"],
+            )
+        else:
+            run_catalog(catalog, options, metrics)
+
+
+def run_tables(catalog, tables, max_workers):
+    # Tables are independent, so their reads and writes are submitted from a
+    # thread pool and run as concurrent Spark jobs in the same application,
+    # sharing its executors instead of paying for one job start per table.
+    # A failed run commits no bookmarks, so its retry reads the files of
+    # every incremental table again: their output is staged and only moved
+    # into place once all tables succeeded.
+    spark = catalog.spark_session
+    staged = {}
+    for options in tables:
+        if options["processing_mode"] == "incremental" and options["staging_path"]:
+            staged[options["name"]] = (
+                f"{options['staging_path']}runs/{uuid.uuid4().hex}/"
+            )
+
+    failures = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(
+                    run_table,
+                    catalog,
+                    staged_options(t, staged[t["name"]]) if t["name"] in staged else t,
+                ): t["name"]
+                for t in tables
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    logging.info("Processed table %s", futures[future])
+                except Exception as e:
+                    logging.error("Table %s failed: %s", futures[future], str(e))
+                    failures.append(futures[future])
+
+        # Failing the run keeps the bookmarks of all tables uncommitted, and
+        # the staged output of the tables that succeeded is dropped with them
+        if failures:
+            raise RuntimeError(f"Failed tables: {', '.join(sorted(failures))}")
+        for options in tables:
+            if options["name"] in staged:
+                publish_staged(spark, options, staged[options["name"]])
+    finally:
+        for staging in staged.values():
+            delete_path(spark, staging)
+
+
+def main():
+    from awsglue.context import GlueContext
+    from awsglue.job import Job
+    from awsglue.utils import getResolvedOptions
+    from pyspark.context import SparkContext
+
     ## @params: [JOB_NAME]
     args = getResolvedOptions(sys.argv, ["JOB_NAME"])
+    options = resolve_optional_args(sys.argv, DEFAULT_OPTIONS)
+    if options["processing_mode"] not in PROCESSING_MODES:
+        raise ValueError(f"Unknown processing mode: {options['processing_mode']}")
+    if options["output_format"] not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {options['output_format']}")
 
     sc = SparkContext()
     glueContext = GlueContext(sc)
     spark = glueContext.spark_session
+    configure_session(spark)
     job = Job(glueContext)
     job.init(args["JOB_NAME"], args)
 
-    # DataSource: Read from Glue Catalog
-    datasource0 = glueContext.create_dynamic_frame.from_catalog(
-        database="metadata_db",
-        table_name="data_lake_costumers",
-        transformation_ctx="datasource0",
-    )
-
-    # Convert to Spark DataFrame to utilize DataFrame operations
-    df = datasource0.toDF()
+    # Runs not started by the trigger Lambda, e.g. scheduled compactions, are
+    # traced under an ID of their own
+    options["correlation_id"] = options["correlation_id"] or new_correlation_id()
+    with span(
+        "JobRun",
+        {"Component": "glue_job"},
+        {"CorrelationId": options["correlation_id"], "JobName": args["JOB_NAME"]},
+    ):
+        run_tables(
+            GlueCatalog(glueContext),
+            table_options(options),
+            int(options["max_parallel_tables"]),
+        )
+        job.commit()
 
-    # Convert CSV format to JSON
-    df.write.mode("overwrite").format("json").save("s3://customers-output-bucket/output/")
-    job.commit()
 
-except Exception as e:
-    logging.error("An error occurred in the Glue job: %s", str(e))
-    sys.exit(1)
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        logging.error("An error occurred in the Glue job: %s", str(e))
+        sys.exit(1)
@@ -0,0 +1,304 @@
+import codecs
+import csv
+import datetime
+import hashlib
+import json
+import re
+import tempfile
+
+# Small uploads are converted to the JSON output right in the trigger Lambda,
+# which takes well under a second, instead of waiting minutes for a Glue job
+# run to start. The conversion follows the Glue job's: the declared casts and
+# transforms, rejected rows set aside, dropped columns left out and rows
+# deduplicated on the table's key. Any of the settings can be overridden
+# through the FAST_PATH environment variable.
+DEFAULT_SETTINGS = {
+    # Objects up to this size are converted in the Lambda, 0 turns it off
+    "max_bytes": 0,
+    # Objects converted at the same time
+    "max_workers": 8,
+    # Conversions are only started while the invocation has this long left
+    "min_remaining_ms": 10000,
+}
+
+# Spellings accepted for BOOLEAN columns, as in glue/glue_job.py
+TRUE_VALUES = ("TRUE", "T", "YES", "Y", "1")
+FALSE_VALUES = ("FALSE", "F", "NO", "N", "0")
+
+# Strings the Glue job's number and timestamp casts accept. Numbers lose
+# their decimals, as in Spark's cast to bigint.
+NUMBER_PATTERN = re.compile(r"[+-]?\d+(?:\.\d*)?")
+TIMESTAMP_PATTERN = re.compile(
+    r"(\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?)(?:\.(\d{1,9}))?"
+)
+
+BIGINT_RANGE = (-(2**63), 2**63 - 1)
+
+# Output is spooled to memory up to this size and to /tmp beyond it
+SPOOL_BYTES = 8 * 1024 * 1024
+
+# Characters decoded per read of the object body
+READ_CHUNK_CHARS = 64 * 1024
+
+
+def fast_path_tables(value):
+    # Expands the fast path's tables document, rendered by the Pulumi program
+    # with the buckets given once, into the table entries of the Glue job's
+    # --tables argument the conversion reads. The paths follow
+    # modules/registry.py.
+    lake, output, scripts = (
+        value["data_lake_bucket"],
+        value["output_bucket"],
+        value["scripts_bucket"],
+    )
+    return [
+        {
+            "name": name,
+            "input_path": f"s3://{lake}/{table['input_prefix']}",
+            "output_path": f"s3://{output}/{table['output_prefix']}",
+            "manifest_path": f"s3://{scripts}/state/manifest/{name}/",
+            "rejected_path": f"s3://{scripts}/{table['rejected_prefix']}",
+            "column_types": table["column_types"],
+            "drop_columns": table["drop_columns"],
+            "dedup_keys": table["dedup_keys"],
+            "dedup_order": table["dedup_order"],
+            "row_filter": "",
+        }
+        for name, table in value["tables"].items()
+    ]
+
+
+def parse_column_types(value):
+    # "customerid:NUMBER,...,rowguid:STRING:strip_braces,..." as rendered by
+    # the Pulumi program for the Glue job
+    column_types = []
+    for item in value.split(","):
+        name, _, spec = item.partition(":")
+        sf_type, _, transform = spec.partition(":")
+        column_types.append((name.strip().lower(), sf_type.strip().upper(), transform))
+    return column_types
+
+
+def cast_value(value, sf_type):
+    # Returns the JSON value the Glue job writes for value, raising ValueError
+    # where its cast comes out null
+    if sf_type == "STRING":
+        return value
+    value = value.strip()
+    if sf_type == "NUMBER":
+        if not NUMBER_PATTERN.fullmatch(value):
+            raise ValueError(value)
+        number = int(value.split(".")[0])
+        if not BIGINT_RANGE[0] <= number <= BIGINT_RANGE[1]:
+            raise ValueError(value)
+        return number
+    if sf_type == "BOOLEAN":
+        if value.upper() in TRUE_VALUES:
+            return True
+        if value.upper() in FALSE_VALUES:
+            return False
+        raise ValueError(value)
+    if sf_type == "TIMESTAMP":
+        match = TIMESTAMP_PATTERN.fullmatch(value)
+        if not match:
+            raise ValueError(value)
+        # Fractions past microseconds are truncated, as Spark's cast does
+        parsed = datetime.datetime.fromisoformat(match[1]).replace(
+            microsecond=int((match[2] or "0")[:6].ljust(6, "0"))
+        )
+        # Spark's JSON writer format in UTC, yyyy-MM-dd'T'HH:mm:ss.SSSXXX
+        return (
+            parsed.strftime("%Y-%m-%dT%H:%M:%S.") + f"{parsed.microsecond // 1000:03d}Z"
+        )
+    return value
+
+
+def transform_value(value, transform):
+    if transform == "strip_braces" and value.startswith("{") and value.endswith("}"):
+        return value[1:-1]
+    return value
+
+
+def split_line(line):
+    # Fields of one line. Lines are parsed on their own, as Spark reads CSV
+    # without multiLine: a quote left open does not run into the next line.
+    if '"' not in line:
+        return line.split(",")
+    return next(csv.reader([line]))
+
+
+def convert_rows(lines, table):
+    # Yields ("valid", key, record) and ("rejected", None, record) for the
+    # rows of a CSV stream, raising LookupError before the first row when its
+    # header does not match the declared columns
+    column_types = parse_column_types(table["column_types"])
+    drop_columns = {c for c in table["drop_columns"].split(",") if c}
+    dedup_keys = [c for c in table["dedup_keys"].split(",") if c]
+
+    lines = (line.rstrip("\r\n") for line in lines)
+    header = [column.strip().lower() for column in split_line(next(lines, ""))]
+    if header != [name for name, _, _ in column_types]:
+        raise LookupError(f"header {header} does not match the declared columns")
+
+    for line in lines:
+        if not line:
+            # Spark skips blank lines too
+            continue
+        fields = split_line(line)
+        if len(fields) != len(column_types):
+            yield "rejected", None, {"source_line": line, "reject_reason": "malformed"}
+            continue
+
+        record = {}
+        raw = {}
+        reasons = []
+        for (name, sf_type, transform), value in zip(column_types, fields):
+            if name in drop_columns:
+                continue
+            raw[name] = value
+            # Empty fields are read as nulls and left out of the output
+            if value == "":
+                continue
+            try:
+                record[name] = transform_value(cast_value(value, sf_type), transform)
+            except ValueError:
+                reasons.append(name)
+
+        if reasons:
+            yield "rejected", None, dict(raw, reject_reason=",".join(reasons))
+        else:
+            yield "valid", tuple(record.get(k) for k in dedup_keys), record
+
+
+def open_body(body):
+    # Decodes the streamed object body in chunks, so memory does not grow
+    # with the object
+    return codecs.getreader("utf-8-sig")(body, errors="replace")
+
+
+def iter_lines(reader):
+    # Lines split on newlines only
+    pending = ""
+    while True:
+        chunk = reader.read(READ_CHUNK_CHARS)
+        if not chunk:
+            break
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+
+def is_newer(record, kept, order_column):
+    # Latest order_column value first and nulls last, as the Glue job orders
+    # its dedup window; timestamps in the output format sort as text
+    order = record.get(order_column)
+    return order is not None and (
+        kept.get(order_column) is None or order > kept[order_column]
+    )
+
+
+def write_lines(records):
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    for record in records:
+        output.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+    size = output.tell()
+    output.seek(0)
+    return output, size
+
+
+def object_id(url, etag):
+    # Names the outputs of one version of an object, so a retried conversion
+    # overwrites them instead of adding files Snowpipe loads twice
+    return hashlib.sha256(f"{url}:{etag}".encode()).hexdigest()[:16]
+
+
+def split_url(url):
+    bucket, _, key = url[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def convert_object(s3_client, url, table):
+    # Converts one CSV object into a JSON file in the table's output path and
+    # records it in the manifest the Glue job's manifest mode skips files by.
+    # Returns the counts of the conversion, raises LookupError when the
+    # object has to go through the Glue job instead.
+    bucket, key = split_url(url)
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    modified = int(response["LastModified"].timestamp() * 1000)
+    name = object_id(url, response["ETag"].strip('"'))
+
+    # Rows are held until the object is read, to deduplicate them; the size
+    # threshold bounds how many
+    valid = {}
+    unkeyed = []
+    rejected = []
+    with response["Body"] as body:
+        for status, row_key, record in convert_rows(iter_lines(open_body(body)), table):
+            if status == "rejected":
+                rejected.append(record)
+            elif not row_key:
+                unkeyed.append(record)
+            elif row_key not in valid or is_newer(
+                record, valid[row_key], table["dedup_order"]
+            ):
+                valid[row_key] = record
+
+    rows = list(valid.values()) + unkeyed
+    bytes_written = 0
+    if rows:
+        output_bucket, output_key = split_url(table["output_path"])
+        output, bytes_written = write_lines(rows)
+        with output:
+            s3_client.upload_fileobj(
+                output, output_bucket, f"{output_key}part-lambda-{name}.json"
+            )
+
+    if rejected and table["rejected_path"]:
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rejected_bucket, rejected_key = split_url(table["rejected_path"])
+        output, _ = write_lines(dict(r, rejected_at=now) for r in rejected)
+        with output:
+            s3_client.upload_fileobj(
+                output, rejected_bucket, f"{rejected_key}lambda-{name}.json"
+            )
+
+    manifest_bucket, manifest_key = split_url(table["manifest_path"])
+    s3_client.put_object(
+        Bucket=manifest_bucket,
+        Key=f"{manifest_key}lambda-{name}.json",
+        Body=json.dumps(
+            {
+                "key": url,
+                "size": response["ContentLength"],
+                "modified": modified,
+                "processed_at": datetime.datetime.now(
+                    datetime.timezone.utc
+                ).isoformat(),
+            }
+        ).encode(),
+    )
+    return {
+        "rows": len(rows),
+        "rejected_rows": len(rejected),
+        "bytes_read": response["ContentLength"],
+        "bytes_written": bytes_written,
+    }
+
+
+def fast_path_table(tables, url):
+    # Table entry with the longest input path the object falls under, if it
+    # can be converted in the Lambda: Spark SQL row filters cannot, tables
+    # with quality checks are checked per batch, and gzip uploads are left to
+    # the Glue job
+    if url.endswith(".gz"):
+        return None
+    matching = [t for t in tables if url.startswith(t["input_path"])]
+    if not matching:
+        return None
+    table = max(matching, key=lambda t: len(t["input_path"]))
+    if not table["column_types"] or table["row_filter"] or table.get("quality"):
+        return None
+    return table
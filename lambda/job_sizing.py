@@ -0,0 +1,57 @@
+import math
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+# Thresholds used to size a Glue job run from the bytes it has to process.
+# Any of them can be overridden through the JOB_SIZING environment variable.
+DEFAULT_SIZING = {
+    # Loads up to this size run as Flex on the minimum number of workers
+    "flex_max_bytes": 256 * MB,
+    # Input each G.1X worker is given; a G.2X worker takes twice as much
+    "bytes_per_worker": 2 * GB,
+    # Loads from this size on run on G.2X workers, for their larger memory
+    "g2x_min_bytes": 100 * GB,
+    "min_workers": 2,
+    "max_workers": 30,
+    # Gzip-compressed CSV is counted as this many times its size; the
+    # customers sample compresses about 2.2 times, with its password hashes
+    "gzip_ratio": 3,
+}
+
+DPUS_PER_WORKER = {"G.1X": 1, "G.2X": 2}
+
+
+def input_bytes(input_sizes, sizing=None):
+    # Bytes the job has to process for objects of the given sizes by URL
+    sizing = {**DEFAULT_SIZING, **(sizing or {})}
+    return sum(
+        size * sizing["gzip_ratio"] if url.endswith(".gz") else size
+        for url, size in input_sizes.items()
+    )
+
+
+def size_job_run(total_bytes, sizing=None):
+    # Returns the start_job_run parameters for a run over total_bytes of input,
+    # or nothing when the size is unknown so the job's defaults apply
+    if total_bytes is None:
+        return {}
+    sizing = {**DEFAULT_SIZING, **(sizing or {})}
+
+    if total_bytes <= sizing["flex_max_bytes"]:
+        return {
+            "WorkerType": "G.1X",
+            "NumberOfWorkers": sizing["min_workers"],
+            "ExecutionClass": "FLEX",
+        }
+
+    worker_type = "G.2X" if total_bytes >= sizing["g2x_min_bytes"] else "G.1X"
+    bytes_per_worker = sizing["bytes_per_worker"] * DPUS_PER_WORKER[worker_type]
+    workers = math.ceil(total_bytes / bytes_per_worker)
+    return {
+        "WorkerType": worker_type,
+        "NumberOfWorkers": min(
+            max(workers, sizing["min_workers"]), sizing["max_workers"]
+        ),
+        "ExecutionClass": "STANDARD",
+    }
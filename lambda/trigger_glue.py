@@ -1,24 +1,424 @@
 import boto3
+import csv
+import functools
+import json
 import os
+import random
+import re
 import time
+import urllib.parse
+import zlib
+import botocore.config
 import botocore.exceptions
+from concurrent.futures import ThreadPoolExecutor
+from fast_path import DEFAULT_SETTINGS as FAST_PATH_DEFAULTS
+from fast_path import convert_object, fast_path_table, fast_path_tables, split_url
+from inventory import PROCESSED, DynamoInventory, epoch_millis, new_file
+from job_sizing import input_bytes, size_job_run
+from metrics import CORRELATION_ID_ARGUMENT, new_correlation_id, s3_correlation_id, span
 
+# Clients are created once per execution environment and reused by warm
+# invocations. Adaptive retries back off on Glue API throttling.
+CLIENT_CONFIG = botocore.config.Config(
+    connect_timeout=5,
+    read_timeout=15,
+    max_pool_connections=10,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
 
-def handler(event, context):
-    glue_client = boto3.client("glue")
-    glue_crawler_name = os.getenv("GLUE_CRAWLER_NAME")
-    glue_job_name = os.getenv("GLUE_JOB_NAME")
+# The new object keys are handed to the Glue job as a JSON list argument.
+# Larger batches are left to the job's own input discovery instead.
+MAX_INPUT_KEYS_ARGUMENT_BYTES = 32 * 1024
+
+# Only the start of each new CSV is fetched to read its header, the headers
+# of a batch this many at a time
+HEADER_RANGE_BYTES = 64 * 1024
+HEADER_READ_WORKERS = 16
+
+# Catalog table columns are cached across warm invocations for this long, and
+# dropped as soon as a crawl succeeds
+SCHEMA_CACHE_TTL_SECONDS = 300
+
+# Why new files are crawled: a table or partition the incremental crawler
+# adds, or a header that only a full crawl updates the table's columns to
+NEW_FOLDERS = "new_folders"
+NEW_COLUMNS = "new_columns"
+
+# Hive-style partition folder, e.g. dt=2024-01-01 of the dated layout
+PARTITION_FOLDER = re.compile(r"^([^/=]+)=([^/]*)$")
+
+# A crawler seen running is assumed to still be running for this long, so a
+# burst of invocations does not query it over and over
+CRAWLER_STATE_TTL_SECONDS = 15
+
+# Glue API errors retried with backoff within the invocation: throttling
+# that outlasted the client's own retries, and job runs at their concurrency
+# limit, which frees up as earlier runs finish
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "ConcurrentRunsExceededException",
+    "OperationTimeoutException",
+    "InternalServiceException",
+}
+
+# Attempts per call, and the cap on the exponential delay between them.
+# Each delay is drawn at random up to the cap ("full jitter"), so throttled
+# invocations do not all retry at the same moment.
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 1
+RETRY_MAX_SECONDS = 8
+
+# Dimensions of the metrics the trigger emits
+METRIC_DIMENSIONS = {"Component": "trigger"}
+
+_clients = {}
+_schema_cache = {}
+_partition_cache = set()
+_crawler_state_cache = {}
+
+
+def get_client(service):
+    if service not in _clients:
+        _clients[service] = boto3.client(service, config=CLIENT_CONFIG)
+    return _clients[service]
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings():
+    # The environment of a function does not change between invocations
+    return {
+        "glue_crawler_name": os.getenv("GLUE_CRAWLER_NAME"),
+        "glue_schema_crawler_name": os.getenv("GLUE_SCHEMA_CRAWLER_NAME"),
+        "glue_job_name": os.getenv("GLUE_JOB_NAME"),
+        "glue_database_name": os.getenv("GLUE_DATABASE_NAME"),
+        "glue_tables": json.loads(os.getenv("GLUE_TABLES") or "[]"),
+        "job_sizing": json.loads(os.getenv("JOB_SIZING") or "{}"),
+        "fast_path": {
+            **FAST_PATH_DEFAULTS,
+            **json.loads(os.getenv("FAST_PATH") or "{}"),
+        },
+        "fast_path_tables": os.getenv("FAST_PATH_TABLES"),
+        "inventory_table": os.getenv("INVENTORY_TABLE"),
+    }
+
+
+def extract_s3_records(event):
+    # S3 notifications arrive directly or, with batching enabled, wrapped in
+    # SQS messages. Yields (message_id, s3_record) pairs, message_id is None
+    # for direct S3 events.
+    for record in event.get("Records", []):
+        if record.get("eventSource") == "aws:sqs":
+            # s3:TestEvent messages carry no Records and are simply consumed
+            body = json.loads(record["body"])
+            for s3_record in body.get("Records", []):
+                yield record["messageId"], s3_record
+        elif record.get("eventSource") == "aws:s3":
+            yield None, record
+
+
+def object_url(s3_record):
+    bucket = s3_record["s3"]["bucket"]["name"]
+    key = urllib.parse.unquote_plus(s3_record["s3"]["object"]["key"])
+    return f"s3://{bucket}/{key}"
+
+
+def job_arguments(input_keys):
+    if not input_keys:
+        return {}
+    argument = json.dumps(input_keys)
+    if len(argument.encode()) > MAX_INPUT_KEYS_ARGUMENT_BYTES:
+        print(f"{len(input_keys)} new objects, leaving input discovery to the job")
+        return {}
+    return {"--input_keys": argument}
+
+
+def read_csv_header(s3_client, url):
+    # Returns the header's columns and when the object was written
+    bucket, key = url[len("s3://") :].split("/", 1)
+    response = s3_client.get_object(
+        Bucket=bucket, Key=key, Range=f"bytes=0-{HEADER_RANGE_BYTES - 1}"
+    )
+    body = response["Body"].read()
+    if key.endswith(".gz"):
+        # The start of a gzip stream decompresses on its own
+        body = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(body)
+    lines = body.decode("utf-8-sig", errors="replace").splitlines()
+    if not lines:
+        return [], response["LastModified"]
+    # The crawler lower-cases the column names it takes from the header
+    columns = [column.strip().lower() for column in next(csv.reader(lines[:1]))]
+    return columns, response["LastModified"]
+
+
+def last_crawl_start(glue_client, crawler_name):
+    # When the crawler's last crawl started, None unless it succeeded
+    if not crawler_name:
+        return None
+    last_crawl = glue_client.get_crawler(Name=crawler_name)["Crawler"].get("LastCrawl")
+    if last_crawl and last_crawl["Status"] == "SUCCEEDED":
+        return last_crawl["StartTime"]
+    return None
+
+
+def catalog_columns(glue_client, database_name, table_name):
+    cached = _schema_cache.get((database_name, table_name))
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    try:
+        table = glue_client.get_table(DatabaseName=database_name, Name=table_name)
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "EntityNotFoundException":
+            return None
+        raise
+
+    columns = [
+        column["Name"].lower()
+        for column in table["Table"]["StorageDescriptor"]["Columns"]
+    ]
+    _schema_cache[(database_name, table_name)] = (
+        columns,
+        time.monotonic() + SCHEMA_CACHE_TTL_SECONDS,
+    )
+    return columns
+
+
+def partition_values(table, url):
+    # Values of the partition folders an object sits in below its table's
+    # input prefix, empty for an unpartitioned table
+    key = url[len("s3://") :].split("/", 1)[1]
+    folders = key[len(table["input_prefix"]) :].split("/")[:-1]
+    matches = [PARTITION_FOLDER.match(folder) for folder in folders]
+    if not folders or not all(matches):
+        return []
+    return [match.group(2) for match in matches]
+
+
+def partition_registered(glue_client, database_name, table_name, values):
+    # Registered partitions are remembered across warm invocations, they are
+    # not removed by the crawler
+    cache_key = (database_name, table_name, tuple(values))
+    if cache_key in _partition_cache:
+        return True
+    try:
+        glue_client.get_partition(
+            DatabaseName=database_name, TableName=table_name, PartitionValues=values
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "EntityNotFoundException":
+            return False
+        raise
+    _partition_cache.add(cache_key)
+    return True
 
+
+def registry_table(tables, url):
+    # Registry entry with the longest data lake prefix the object falls under
+    key = url[len("s3://") :].split("/", 1)[1]
+    matching = [t for t in tables if key.startswith(t["input_prefix"])]
+    if not matching:
+        return None
+    return max(matching, key=lambda t: len(t["input_prefix"]))
+
+
+def record_arrivals(inventory, tables, records):
+    # Records the uploads of registered tables as pending in the inventory
+    # the Glue job takes its work list from. Returns them by URL. Events
+    # delivered again leave the records of their uploads as they are.
+    arrivals = {}
+    for _, s3_record in records:
+        url = object_url(s3_record)
+        table = registry_table(tables, url)
+        if table is None:
+            continue
+        event_time = s3_record.get("eventTime")
+        arrivals[url] = new_file(
+            url,
+            table["name"],
+            s3_record["s3"]["object"].get("size", 0),
+            s3_record["s3"]["object"].get("eTag", ""),
+            epoch_millis(event_time) if event_time else int(time.time() * 1000),
+        )
+    inventory.record(list(arrivals.values()))
+    return arrivals
+
+
+def schema_changed(
+    glue_client, s3_client, database_name, tables, input_keys, schema_crawler_name
+):
+    # Returns NEW_COLUMNS or NEW_FOLDERS when the new files need a crawl, or
+    # None. Without new keys (e.g. a manual invocation) or configured tables,
+    # crawl as before.
+    if not input_keys or not database_name or not tables:
+        return NEW_FOLDERS
+
+    changed = None
+    cataloged = {}
+    table_columns = {}
+    for url in input_keys:
+        table = registry_table(tables, url)
+        if table is None:
+            print(f"No table registered for {url}")
+            changed = NEW_FOLDERS
+            continue
+        table_name = table["table_name"]
+        if table_name not in table_columns:
+            table_columns[table_name] = catalog_columns(
+                glue_client, database_name, table_name
+            )
+            if table_columns[table_name] is None:
+                print(f"Catalog table {database_name}.{table_name} does not exist yet")
+        if table_columns[table_name] is None:
+            changed = NEW_FOLDERS
+            continue
+        cataloged[url] = (table, table_columns[table_name])
+    if not cataloged:
+        return changed
+
+    # The headers of a batch are fetched in parallel, one at a time they
+    # would take most of the invocation's timeout for a thousand uploads
+    with ThreadPoolExecutor(
+        max_workers=min(HEADER_READ_WORKERS, len(cataloged))
+    ) as pool:
+        headers = dict(
+            zip(
+                cataloged,
+                pool.map(lambda url: read_csv_header(s3_client, url), cataloged),
+            )
+        )
+
+    # A full crawl that has seen a file and left its table's columns as they
+    # are would do the same again, e.g. for a header it cannot merge into
+    # the table's
+    drifted = [
+        url for url, (_, columns) in cataloged.items() if headers[url][0] != columns
+    ]
+    if drifted:
+        crawled = last_crawl_start(glue_client, schema_crawler_name)
+        for url in drifted:
+            table_name = cataloged[url][0]["table_name"]
+            if crawled and crawled > headers[url][1]:
+                print(
+                    f"Header of {url} differs from {database_name}.{table_name}, "
+                    "which a full crawl since did not update"
+                )
+            else:
+                print(f"Header of {url} differs from {database_name}.{table_name}")
+                return NEW_COLUMNS
+
+    # Catalog reads only see registered partitions, so the first upload to
+    # a new one, e.g. each day's dt= folder, is crawled to add it. Each
+    # partition of the batch is looked up once.
+    partitions = {
+        (table["table_name"], tuple(partition_values(table, url)))
+        for url, (table, _) in cataloged.items()
+    }
+    for table_name, values in sorted(partitions):
+        if values and not partition_registered(
+            glue_client, database_name, table_name, list(values)
+        ):
+            print(f"Partition {list(values)} of {database_name}.{table_name} is new")
+            changed = NEW_FOLDERS
+    return changed
+
+
+@functools.lru_cache(maxsize=None)
+def load_fast_path_tables(url):
+    # The fast path's tables, read once per execution environment. The
+    # document's key changes with its content, so a deploy that changes it
+    # changes the function's environment too.
+    if not url:
+        return []
+    bucket, key = split_url(url)
+    body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+    return fast_path_tables(json.loads(body))
+
+
+def convert_small_objects(s3_client, settings, input_sizes, context, metrics):
+    # Converts the objects small enough for the fast path in the Lambda and
+    # returns their URLs. Anything that fails or does not qualify is left to
+    # the Glue job. The manifest entry is written last, so a failure after
+    # the output was written duplicates rows rather than losing them.
+    fast_path = settings["fast_path"]
+    tables = load_fast_path_tables(settings["fast_path_tables"])
+    candidates = {}
+    for url, size in input_sizes.items():
+        table = fast_path_table(tables, url)
+        if size <= fast_path["max_bytes"] and table:
+            candidates[url] = table
+    if not candidates:
+        return set()
+
+    def convert(url):
+        if (
+            context
+            and context.get_remaining_time_in_millis() < fast_path["min_remaining_ms"]
+        ):
+            return url, None, "out of time"
+        try:
+            return url, convert_object(s3_client, url, candidates[url]), None
+        except Exception as e:
+            return url, None, str(e)
+
+    converted = set()
+    with ThreadPoolExecutor(max_workers=fast_path["max_workers"]) as pool:
+        for url, result, error in pool.map(convert, candidates):
+            if error:
+                print(f"Leaving {url} to the Glue job: {error}")
+                metrics["FastPathFallbacks"] = metrics.get("FastPathFallbacks", 0) + 1
+                continue
+            converted.add(url)
+            for name, value in (
+                ("FastPathRows", result["rows"]),
+                ("FastPathRejectedRows", result["rejected_rows"]),
+                ("FastPathBytes", result["bytes_written"]),
+            ):
+                metrics[name] = metrics.get(name, 0) + value
+
+    metrics["FastPathObjects"] = len(converted)
+    print(f"Converted {len(converted)} of {len(candidates)} small objects")
+    return converted
+
+
+def call_with_backoff(call, metrics=None, **kwargs):
+    # Retries call on RETRYABLE_ERRORS, counting the retries in metrics
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        try:
+            return call(**kwargs)
+        except botocore.exceptions.ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code not in RETRYABLE_ERRORS or attempt + 1 == RETRY_MAX_ATTEMPTS:
+                raise
+            delay = random.uniform(
+                0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2**attempt)
+            )
+            print(f"{code}, retrying in {delay:.1f}s")
+            if metrics is not None:
+                metrics["GlueApiRetries"] = metrics.get("GlueApiRetries", 0) + 1
+            time.sleep(delay)
+
+
+def start_crawler(glue_client, glue_crawler_name, metrics=None):
+    # Returns True when this invocation started the crawler
+    cached = _crawler_state_cache.get(glue_crawler_name)
+    if cached and cached > time.monotonic():
+        print(f"Glue crawler {glue_crawler_name} is already running.")
+        return False
+
+    started = False
     try:
         # Get the current state of the Glue Crawler
-        crawler_status = glue_client.get_crawler(Name=glue_crawler_name)["Crawler"][
-            "State"
-        ]
+        crawler_status = call_with_backoff(
+            glue_client.get_crawler, metrics, Name=glue_crawler_name
+        )["Crawler"]["State"]
 
         # Start the Glue Crawler only if it is not already running
         if crawler_status != "RUNNING":
-            glue_client.start_crawler(Name=glue_crawler_name)
+            call_with_backoff(
+                glue_client.start_crawler, metrics, Name=glue_crawler_name
+            )
             print(f"Started Glue crawler: {glue_crawler_name}")
+            started = True
         else:
             print(f"Glue crawler {glue_crawler_name} is already running.")
     except botocore.exceptions.ClientError as e:
@@ -27,26 +427,166 @@ def handler(event, context):
         else:
             raise
 
-        # Wait for the Glue Crawler to finish running
-        while True:
-            crawler_metadata = glue_client.get_crawler(Name=glue_crawler_name)
-            if crawler_metadata["Crawler"]["State"] != "RUNNING":
-                break
-            time.sleep(
-                60
-            )  # Wait for 60 seconds before checking the Crawler status again
+    _crawler_state_cache[glue_crawler_name] = (
+        time.monotonic() + CRAWLER_STATE_TTL_SECONDS
+    )
+    return started
 
-    # Start the Glue job
+
+def start_job(
+    glue_client,
+    glue_job_name,
+    arguments,
+    message_ids=(),
+    run_options=None,
+    metrics=None,
+):
+    # Outcome counters are added to metrics, the dict of the invocation's span.
+    # A run that cannot be started fails the invocation, so Lambda retries
+    # the event and finally hands it to the dead-letter queue.
+    metrics = {} if metrics is None else metrics
     try:
-        response = glue_client.start_job_run(JobName=glue_job_name)
+        response = call_with_backoff(
+            glue_client.start_job_run,
+            metrics,
+            JobName=glue_job_name,
+            Arguments=arguments,
+            **(run_options or {}),
+        )
         print(f"Glue job started successfully: {response['JobRunId']}")
+        metrics["JobRunsStarted"] = 1
         return {
             "statusCode": 200,
             "body": f"Glue job {glue_job_name} started successfully with JobRunId {response['JobRunId']}",
         }
     except Exception as e:
         print(f"Error in processing: {str(e)}")
+        if (
+            message_ids
+            and isinstance(e, botocore.exceptions.ClientError)
+            and e.response["Error"]["Code"] == "ConcurrentRunsExceededException"
+        ):
+            # Hand the batch back to SQS, it is delivered again once the
+            # visibility timeout expires and picked up by a later run
+            metrics["JobStartsDeferred"] = 1
+            return {"batchItemFailures": [{"itemIdentifier": m} for m in message_ids]}
+        metrics["JobStartFailures"] = 1
+        raise
+
+
+def crawler_run_seconds(event):
+    # How long the crawl that held back the job run took, as reported by the
+    # state change event
+    value = event.get("detail", {}).get("runningTime (sec)")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def handler(event, context):
+    glue_client = get_client("glue")
+    settings = get_settings()
+    glue_crawler_name = settings["glue_crawler_name"]
+    glue_job_name = settings["glue_job_name"]
+
+    # EventBridge "Glue Crawler State Change" event: the crawler started for
+    # earlier uploads has succeeded, so the catalog is up to date
+    if event.get("source") == "aws.glue":
+        # The run is traced by the ID of the event, the uploads that started
+        # the crawl were traced up to CrawlerStarts under their own IDs
+        correlation_id = event.get("id") or new_correlation_id()
+        properties = {"CorrelationId": correlation_id, "Event": "crawler_succeeded"}
+        with span("Trigger", METRIC_DIMENSIONS, properties) as metrics:
+            print(f"Glue crawler {event['detail']['crawlerName']} succeeded.")
+            metrics["CrawlerRunSeconds"] = crawler_run_seconds(event)
+            _schema_cache.clear()
+            _crawler_state_cache.clear()
+            return start_job(
+                glue_client,
+                glue_job_name,
+                {CORRELATION_ID_ARGUMENT: correlation_id},
+                metrics=metrics,
+            )
+
+    records = list(extract_s3_records(event))
+    message_ids = list(dict.fromkeys(m for m, _ in records if m))
+    input_sizes = {object_url(r): r["s3"]["object"].get("size", 0) for _, r in records}
+    input_keys = list(input_sizes)
+    print(f"Received {len(input_keys)} new objects in {len(message_ids)} messages")
+
+    correlation_id = s3_correlation_id([r for _, r in records])
+    properties = {"CorrelationId": correlation_id, "Event": "s3"}
+    with span("Trigger", METRIC_DIMENSIONS, properties) as metrics:
+        metrics["EventsReceived"] = len(input_keys)
+        metrics["EventBytes"] = sum(input_sizes.values())
+
+        arrivals = {}
+        if settings["inventory_table"]:
+            inventory = DynamoInventory(
+                get_client("dynamodb"), settings["inventory_table"]
+            )
+            arrivals = record_arrivals(inventory, settings["glue_tables"], records)
+            metrics["FilesInventoried"] = len(arrivals)
+
+        # Small objects skip the crawler and the job, which take minutes to
+        # start, and are converted to the output right here
+        if settings["fast_path"]["max_bytes"]:
+            converted = convert_small_objects(
+                get_client("s3"), settings, input_sizes, context, metrics
+            )
+            input_sizes = {k: v for k, v in input_sizes.items() if k not in converted}
+            if arrivals:
+                inventory.mark(
+                    [f for url, f in arrivals.items() if url in converted], PROCESSED
+                )
+            input_keys = list(input_sizes)
+            if converted and not input_keys:
+                return {
+                    "statusCode": 200,
+                    "body": f"Converted {len(converted)} objects in the trigger Lambda",
+                }
+
+        # Crawling only matters when the new files could change the catalog
+        # table or add a partition to it, otherwise the job is started right
+        # away for exactly these files
+        changed = schema_changed(
+            glue_client,
+            get_client("s3"),
+            settings["glue_database_name"],
+            settings["glue_tables"],
+            input_keys,
+            settings["glue_schema_crawler_name"],
+        )
+        if not changed:
+            print("Schema unchanged, skipping the Glue crawler")
+            # Size the run for the bytes that arrived
+            total_bytes = input_bytes(input_sizes, settings["job_sizing"])
+            run_options = size_job_run(total_bytes, settings["job_sizing"])
+            print(f"Sized Glue job run for {total_bytes} bytes: {run_options}")
+            return start_job(
+                glue_client,
+                glue_job_name,
+                {
+                    **job_arguments(input_keys),
+                    CORRELATION_ID_ARGUMENT: correlation_id,
+                },
+                message_ids,
+                run_options,
+                metrics,
+            )
+
+        # A changed header is crawled in full, the incremental crawler would
+        # leave the table's columns as they are
+        if changed == NEW_COLUMNS and settings["glue_schema_crawler_name"]:
+            glue_crawler_name = settings["glue_schema_crawler_name"]
+
+        # The job run is started by the crawler's "Succeeded" state change
+        # event instead of waiting for the crawler here
+        metrics["CrawlerStarts"] = int(
+            start_crawler(glue_client, glue_crawler_name, metrics)
+        )
         return {
-            "statusCode": 500,
-            "body": f"Error in processing: {str(e)}",
+            "statusCode": 202,
+            "body": f"Glue crawler {glue_crawler_name} started, Glue job {glue_job_name} starts when it succeeds",
         }
@@ -0,0 +1,52 @@
+import hashlib
+import os
+import pulumi
+import pulumi_aws as aws
+
+# Code is uploaded under keys named after the SHA-256 of its content. An
+# unchanged file keeps its key, so a deploy leaves the object and the Glue
+# job or Lambda function pointing at it untouched. A changed file gets a new
+# key, which is what tells the job and function that the code changed; the
+# object of the previous key is deleted once the new one is in place.
+
+# Bytes hashed per read
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def artifact_key(prefix, path, keep_name=False):
+    # glue/<sha256>.py, or glue/lib/<sha256>/metrics.py for modules that are
+    # imported by their file name
+    digest = file_sha256(path)
+    if keep_name:
+        return f"{prefix}/{digest}/{os.path.basename(path)}"
+    return f"{prefix}/{digest}{os.path.splitext(path)[1]}"
+
+
+def upload_document(name, bucket_name, content, prefix):
+    # A JSON document rendered by the program, e.g. registry/<sha256>.json
+    return aws.s3.BucketObject(
+        name,
+        bucket=bucket_name,
+        content=content,
+        content_type="application/json",
+        key=pulumi.Output.from_input(content).apply(
+            lambda text: f"{prefix}/{hashlib.sha256(text.encode()).hexdigest()}.json"
+        ),
+    )
+
+
+def upload_artifact(name, bucket_name, path, prefix, keep_name=False):
+    return aws.s3.BucketObject(
+        name,
+        bucket=bucket_name,
+        source=pulumi.FileAsset(path),
+        key=artifact_key(prefix, path, keep_name),
+    )
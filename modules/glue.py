@@ -1,101 +1,131 @@
 import json
 import pulumi
 import pulumi_aws as aws
+from modules.artifacts import upload_artifact
+from modules.policies import (
+    assume_role_policy,
+    glue_arn,
+    policy_document,
+    s3_bucket_arn,
+    s3_objects_arn,
+    statement,
+)
 
 
-def setup_crawler(bucket, glue_database, provider=None):
+def setup_crawler(bucket, glue_database, prefixes=("",), provider=None):
     # Create a role for the AWS Glue Crawler
     aws_glue_crawler_role = aws.iam.Role(
         "AWSGlueCrawlerRole",
-        assume_role_policy=json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {"Service": "glue.amazonaws.com"},
-                        "Action": "sts:AssumeRole",
-                    }
-                ],
-            }
-        ),
+        assume_role_policy=assume_role_policy("glue.amazonaws.com"),
         opts=pulumi.ResourceOptions(provider=provider) if provider else None,
     )
 
-    # Attach the policy that allows logs:PutLogEvents
-    aws.iam.RolePolicy(
-        "AWSGlueCrawlerLoggingPolicy",
-        role=aws_glue_crawler_role.id,
-        policy=json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Action": [
-                            "logs:PutLogEvents",
-                            "logs:CreateLogGroup",
-                            "logs:CreateLogStream",
-                        ],
-                        "Resource": "arn:aws:logs:*:*:*",
-                    }
-                ],
-            }
-        ),
-    )
-
-    # Attach the policy that allows s3:GetObject, s3:ListBucket, and Glue access
+    # Logs, reads of the data lake, and the catalog tables and partitions the
+    # crawler keeps
     aws.iam.RolePolicy(
-        "AWSGlueCrawlerS3GlueAccessPolicy",
+        "AWSGlueCrawlerPolicy",
         role=aws_glue_crawler_role.id,
-        policy=pulumi.Output.all(bucket, glue_database.name).apply(
-            lambda args: json.dumps(
-                {
-                    "Version": "2012-10-17",
-                    "Statement": [
-                        {
-                            "Effect": "Allow",
-                            "Action": ["s3:GetObject", "s3:ListBucket"],
-                            "Resource": [
-                                f"arn:aws:s3:::{args[0]}/*",
-                                f"arn:aws:s3:::{args[0]}",
-                            ],
-                        },
-                        {
-                            "Effect": "Allow",
-                            "Action": [
-                                "glue:GetDatabase",
-                                "glue:GetTables",
-                                "glue:GetTable",
-                                "glue:StartCrawler",
-                                "glue:BatchGetCrawlers",
-                                "glue:CreateTable",
-                            ],
-                            "Resource": [
-                                f"arn:aws:glue:*:*:catalog",
-                                f"arn:aws:glue:*:*:database/{args[1]}",
-                                f"arn:aws:glue:*:*:table/{args[1]}/*",
-                            ],
-                        },
+        policy=policy_document(
+            [
+                statement(
+                    [
+                        "logs:PutLogEvents",
+                        "logs:CreateLogGroup",
+                        "logs:CreateLogStream",
                     ],
-                }
-            )
+                    ["arn:aws:logs:*:*:*"],
+                ),
+                statement(
+                    ["s3:GetObject"], [s3_objects_arn(bucket, p) for p in prefixes]
+                ),
+                statement(["s3:ListBucket"], [s3_bucket_arn(bucket)]),
+                statement(
+                    [
+                        "glue:GetDatabase",
+                        "glue:GetTables",
+                        "glue:GetTable",
+                        "glue:StartCrawler",
+                        "glue:BatchGetCrawlers",
+                        "glue:CreateTable",
+                        "glue:UpdateTable",
+                        "glue:GetPartitions",
+                        "glue:BatchGetPartition",
+                        "glue:BatchCreatePartition",
+                        "glue:UpdatePartition",
+                        "glue:BatchUpdatePartition",
+                    ],
+                    [
+                        glue_arn("catalog"),
+                        glue_arn("database", glue_database.name),
+                        glue_arn("table", glue_database.name, "/*"),
+                    ],
+                ),
+            ]
+        ),
+        opts=pulumi.ResourceOptions(
+            aliases=[pulumi.Alias(name="AWSGlueCrawlerS3GlueAccessPolicy")]
         ),
     )
 
-    # Create the Glue Crawler
+    # Skip hidden and temporary objects such as Spark's _SUCCESS markers
+    exclusions = pulumi.Config().get_object("crawler_exclusions") or ["**/_*", "**/.*"]
+
+    # One target per prefix, each becoming a catalog table named after its
+    # last folder, or the whole bucket
+    s3_targets = [
+        aws.glue.CrawlerS3TargetArgs(
+            path=pulumi.Output.concat("s3://", bucket, "/", prefix),
+            exclusions=exclusions,
+        )
+        for prefix in prefixes
+    ]
+
+    # Create the Glue Crawler. It only crawls folders added since its last
+    # run; the trigger Lambda starts it when new files add a table or a
+    # partition.
     crawler = aws.glue.Crawler(
         "glueCrawler",
         role=aws_glue_crawler_role.arn,
         database_name=glue_database.name,
-        s3_targets=[
-            aws.glue.CrawlerS3TargetArgs(
-                path=bucket.apply(lambda b: f"s3://{b}/"),
-            )
-        ],
+        s3_targets=s3_targets,
+        recrawl_policy=aws.glue.CrawlerRecrawlPolicyArgs(
+            recrawl_behavior="CRAWL_NEW_FOLDERS_ONLY",
+        ),
+        # Required by incremental crawls
+        schema_change_policy=aws.glue.CrawlerSchemaChangePolicyArgs(
+            update_behavior="LOG",
+            delete_behavior="LOG",
+        ),
         opts=pulumi.ResourceOptions(provider=provider) if provider else None,
     )
-    return crawler
+
+    # An incremental crawl leaves the columns of existing tables as they are,
+    # so new files with another header are crawled in full by a second
+    # crawler that updates the tables, their partitions taking the table's
+    # columns
+    schema_crawler = aws.glue.Crawler(
+        "glueSchemaCrawler",
+        role=aws_glue_crawler_role.arn,
+        database_name=glue_database.name,
+        s3_targets=s3_targets,
+        recrawl_policy=aws.glue.CrawlerRecrawlPolicyArgs(
+            recrawl_behavior="CRAWL_EVERYTHING",
+        ),
+        schema_change_policy=aws.glue.CrawlerSchemaChangePolicyArgs(
+            update_behavior="UPDATE_IN_DATABASE",
+            delete_behavior="LOG",
+        ),
+        configuration=json.dumps(
+            {
+                "Version": 1.0,
+                "CrawlerOutput": {
+                    "Partitions": {"AddOrUpdateBehavior": "InheritFromTable"}
+                },
+            }
+        ),
+        opts=pulumi.ResourceOptions(provider=provider) if provider else None,
+    )
+    return crawler, schema_crawler
 
 
 def setup_database(provider=None):
@@ -110,32 +140,29 @@ def setup_database(provider=None):
 
 
 def upload_glue_code(bucket_name, script_path):
-    return aws.s3.BucketObject(
-        "GlueJobScript",
-        bucket=bucket_name,
-        source=pulumi.FileAsset(script_path),
-        key="glue/",
-    )
+    return upload_artifact("GlueJobScript", bucket_name, script_path, "glue")
+
+
+def upload_glue_library(bucket_name, module_path, name="GlueJobLibrary"):
+    # Python module the job imports, passed to it as --extra-py-files
+    return upload_artifact(name, bucket_name, module_path, "glue/lib", keep_name=True)
 
 
 def setup_job(
-    data_lake_bucket, output_bucket, scripts_bucket, script_path, provider=None
+    data_lake_bucket,
+    output_bucket,
+    scripts_bucket,
+    script_path,
+    glue_database_name,
+    extra_arguments=None,
+    extra_statements=(),
+    compaction_schedule=None,
+    provider=None,
 ):
     # Create a role for the AWS Glue Job
     glue_job_role = aws.iam.Role(
         "AWSGlueJobRole",
-        assume_role_policy=json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {"Service": "glue.amazonaws.com"},
-                        "Action": "sts:AssumeRole",
-                    }
-                ],
-            }
-        ),
+        assume_role_policy=assume_role_policy("glue.amazonaws.com"),
     )
 
     # Attach the Glue Service Role policy
@@ -145,62 +172,54 @@ def setup_job(
         policy_arn="arn:aws:iam::aws:policy/service-role/AWSGlueServiceRole",
     )
 
-    # Create and attach a policy for S3 access
-    scripts_bucket_name = pulumi.Config().require("scripts_bucket_name")
-
-    s3_access_policy_document = pulumi.Output.all(
-        data_lake_bucket, output_bucket, scripts_bucket_name
-    ).apply(
-        lambda args: json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Action": ["s3:GetObject", "s3:PutObject", "s3:DeleteObject"],
-                        "Resource": [
-                            f"arn:aws:s3:::{args[2]}/*",
-                            f"arn:aws:s3:::{args[0]}/*",
-                            f"arn:aws:s3:::{args[1]}/*",
-                        ],
-                    }
-                ],
-            }
-        )
-    )
-    s3_access_policy = aws.iam.Policy(
-        "S3AccessPolicy", policy=s3_access_policy_document
-    )
-
-    aws.iam.RolePolicyAttachment(
-        "S3AccessPolicyAttachment",
-        role=glue_job_role.name,
-        policy_arn=s3_access_policy.arn,
+    # S3 access to the three buckets, listing included for the new input
+    # files and the manifest of the incremental processing modes, reads of
+    # the job's catalog tables, and what the enabled features add
+    buckets = [data_lake_bucket, output_bucket, scripts_bucket]
+    aws.iam.RolePolicy(
+        "AWSGlueJobPolicy",
+        role=glue_job_role.id,
+        policy=policy_document(
+            [
+                statement(
+                    ["s3:GetObject", "s3:PutObject", "s3:DeleteObject"],
+                    [s3_objects_arn(bucket) for bucket in buckets],
+                ),
+                statement(
+                    ["s3:ListBucket"], [s3_bucket_arn(bucket) for bucket in buckets]
+                ),
+                statement(
+                    ["glue:GetTable", "glue:GetTables", "glue:GetDatabase"],
+                    [
+                        glue_arn("catalog"),
+                        glue_arn("database", glue_database_name),
+                        glue_arn("table", glue_database_name, "/*"),
+                    ],
+                ),
+                *extra_statements,
+            ]
+        ),
     )
 
-    # Create and attach a policy for Glue Catalog access
-    glue_catalog_policy_document = json.dumps(
-        {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Action": ["glue:GetTable", "glue:GetTables", "glue:GetDatabase"],
-                    "Resource": ["*"],
-                }
-            ],
-        }
-    )
+    # "incremental" relies on job bookmarks, "manifest" on a list of processed
+    # files kept next to the scripts, "full" reprocesses the whole table
+    config = pulumi.Config()
+    processing_mode = config.get("glue_processing_mode") or "incremental"
+    # Only the incremental mode reads through bookmarks. A full run reading
+    # just the bookmarked delta would overwrite the output with it.
+    bookmarks = "enable" if processing_mode == "incremental" else "disable"
 
-    glue_catalog_policy = aws.iam.Policy(
-        "GlueCatalogAccessPolicy", policy=glue_catalog_policy_document
-    )
+    # Output files are sized towards this target, which Snowpipe ingests best
+    # at 100-250 MB
+    target_file_size_mb = config.get("target_file_size_mb") or "128"
 
-    aws.iam.RolePolicyAttachment(
-        "GlueCatalogAccessPolicyAttachment",
-        role=glue_job_role.name,
-        policy_arn=glue_catalog_policy.arn,
-    )
+    # Default capacity of a run. The trigger Lambda sizes each run it starts
+    # from the bytes that arrived, and with auto scaling the number of
+    # workers is only an upper bound Glue scales within.
+    worker_type = config.get("glue_worker_type") or "G.1X"
+    number_of_workers = config.get_int("glue_number_of_workers") or 10
+    auto_scaling = config.get_bool("glue_auto_scaling")
+    auto_scaling = True if auto_scaling is None else auto_scaling
 
     # Create the Glue Job
     glue_job = aws.glue.Job(
@@ -213,8 +232,78 @@ def setup_job(
             ),
             python_version="3",
         ),
-        max_capacity=2.0,  # Specify the capacity for the job. This should be a value between 2.0 and 100.0
+        default_arguments={
+            "--job-bookmark-option": f"job-bookmark-{bookmarks}",
+            "--processing_mode": processing_mode,
+            "--input_path": pulumi.Output.concat("s3://", data_lake_bucket, "/"),
+            "--output_path": pulumi.Output.concat("s3://", output_bucket, "/output/"),
+            "--manifest_path": pulumi.Output.concat(
+                "s3://", scripts_bucket, "/state/manifest/"
+            ),
+            "--target_file_size_mb": target_file_size_mb,
+            "--compaction_temp_path": pulumi.Output.concat(
+                "s3://", scripts_bucket, "/state/compaction/"
+            ),
+            "--enable-auto-scaling": "true" if auto_scaling else "false",
+            **(extra_arguments or {}),
+        },
+        worker_type=worker_type,
+        number_of_workers=number_of_workers,
         glue_version="4.0",  # Specify the Glue version. This should be '0.9', '1.0', or '2.0'
         opts=pulumi.ResourceOptions(provider=provider) if provider else None,
     )
+
+    # Optionally run the compaction pass on a schedule, e.g. "cron(0 3 * * ? *)"
+    if compaction_schedule:
+        aws.glue.Trigger(
+            "GlueCompactionTrigger",
+            type="SCHEDULED",
+            schedule=compaction_schedule,
+            actions=[
+                aws.glue.TriggerActionArgs(
+                    job_name=glue_job.name,
+                    arguments={
+                        "--processing_mode": "compact",
+                        "--job-bookmark-option": "job-bookmark-disable",
+                    },
+                )
+            ],
+            opts=pulumi.ResourceOptions(provider=provider) if provider else None,
+        )
+
     return glue_job
+
+
+def setup_crawler_succeeded_rule(crawler_names, lambda_function, provider=None):
+    # Invoke the trigger Lambda when a crawler succeeds, so it starts the
+    # Glue job right away instead of polling the crawler state
+    rule = aws.cloudwatch.EventRule(
+        "glueCrawlerSucceededRule",
+        event_pattern=pulumi.Output.all(*crawler_names).apply(
+            lambda names: json.dumps(
+                {
+                    "source": ["aws.glue"],
+                    "detail-type": ["Glue Crawler State Change"],
+                    "detail": {"crawlerName": list(names), "state": ["Succeeded"]},
+                }
+            )
+        ),
+        opts=pulumi.ResourceOptions(provider=provider) if provider else None,
+    )
+
+    permission = aws.lambda_.Permission(
+        "glueCrawlerSucceededPermission",
+        action="lambda:InvokeFunction",
+        function=lambda_function.arn,
+        principal="events.amazonaws.com",
+        source_arn=rule.arn,
+        opts=pulumi.ResourceOptions(provider=provider) if provider else None,
+    )
+
+    aws.cloudwatch.EventTarget(
+        "glueCrawlerSucceededTarget",
+        rule=rule.name,
+        arn=lambda_function.arn,
+        opts=pulumi.ResourceOptions(provider=provider, depends_on=[permission]),
+    )
+    return rule
@@ -0,0 +1,50 @@
+import pulumi
+import pulumi_aws as aws
+from modules.policies import statement
+
+# Attributes of the inventory's keys and index, as in shared/inventory.py
+PENDING_INDEX = "pending"
+PENDING_ATTRIBUTE = "pending_table"
+
+
+def setup_inventory_table():
+    # One item per input file, keyed by its URL. Only pending files carry
+    # the pending_table attribute, so the index on it holds exactly the work
+    # the Glue job has left, and the records of processed files expire.
+    return aws.dynamodb.Table(
+        "inputInventory",
+        billing_mode="PAY_PER_REQUEST",
+        hash_key="key",
+        attributes=[
+            {"name": "key", "type": "S"},
+            {"name": PENDING_ATTRIBUTE, "type": "S"},
+            {"name": "arrived_at", "type": "N"},
+        ],
+        global_secondary_indexes=[
+            {
+                "name": PENDING_INDEX,
+                "hash_key": PENDING_ATTRIBUTE,
+                "range_key": "arrived_at",
+                "projection_type": "ALL",
+            }
+        ],
+        ttl={"attribute_name": "expires_at", "enabled": True},
+    )
+
+
+def inventory_writer_statements(inventory_table):
+    # The trigger Lambda records uploads and marks the ones it converts
+    return [
+        statement(["dynamodb:PutItem", "dynamodb:UpdateItem"], [inventory_table.arn])
+    ]
+
+
+def inventory_reader_statements(inventory_table):
+    # The Glue job queries the pending index and marks the files it processed
+    return [
+        statement(
+            ["dynamodb:Query"],
+            [pulumi.Output.concat(inventory_table.arn, "/index/", PENDING_INDEX)],
+        ),
+        statement(["dynamodb:UpdateItem"], [inventory_table.arn]),
+    ]
@@ -1,23 +1,69 @@
 import pulumi
 import pulumi_aws as aws
-import json
+import base64
+import hashlib
+import os
+import zipfile
+from modules.artifacts import upload_artifact
+from modules.policies import (
+    assume_role_policy,
+    glue_arn,
+    policy_document,
+    s3_bucket_arn,
+    s3_objects_arn,
+    statement,
+)
 
 
-def setup_lambda_roles_and_policies(glue_job_name, glue_crawler_name, s3_bucket_arn):
+def trigger_statements(
+    glue_job_name, glue_crawler_names, s3_bucket_name, glue_database_name
+):
+    # Starting the job and crawlers, reading the catalog schema and partitions
+    # to decide whether to crawl, and reading the uploads' headers
+    return [
+        statement(["glue:StartJobRun"], [glue_arn("job", glue_job_name)]),
+        statement(
+            ["glue:StartCrawler", "glue:GetCrawler"],
+            [glue_arn("crawler", name) for name in glue_crawler_names],
+        ),
+        statement(
+            ["glue:GetTable", "glue:GetPartition"],
+            [
+                glue_arn("catalog"),
+                glue_arn("database", glue_database_name),
+                glue_arn("table", glue_database_name, "/*"),
+            ],
+        ),
+        statement(["s3:GetObject"], [s3_objects_arn(s3_bucket_name)]),
+        statement(["s3:ListBucket"], [s3_bucket_arn(s3_bucket_name)]),
+    ]
+
+
+def fast_path_statements(output_bucket, scripts_bucket, rejected_prefix="rejected/"):
+    # The fast path reads its tables from the registry/ document and writes
+    # the output, rejected rows and manifest entries the Glue job would
+    # otherwise write
+    return [
+        statement(["s3:GetObject"], [s3_objects_arn(scripts_bucket, "registry/")]),
+        statement(
+            ["s3:PutObject"],
+            [
+                s3_objects_arn(output_bucket),
+                s3_objects_arn(scripts_bucket, rejected_prefix),
+                s3_objects_arn(scripts_bucket, "state/manifest/"),
+            ],
+        ),
+    ]
+
+
+def failure_destination_statements(dead_letter_queue):
+    return [statement(["sqs:SendMessage"], [dead_letter_queue.arn])]
+
+
+def setup_lambda_roles_and_policies(statements):
     lambda_role = aws.iam.Role(
         "lambdaRoleForGlueTrigger",
-        assume_role_policy=json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {"Service": "lambda.amazonaws.com"},
-                        "Action": "sts:AssumeRole",
-                    }
-                ],
-            }
-        ),
+        assume_role_policy=assume_role_policy("lambda.amazonaws.com"),
     )
 
     # Attach AWSLambdaBasicExecutionRole to the lambda role
@@ -27,68 +73,14 @@ def setup_lambda_roles_and_policies(glue_job_name, glue_crawler_name, s3_bucket_
         policy_arn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole",
     )
 
-    # Create and attach a policy for Glue job execution and S3 access
-    policy_document = pulumi.Output.all(
-        glue_job_name, glue_crawler_name, s3_bucket_arn
-    ).apply(
-        lambda args: json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Action": ["glue:StartJobRun"],
-                        "Resource": [f"arn:aws:glue:*:*:job/{args[0]}"],
-                    },
-                    {
-                        "Effect": "Allow",
-                        "Action": ["glue:StartCrawler", "glue:GetCrawler"],
-                        "Resource": [f"arn:aws:glue:*:*:crawler/{args[1]}"],
-                    },
-                    {
-                        "Effect": "Allow",
-                        "Action": ["s3:GetObject", "s3:ListBucket"],
-                        "Resource": [
-                            f"arn:aws:s3:::{args[2]}/*",
-                            f"arn:aws:s3:::{args[2]}",
-                        ],
-                    },
-                ],
-            }
-        )
-    )
-    glue_policy = aws.iam.Policy("gluePolicy", policy=policy_document)
-
-    aws.iam.RolePolicyAttachment(
-        "lambdaGluePolicyAttachment", role=lambda_role.name, policy_arn=glue_policy.arn
-    )
-
-    # Additionally, create and attach a policy for S3 read access specific to the data lake bucket
-    s3_read_policy_document = s3_bucket_arn.apply(
-        lambda arn: json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Action": ["s3:GetObject"],
-                        "Resource": f"arn:aws:s3:::{arn}/*",
-                    }
-                ],
-            }
-        )
-    )
-    s3_read_policy = aws.iam.Policy(
-        "lambdaS3ReadPolicy", policy=s3_read_policy_document
-    )
-
-    aws.iam.RolePolicyAttachment(
-        "lambdaS3ReadPolicyAttachment",
-        role=lambda_role.name,
-        policy_arn=s3_read_policy.arn,
+    # Everything else the trigger does, in one policy
+    lambda_policy = aws.iam.RolePolicy(
+        "lambdaTriggerPolicy",
+        role=lambda_role.id,
+        policy=policy_document(statements),
     )
 
-    return lambda_role
+    return lambda_role, lambda_policy
 
 
 def create_lambda_function(
@@ -99,19 +91,31 @@ def create_lambda_function(
     s3_key,
     glue_crawler_name,
     glue_job_name,
-    runtime="python3.8",
+    runtime="python3.12",
+    extra_environment=None,
+    architecture="arm64",
+    memory_size=128,
+    timeout=60,
+    source_code_hash=None,
+    publish=False,
 ):
     lambda_func = aws.lambda_.Function(
         function_name,
         runtime=runtime,
+        architectures=[architecture],
+        memory_size=memory_size,
+        timeout=timeout,
+        publish=publish,
         role=role_arn,
         handler=handler_name,
         s3_bucket=s3_bucket_name,
         s3_key=s3_key,
+        source_code_hash=source_code_hash,
         environment={
             "variables": {
                 "GLUE_CRAWLER_NAME": glue_crawler_name,
                 "GLUE_JOB_NAME": glue_job_name,
+                **(extra_environment or {}),
             }
         },
     )
@@ -119,11 +123,74 @@ def create_lambda_function(
     return lambda_func
 
 
-def upload_lambda_code(bucket_name, file_path):
-    lambda_code = aws.s3.BucketObject(
-        "lambdaCode",
-        bucket=bucket_name,
-        source=pulumi.FileAsset(file_path),
-        key="lambda/",
+def setup_failure_destination(
+    lambda_function,
+    lambda_policy,
+    dead_letter_queue,
+    qualifier=None,
+    maximum_retry_attempts=2,
+    maximum_event_age_in_seconds=3600,
+):
+    # S3 notifications and EventBridge invoke the function asynchronously.
+    # Lambda retries an invocation that fails, and sends the event with its
+    # error to the dead-letter queue once the retries or its age run out.
+    # The role's policy has to allow the send before the config is created.
+    return aws.lambda_.FunctionEventInvokeConfig(
+        "lambdaEventInvokeConfig",
+        function_name=lambda_function.name,
+        qualifier=qualifier,
+        maximum_retry_attempts=maximum_retry_attempts,
+        maximum_event_age_in_seconds=maximum_event_age_in_seconds,
+        destination_config={"on_failure": {"destination": dead_letter_queue.arn}},
+        opts=pulumi.ResourceOptions(depends_on=[lambda_policy]),
+    )
+
+
+def setup_provisioned_concurrency(lambda_function, provisioned_concurrency):
+    # Provisioned concurrency applies to a published version, so triggers
+    # have to invoke the alias rather than the function itself
+    alias = aws.lambda_.Alias(
+        "lambdaLiveAlias",
+        name="live",
+        function_name=lambda_function.name,
+        function_version=lambda_function.version,
     )
-    return lambda_code
+
+    aws.lambda_.ProvisionedConcurrencyConfig(
+        "lambdaProvisionedConcurrency",
+        function_name=lambda_function.name,
+        qualifier=alias.name,
+        provisioned_concurrent_executions=provisioned_concurrency,
+    )
+    return alias
+
+
+def build_lambda_package(source_dir, output_path, extra_files=()):
+    # Packages the handler sources only, boto3 and botocore already ship with
+    # the Lambda Python runtime. extra_files, e.g. shared modules, are added
+    # at the root of the archive. Entries get fixed timestamps and
+    # permissions, so unchanged sources build a byte-identical archive and
+    # the returned hash only changes with the code.
+    sources = {
+        name: os.path.join(source_dir, name)
+        for name in os.listdir(source_dir)
+        if name.endswith(".py") and os.path.isfile(os.path.join(source_dir, name))
+    }
+    sources.update({os.path.basename(path): path for path in extra_files})
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as package:
+        for name, path in sorted(sources.items()):
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, "rb") as source:
+                package.writestr(info, source.read())
+
+    with open(output_path, "rb") as package:
+        code_hash = base64.b64encode(hashlib.sha256(package.read()).digest()).decode()
+    return output_path, code_hash
+
+
+def upload_lambda_code(bucket_name, file_path):
+    return upload_artifact("lambdaCode", bucket_name, file_path, "lambda")
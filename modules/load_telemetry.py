@@ -0,0 +1,201 @@
+# Parses Snowflake COPY_HISTORY and PIPE_USAGE_HISTORY result sets into load
+# metrics and compares Snowpipe against a scheduled COPY task for the same
+# volume. Rows are dicts keyed by the upper-case column names, as returned by
+# a DictCursor or read from a CSV export, so everything here runs offline.
+
+import datetime
+import math
+import re
+
+# Credits per hour of each warehouse size
+WAREHOUSE_CREDITS_PER_HOUR = {
+    "X-SMALL": 1,
+    "SMALL": 2,
+    "MEDIUM": 4,
+    "LARGE": 8,
+    "X-LARGE": 16,
+    "2X-LARGE": 32,
+    "3X-LARGE": 64,
+    "4X-LARGE": 128,
+}
+
+# A resumed warehouse is billed for at least this long
+MINIMUM_BILLED_SECONDS = 60
+
+# GB a warehouse loads per credit with COPY, independent of its size as long
+# as there are enough files to keep its threads busy. A rough starting point;
+# measure it on a backfill of your own files and pass it in.
+DEFAULT_COPY_GB_PER_CREDIT = 10.0
+
+GB = 1024**3
+
+
+def parse_timestamp(value):
+    # Result sets hold datetimes, CSV exports strings like
+    # "2024-05-01 10:00:00.123 -0700"
+    if value in (None, ""):
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    value = re.sub(r"\s+([+-]\d{2}):?(\d{2})$", r"\1:\2", str(value).strip())
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _number(value):
+    return float(value) if value not in (None, "") else 0.0
+
+
+def file_loads(copy_history):
+    # One record per file of COPY_HISTORY, with the seconds between Snowpipe
+    # receiving its notification and the load for pipe loads
+    files = []
+    for row in copy_history:
+        received = parse_timestamp(row.get("PIPE_RECEIVED_TIME"))
+        loaded = parse_timestamp(row.get("LAST_LOAD_TIME"))
+        files.append(
+            {
+                "file": row["FILE_NAME"],
+                "table": row.get("TABLE_NAME"),
+                "pipe": row.get("PIPE_NAME") or None,
+                "status": row.get("STATUS"),
+                "bytes": int(_number(row.get("FILE_SIZE"))),
+                "rows": int(_number(row.get("ROW_COUNT"))),
+                "errors": int(_number(row.get("ERROR_COUNT"))),
+                "received": received,
+                "loaded": loaded,
+                "latency_seconds": (
+                    (loaded - received).total_seconds() if received and loaded else None
+                ),
+            }
+        )
+    return files
+
+
+def pipe_usage(pipe_usage_history):
+    # Credits, bytes and files per pipe over the rows of PIPE_USAGE_HISTORY
+    pipes = {}
+    for row in pipe_usage_history:
+        pipe = pipes.setdefault(
+            row["PIPE_NAME"],
+            {"credits": 0.0, "bytes": 0, "files": 0, "start": None, "end": None},
+        )
+        pipe["credits"] += _number(row.get("CREDITS_USED"))
+        pipe["bytes"] += int(_number(row.get("BYTES_INSERTED")))
+        pipe["files"] += int(_number(row.get("FILES_INSERTED")))
+        start = parse_timestamp(row.get("START_TIME"))
+        end = parse_timestamp(row.get("END_TIME"))
+        if start and (pipe["start"] is None or start < pipe["start"]):
+            pipe["start"] = start
+        if end and (pipe["end"] is None or end > pipe["end"]):
+            pipe["end"] = end
+
+    for pipe in pipes.values():
+        pipe["credits_per_gb"] = (
+            pipe["credits"] / (pipe["bytes"] / GB) if pipe["bytes"] else None
+        )
+    return pipes
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile, None for no values
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def load_metrics(files, pipes):
+    latencies = [
+        f["latency_seconds"] for f in files if f["latency_seconds"] is not None
+    ]
+    total_bytes = sum(f["bytes"] for f in files if f["status"] != "Load failed")
+    credits = sum(p["credits"] for p in pipes.values())
+    pipe_bytes = sum(p["bytes"] for p in pipes.values())
+    starts = [p["start"] for p in pipes.values() if p["start"]]
+    ends = [p["end"] for p in pipes.values() if p["end"]]
+    return {
+        "files": len(files),
+        "failed_files": sum(1 for f in files if f["status"] != "Loaded"),
+        "rows": sum(f["rows"] for f in files),
+        # Bytes of the files that were loaded, in full or in part
+        "bytes": total_bytes,
+        "mean_file_mb": (
+            sum(f["bytes"] for f in files) / len(files) / 1024 / 1024 if files else None
+        ),
+        "latency_p50_seconds": percentile(latencies, 0.5),
+        "latency_p95_seconds": percentile(latencies, 0.95),
+        "latency_max_seconds": max(latencies) if latencies else None,
+        "credits": credits,
+        "credits_per_gb": credits / (pipe_bytes / GB) if pipe_bytes else None,
+        "credits_per_1000_files": (
+            credits / sum(p["files"] for p in pipes.values()) * 1000
+            if sum(p["files"] for p in pipes.values())
+            else None
+        ),
+        "window_hours": (
+            (max(ends) - min(starts)).total_seconds() / 3600 if starts else None
+        ),
+    }
+
+
+def copy_task_credits(
+    total_bytes,
+    window_hours,
+    schedule_minutes,
+    warehouse_size="X-SMALL",
+    auto_suspend_seconds=120,
+    gb_per_credit=DEFAULT_COPY_GB_PER_CREDIT,
+):
+    # Credits a COPY task on the given schedule would use for the same bytes:
+    # each run bills at least a minute plus the idle time before suspending
+    credits_per_hour = WAREHOUSE_CREDITS_PER_HOUR[warehouse_size]
+    runs = max(1, math.ceil(window_hours * 60 / schedule_minutes))
+    load_seconds = (total_bytes / GB) / gb_per_credit / credits_per_hour * 3600
+    billed_seconds = runs * (
+        max(MINIMUM_BILLED_SECONDS, load_seconds / runs) + auto_suspend_seconds
+    )
+    return billed_seconds / 3600 * credits_per_hour
+
+
+def recommend_ingestion(
+    metrics,
+    schedule_minutes=60,
+    warehouse_size="X-SMALL",
+    auto_suspend_seconds=120,
+    gb_per_credit=DEFAULT_COPY_GB_PER_CREDIT,
+    max_latency_seconds=None,
+):
+    # Picks the cheaper of Snowpipe, as measured, and a COPY task on the given
+    # schedule, unless the schedule alone would break the latency target
+    if not metrics["bytes"] or not metrics["window_hours"]:
+        return {"ingestion": "snowpipe", "reason": "no loads to compare"}
+
+    task_credits = copy_task_credits(
+        metrics["bytes"],
+        metrics["window_hours"],
+        schedule_minutes,
+        warehouse_size,
+        auto_suspend_seconds,
+        gb_per_credit,
+    )
+    recommendation = {
+        "snowpipe_credits": metrics["credits"],
+        "copy_task_credits": task_credits,
+    }
+    if max_latency_seconds is not None and schedule_minutes * 60 > max_latency_seconds:
+        return dict(
+            recommendation,
+            ingestion="snowpipe",
+            reason=f"a {schedule_minutes} minute schedule exceeds the latency target",
+        )
+    if task_credits < metrics["credits"]:
+        return dict(
+            recommendation,
+            ingestion="copy_task",
+            reason="the COPY task uses fewer credits for the same bytes",
+        )
+    return dict(
+        recommendation,
+        ingestion="snowpipe",
+        reason="Snowpipe uses fewer credits for the same bytes",
+    )
@@ -0,0 +1,262 @@
+import json
+import pulumi
+import pulumi_aws as aws
+from shared.metrics import NAMESPACE, metric_unit
+
+# Metrics of the Glue job's EMF lines (see shared/metrics.py), extracted by
+# log metric filters since only Lambda turns EMF lines into metrics by itself
+GLUE_TABLE_METRICS = [
+    "RowsIn",
+    "RowsOut",
+    "RowsRejected",
+    "FilesWritten",
+    "BytesWritten",
+    "InputFiles",
+    "InputBytes",
+    "DiscoveryMilliseconds",
+    "FilesCompacted",
+    "FilesQuarantined",
+    "BatchesQuarantined",
+    "QualityMilliseconds",
+    "FilesRechunked",
+    "RechunkedBytes",
+    "RechunkMilliseconds",
+    "TableMilliseconds",
+    "TableFailed",
+]
+GLUE_JOB_METRICS = ["JobRunMilliseconds", "JobRunFailed"]
+
+
+def setup_glue_job_log_group():
+    # Continuous logging target of the Glue job. Named under /aws-glue/, where
+    # the AWSGlueServiceRole policy lets the job write.
+    retention_days = pulumi.Config().get_int("log_retention_days") or 30
+    return aws.cloudwatch.LogGroup(
+        "glueJobLogGroup",
+        name_prefix="/aws-glue/jobs/etl-pipeline-",
+        retention_in_days=retention_days,
+    )
+
+
+def setup_glue_metric_filters(log_group):
+    filters = []
+    for name in GLUE_TABLE_METRICS + GLUE_JOB_METRICS:
+        per_table = name in GLUE_TABLE_METRICS
+        filters.append(
+            aws.cloudwatch.LogMetricFilter(
+                f"glueJob{name}Filter",
+                log_group_name=log_group.name,
+                pattern=f'{{ ($.Component = "glue_job") && ($.{name} = *) }}',
+                metric_transformation=aws.cloudwatch.LogMetricFilterMetricTransformationArgs(
+                    name=name,
+                    namespace=NAMESPACE,
+                    value=f"$.{name}",
+                    unit=metric_unit(name),
+                    dimensions={"Table": "$.Table"} if per_table else None,
+                ),
+            )
+        )
+    return filters
+
+
+def _metric_widget(title, metrics, region, stat="Sum", x=0, y=0):
+    return {
+        "type": "metric",
+        "x": x,
+        "y": y,
+        "width": 12,
+        "height": 6,
+        "properties": {
+            "title": title,
+            "region": region,
+            "stat": stat,
+            "period": 300,
+            "view": "timeSeries",
+            "metrics": metrics,
+        },
+    }
+
+
+def dashboard_body(function_name, table_names, region):
+    trigger = ["Component", "trigger"]
+    widgets = [
+        _metric_widget(
+            "Trigger events",
+            [
+                [NAMESPACE, name, *trigger]
+                for name in (
+                    "EventsReceived",
+                    "CrawlerStarts",
+                    "JobRunsStarted",
+                    "JobStartsDeferred",
+                    "JobStartFailures",
+                    "GlueApiRetries",
+                )
+            ],
+            region,
+        ),
+        _metric_widget(
+            "Trigger and crawler time",
+            [
+                [NAMESPACE, "TriggerMilliseconds", *trigger, {"stat": "p95"}],
+                [NAMESPACE, "CrawlerRunSeconds", *trigger, {"stat": "Maximum"}],
+                ["AWS/Lambda", "Errors", "FunctionName", function_name],
+            ],
+            region,
+            x=12,
+        ),
+        _metric_widget(
+            "Glue job runs",
+            [
+                [NAMESPACE, "JobRunMilliseconds", {"stat": "Maximum"}],
+                [NAMESPACE, "JobRunFailed"],
+            ],
+            region,
+            y=6,
+        ),
+        _metric_widget(
+            "Rows per table",
+            [
+                [NAMESPACE, name, "Table", table]
+                for table in table_names
+                for name in ("RowsIn", "RowsOut", "RowsRejected")
+            ],
+            region,
+            x=12,
+            y=6,
+        ),
+        _metric_widget(
+            "Output per table",
+            [
+                [NAMESPACE, name, "Table", table]
+                for table in table_names
+                for name in (
+                    "FilesWritten",
+                    "BytesWritten",
+                    "FilesQuarantined",
+                    "BatchesQuarantined",
+                )
+            ],
+            region,
+            y=12,
+        ),
+        _metric_widget(
+            "Table processing time",
+            [[NAMESPACE, "TableMilliseconds", "Table", t] for t in table_names],
+            region,
+            stat="Maximum",
+            x=12,
+            y=12,
+        ),
+    ]
+    return json.dumps({"widgets": widgets})
+
+
+def setup_dashboard(lambda_function, tables):
+    # Snowpipe and COPY task loads are reported by Snowflake, see
+    # modules/load_telemetry.py
+    region = aws.config.region or "us-east-1"
+    table_names = [table["name"] for table in tables]
+    return aws.cloudwatch.Dashboard(
+        "etlPipelineDashboard",
+        dashboard_name=pulumi.Output.concat(pulumi.get_stack(), "-etl-pipeline"),
+        dashboard_body=lambda_function.name.apply(
+            lambda name: dashboard_body(name, table_names, region)
+        ),
+    )
+
+
+def setup_alarms(lambda_function, tables, dead_letter_queue=None):
+    # Alarms notify the SNS topic set as alarm_topic_arn, if any
+    config = pulumi.Config()
+    actions = [config.get("alarm_topic_arn")] if config.get("alarm_topic_arn") else []
+
+    def alarm(resource_name, metric_name, namespace, dimensions, threshold=1):
+        return aws.cloudwatch.MetricAlarm(
+            resource_name,
+            namespace=namespace,
+            metric_name=metric_name,
+            dimensions=dimensions,
+            statistic="Sum",
+            period=300,
+            evaluation_periods=1,
+            threshold=threshold,
+            comparison_operator="GreaterThanOrEqualToThreshold",
+            treat_missing_data="notBreaching",
+            alarm_actions=actions,
+            ok_actions=actions,
+        )
+
+    alarms = [
+        alarm(
+            "triggerErrorsAlarm",
+            "Errors",
+            "AWS/Lambda",
+            {"FunctionName": lambda_function.name},
+        ),
+        alarm(
+            "jobStartFailuresAlarm",
+            "JobStartFailures",
+            NAMESPACE,
+            {"Component": "trigger"},
+        ),
+        alarm("jobRunFailedAlarm", "JobRunFailed", NAMESPACE, None),
+    ]
+
+    # Any event in the dead-letter queue is an upload no job run will pick up
+    # on its own
+    if dead_letter_queue is not None:
+        alarms.append(
+            aws.cloudwatch.MetricAlarm(
+                "triggerDeadLetterQueueAlarm",
+                namespace="AWS/SQS",
+                metric_name="ApproximateNumberOfMessagesVisible",
+                dimensions={"QueueName": dead_letter_queue.name},
+                statistic="Maximum",
+                period=300,
+                evaluation_periods=1,
+                threshold=1,
+                comparison_operator="GreaterThanOrEqualToThreshold",
+                treat_missing_data="notBreaching",
+                alarm_actions=actions,
+                ok_actions=actions,
+            )
+        )
+
+    # A quarantined file is skipped until it is fixed and uploaded again
+    for table in tables:
+        alarms.append(
+            alarm(
+                f"{table['name']}FilesQuarantinedAlarm",
+                "FilesQuarantined",
+                NAMESPACE,
+                {"Table": table["name"]},
+            )
+        )
+
+    # A batch that failed its quality checks is written aside, not loaded
+    if config.get_bool("data_quality"):
+        for table in tables:
+            alarms.append(
+                alarm(
+                    f"{table['name']}BatchesQuarantinedAlarm",
+                    "BatchesQuarantined",
+                    NAMESPACE,
+                    {"Table": table["name"]},
+                )
+            )
+
+    # Rejected rows only alarm above a threshold, a few are expected
+    rejected_rows_threshold = config.get_int("rejected_rows_alarm_threshold")
+    if rejected_rows_threshold:
+        for table in tables:
+            alarms.append(
+                alarm(
+                    f"{table['name']}RejectedRowsAlarm",
+                    "RowsRejected",
+                    NAMESPACE,
+                    {"Table": table["name"]},
+                    rejected_rows_threshold,
+                )
+            )
+    return alarms
@@ -0,0 +1,84 @@
+import json
+import pulumi
+
+# IAM policy documents built from statement specs. Each module lists the
+# actions its role needs on the resources it names; the specs of one role are
+# rendered into a single document in one step, merging statements that grant
+# the same resources or the same actions and sorting both, so a role carries
+# one stable policy that only changes when its access does.
+
+
+def statement(actions, resources, effect="Allow", principal=None, condition=None):
+    # Resources may be outputs, e.g. a queue's ARN
+    return {
+        "effect": effect,
+        "actions": list(actions),
+        "resources": list(resources),
+        "principal": principal,
+        "condition": condition,
+    }
+
+
+def s3_bucket_arn(bucket):
+    return pulumi.Output.concat("arn:aws:s3:::", bucket)
+
+
+def s3_objects_arn(bucket, prefix=""):
+    return pulumi.Output.concat("arn:aws:s3:::", bucket, "/", prefix, "*")
+
+
+def glue_arn(kind, name="", suffix=""):
+    # arn:aws:glue:*:*:catalog, ...:job/<name>, ...:table/<database>/*
+    if not name:
+        return f"arn:aws:glue:*:*:{kind}"
+    return pulumi.Output.concat("arn:aws:glue:*:*:", kind, "/", name, suffix)
+
+
+def merge_statements(statements, same, merged):
+    # Statements equal in everything but the merged field become one
+    groups = {}
+    for item in statements:
+        key = json.dumps([item[field] for field in same], sort_keys=True)
+        if key in groups:
+            groups[key][merged] = sorted(set(groups[key][merged] + item[merged]))
+        else:
+            groups[key] = dict(item, **{merged: sorted(set(item[merged]))})
+    return list(groups.values())
+
+
+def render_policy(statements):
+    conditions = ["effect", "principal", "condition"]
+    statements = merge_statements(statements, conditions + ["resources"], "actions")
+    statements = merge_statements(statements, conditions + ["actions"], "resources")
+    document = []
+    for item in statements:
+        rendered = {"Effect": item["effect"]}
+        if item["principal"]:
+            rendered["Principal"] = item["principal"]
+        rendered["Action"] = item["actions"]
+        rendered["Resource"] = item["resources"]
+        if item["condition"]:
+            rendered["Condition"] = item["condition"]
+        document.append(rendered)
+    return json.dumps({"Version": "2012-10-17", "Statement": document})
+
+
+def policy_document(statements):
+    # Waits on the outputs of all statements at once, instead of one apply
+    # per policy
+    return pulumi.Output.from_input(list(statements)).apply(render_policy)
+
+
+def assume_role_policy(service):
+    return json.dumps(
+        {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Principal": {"Service": service},
+                    "Action": "sts:AssumeRole",
+                }
+            ],
+        }
+    )
@@ -0,0 +1,208 @@
+import json
+import pulumi
+
+CUSTOMERS_COLUMNS = [
+    {"name": "customerid", "type": "NUMBER"},
+    {"name": "namestyle", "type": "BOOLEAN"},
+    {"name": "title", "type": "STRING"},
+    {"name": "firstname", "type": "STRING"},
+    {"name": "middlename", "type": "STRING"},
+    {"name": "lastname", "type": "STRING"},
+    {"name": "suffix", "type": "STRING"},
+    {"name": "companyname", "type": "STRING"},
+    {"name": "salesperson", "type": "STRING"},
+    {"name": "emailaddress", "type": "STRING"},
+    {"name": "phone", "type": "STRING"},
+    {"name": "passwordhash", "type": "STRING"},
+    {"name": "passwordsalt", "type": "STRING"},
+    # Stored without the braces of the SQL Server uniqueidentifier
+    {"name": "rowguid", "type": "STRING", "transform": "strip_braces"},
+    {"name": "modifieddate", "type": "TIMESTAMP"},
+]
+
+
+def load_table_registry(default_source_table, layout):
+    # Each entry maps a catalog table (and its data lake prefix) to an output
+    # prefix and a Snowflake table. The Glue job, the trigger Lambda and the
+    # Snowflake module are all generated from this list. Prefixes default to
+    # the entity's folders of the bucket layout, see modules/s3.py.
+    dated = layout["layout"] == "dated"
+    tables = pulumi.Config().get_object("tables")
+    if not tables:
+        tables = [
+            {
+                "name": "customers",
+                # The crawler names the table of raw/customers/ after it
+                "source_table": "customers" if dated else default_source_table,
+                "input_prefix": f"{layout['raw_prefix']}customers/" if dated else "",
+                "output_prefix": (
+                    f"{layout['processed_prefix']}customers/" if dated else "output/"
+                ),
+                "columns": CUSTOMERS_COLUMNS,
+                "key": ["customerid"],
+                "version_column": "modifieddate",
+                # Credentials stay in the data lake
+                "drop_columns": ["passwordhash", "passwordsalt"],
+                # Thresholds of the data_quality checks, see glue/glue_job.py
+                "quality": {
+                    "patterns": {
+                        "emailaddress": "email",
+                        "phone": "phone",
+                        "rowguid": "guid",
+                    },
+                    "max_null_rate": {"customerid": 0, "modifieddate": 0},
+                    "min_conformance": {"*": 0.95},
+                },
+                # Kept from the single-table job so its bookmarks stay valid
+                "transformation_ctx": "datasource0",
+            }
+        ]
+
+    registry = []
+    for table in tables:
+        name = table["name"]
+        registry.append(
+            {
+                "name": name,
+                "source_table": table.get("source_table", name),
+                "input_prefix": table.get(
+                    "input_prefix", f"{layout['raw_prefix']}{name}/"
+                ),
+                "output_prefix": table.get(
+                    "output_prefix", f"{layout['processed_prefix']}{name}/"
+                ),
+                "rejected_prefix": f"{layout['rejected_prefix']}{name}/",
+                "snowflake_table": table.get("snowflake_table", name),
+                "columns": table["columns"],
+                # Rows are deduplicated on the key, keeping the latest
+                # version_column, and merged into Snowflake on it
+                "key": table.get("key", []),
+                "version_column": table.get("version_column"),
+                # Source columns the Glue job drops right after reading and
+                # that are left out of the Snowflake table, a Spark SQL
+                # predicate on the source columns for the rows to keep, and
+                # a partition predicate for partitioned catalog tables
+                "drop_columns": [c.lower() for c in table.get("drop_columns", [])],
+                "row_filter": table.get("row_filter", ""),
+                "push_down_predicate": table.get("push_down_predicate", ""),
+                "transformation_ctx": table.get(
+                    "transformation_ctx", f"datasource_{name}"
+                ),
+                # Patterns and thresholds the data_quality checks apply
+                "quality": table.get("quality", {}),
+            }
+        )
+    return registry
+
+
+def loaded_columns(table):
+    # Columns of the Snowflake table, i.e. the source columns the job keeps
+    return [c for c in table["columns"] if c["name"] not in table["drop_columns"]]
+
+
+def column_types_argument(columns):
+    # Renders a column list as the column_types option of the Glue job
+    return ",".join(
+        ":".join(
+            [column["name"], column["type"]]
+            + ([column["transform"]] if column.get("transform") else [])
+        )
+        for column in columns
+    )
+
+
+def job_tables_argument(
+    tables, data_lake_bucket, output_bucket, scripts_bucket, data_quality=False
+):
+    # Renders the registry as the --tables argument of the Glue job. With
+    # data_quality, the batches of each table with checks are checked and
+    # their reports written to the output bucket's _quality/ prefix, outside
+    # the tables' outputs.
+    return pulumi.Output.all(data_lake_bucket, output_bucket, scripts_bucket).apply(
+        lambda args: json.dumps(
+            [
+                {
+                    "name": table["name"],
+                    "table_name": table["source_table"],
+                    "input_path": f"s3://{args[0]}/{table['input_prefix']}",
+                    "output_path": f"s3://{args[1]}/{table['output_prefix']}",
+                    "manifest_path": f"s3://{args[2]}/state/manifest/{table['name']}/",
+                    "rejected_path": f"s3://{args[2]}/{table['rejected_prefix']}",
+                    "staging_path": f"s3://{args[2]}/staging/{table['name']}/",
+                    "quarantine_path": (
+                        f"s3://{args[2]}/{table['rejected_prefix']}_quarantine/"
+                    ),
+                    "column_types": column_types_argument(table["columns"]),
+                    "transformation_ctx": table["transformation_ctx"],
+                    "dedup_keys": ",".join(table["key"]),
+                    "dedup_order": table["version_column"] or "",
+                    "drop_columns": ",".join(table["drop_columns"]),
+                    "row_filter": table["row_filter"],
+                    "push_down_predicate": table["push_down_predicate"],
+                    # Left out for tables without checks, so their batches are
+                    # neither profiled nor kept from the fast path
+                    **(
+                        {
+                            "quality": json.dumps(table["quality"]),
+                            "quality_path": (
+                                f"s3://{args[1]}/_quality/{table['name']}/"
+                            ),
+                        }
+                        if data_quality and table["quality"]
+                        else {}
+                    ),
+                }
+                for table in tables
+            ]
+        )
+    )
+
+
+def fast_path_tables_document(
+    tables, data_lake_bucket, output_bucket, scripts_bucket, data_quality=False
+):
+    # The part of the --tables argument the trigger Lambda's fast path reads,
+    # for the tables it can convert, with the buckets given once. Uploaded to
+    # S3 rather than set in the function's environment, which Lambda limits
+    # to 4 KB in all.
+    return pulumi.Output.all(data_lake_bucket, output_bucket, scripts_bucket).apply(
+        lambda args: json.dumps(
+            {
+                "data_lake_bucket": args[0],
+                "output_bucket": args[1],
+                "scripts_bucket": args[2],
+                "tables": {
+                    table["name"]: {
+                        "input_prefix": table["input_prefix"],
+                        "output_prefix": table["output_prefix"],
+                        "rejected_prefix": table["rejected_prefix"],
+                        "column_types": column_types_argument(table["columns"]),
+                        "drop_columns": ",".join(table["drop_columns"]),
+                        "dedup_keys": ",".join(table["key"]),
+                        "dedup_order": table["version_column"] or "",
+                    }
+                    for table in tables
+                    # Spark SQL row filters need the Glue job, and batches
+                    # of tables with checks are checked there
+                    if not table["row_filter"]
+                    and not (data_quality and table["quality"])
+                },
+            },
+            separators=(",", ":"),
+        )
+    )
+
+
+def lambda_tables_environment(tables):
+    # Data lake prefixes and catalog tables for the trigger Lambda's schema
+    # check, and the registry names it records uploads under in the inventory
+    return json.dumps(
+        [
+            {
+                "name": table["name"],
+                "input_prefix": table["input_prefix"],
+                "table_name": table["source_table"],
+            }
+            for table in tables
+        ]
+    )
@@ -3,11 +3,125 @@ import pulumi_aws as aws
 
 config = pulumi.Config()
 
-def setup_s3_buckets():
+LAYOUTS = ("flat", "dated")
+
+# Storage classes S3 only transitions objects to after 30 days
+INFREQUENT_ACCESS_CLASSES = ("STANDARD_IA", "ONEZONE_IA")
+
+# Scripts bucket prefixes of short-lived objects, the re-chunked parts and the
+# compaction pass's temporary output. Runs delete them, a failed run may not.
+TEMPORARY_PREFIXES = ("staging/", "state/compaction/")
+TEMPORARY_OBJECT_DAYS = 7
+
+
+def _prefix(value):
+    return value.strip("/") + "/"
+
+
+def bucket_layout():
+    # Where the pipeline's objects go. "flat" (default) takes the inputs from
+    # anywhere under the registry's input prefixes. "dated" takes them from
+    # raw/<entity>/dt=YYYY-MM-DD/ and puts the output under
+    # processed/<entity>/ and rejected rows under rejected/<entity>/, so the
+    # notifications, the crawler and the job each cover a bounded prefix.
+    layout = config.get("bucket_layout") or "flat"
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown bucket layout: {layout}")
+    if layout == "flat":
+        return {
+            "layout": layout,
+            "raw_prefix": "",
+            "processed_prefix": "",
+            "rejected_prefix": "rejected/",
+        }
+    return {
+        "layout": layout,
+        "raw_prefix": _prefix(config.get("raw_prefix") or "raw/"),
+        "processed_prefix": _prefix(config.get("processed_prefix") or "processed/"),
+        "rejected_prefix": _prefix(config.get("rejected_prefix") or "rejected/"),
+    }
+
+
+def lifecycle_rules(prefix_rules=()):
+    # Every bucket is versioned, so overwritten and deleted objects, e.g. the
+    # output files compaction replaces and the code of earlier deploys, are
+    # kept as noncurrent versions until they expire. Incomplete multipart
+    # uploads are billed until they are aborted.
+    noncurrent_days = config.get_int("noncurrent_version_days")
+    if noncurrent_days is None:
+        noncurrent_days = 30
+    rules = [
+        aws.s3.BucketLifecycleRuleArgs(
+            id="abort-uploads-and-expire-old-versions",
+            enabled=True,
+            abort_incomplete_multipart_upload_days=config.get_int(
+                "abort_multipart_upload_days"
+            )
+            or 7,
+            noncurrent_version_expiration=(
+                aws.s3.BucketLifecycleRuleNoncurrentVersionExpirationArgs(
+                    days=noncurrent_days
+                )
+                if noncurrent_days
+                else None
+            ),
+        )
+    ]
+    return rules + list(prefix_rules)
+
+
+def raw_lifecycle_rules(raw_prefix):
+    # Inputs are read once by the trigger and the job, so they move to a
+    # cheaper storage class after raw_transition_days and optionally expire
+    rules = []
+    transition_days = config.get_int("raw_transition_days")
+    if transition_days is None:
+        transition_days = 30
+    storage_class = config.get("raw_storage_class") or "STANDARD_IA"
+    if (
+        transition_days
+        and transition_days < 30
+        and (storage_class in INFREQUENT_ACCESS_CLASSES)
+    ):
+        pulumi.log.warn(
+            f"S3 transitions objects to {storage_class} after 30 days at the "
+            "earliest, the raw transition is turned off"
+        )
+        transition_days = 0
+    if transition_days:
+        rules.append(
+            aws.s3.BucketLifecycleRuleArgs(
+                id="transition-raw-inputs",
+                enabled=True,
+                prefix=raw_prefix or None,
+                transitions=[
+                    aws.s3.BucketLifecycleRuleTransitionArgs(
+                        days=transition_days, storage_class=storage_class
+                    )
+                ],
+            )
+        )
+    expiration_days = config.get_int("raw_expiration_days")
+    if expiration_days:
+        rules.append(
+            aws.s3.BucketLifecycleRuleArgs(
+                id="expire-raw-inputs",
+                enabled=True,
+                prefix=raw_prefix or None,
+                expiration=aws.s3.BucketLifecycleRuleExpirationArgs(
+                    days=expiration_days
+                ),
+            )
+        )
+    return rules
+
+
+def setup_s3_buckets(layout):
     data_lake_bucket = aws.s3.Bucket(
         "dataLakeBucket",
         bucket=config.require("s3_bucket_name"),
         versioning=aws.s3.BucketVersioningArgs(enabled=True),
+        lifecycle_rules=lifecycle_rules(raw_lifecycle_rules(layout["raw_prefix"])),
         tags={"Environment": config.require("environment")},
     )
 
@@ -15,6 +129,7 @@ def setup_s3_buckets():
         "OutputBucket",
         bucket=config.require("output_bucket_name"),
         versioning=aws.s3.BucketVersioningArgs(enabled=True),
+        lifecycle_rules=lifecycle_rules(),
         tags={"Environment": config.require("environment")},
     )
 
@@ -22,7 +137,42 @@ def setup_s3_buckets():
         "scriptsBucket",
         bucket=config.require("scripts_bucket_name"),
         versioning=aws.s3.BucketVersioningArgs(enabled=True),
+        lifecycle_rules=lifecycle_rules(
+            aws.s3.BucketLifecycleRuleArgs(
+                id=f"expire-{prefix.strip('/').replace('/', '-')}",
+                enabled=True,
+                prefix=prefix,
+                expiration=aws.s3.BucketLifecycleRuleExpirationArgs(
+                    days=TEMPORARY_OBJECT_DAYS
+                ),
+            )
+            for prefix in TEMPORARY_PREFIXES
+        ),
         tags={"Purpose": "Lambda and Glue Scripts"},
     )
 
     return data_lake_bucket, output_bucket, scripts_bucket
+
+
+# Buckets whose notification is set up
+notified_buckets = set()
+
+
+def setup_bucket_notification(
+    name, bucket, queues=(), lambda_functions=(), depends_on=()
+):
+    # S3 keeps one notification configuration per bucket and each update
+    # replaces it whole, so a second resource on the same bucket would
+    # silently drop the first one's targets. All of a bucket's queues and
+    # functions go into one resource instead.
+    if bucket in notified_buckets:
+        raise ValueError(f"A notification is already set up for {name}'s bucket")
+    notified_buckets.add(bucket)
+
+    return aws.s3.BucketNotification(
+        name,
+        bucket=bucket.bucket,
+        queues=list(queues) or None,
+        lambda_functions=list(lambda_functions) or None,
+        opts=pulumi.ResourceOptions(depends_on=list(depends_on)),
+    )
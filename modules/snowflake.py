@@ -1,42 +1,89 @@
-import json
 import pulumi
 import pulumi_aws as aws
 import pulumi_snowflake as snowflake
+from modules.policies import policy_document, s3_bucket_arn, s3_objects_arn, statement
+from modules.registry import loaded_columns
 
 ROLE_NAME = "snowflake-storage-integration"
 
 config = pulumi.Config()
 
-def setup_snowflake_resources(s3_bucket_name):
-    snowflake_user = aws.iam.User("snowflakeUser")
+# Snowflake file format options for each output format of the Glue job. The
+# Parquet output is partitioned into folders that also hold Spark's _SUCCESS
+# markers, so only the data files are matched.
+FILE_FORMATS = {
+    "json": {"stage": "TYPE = JSON", "copy": "FILE_FORMAT = (TYPE = 'JSON')"},
+    "parquet": {
+        "stage": "TYPE = PARQUET",
+        "copy": "FILE_FORMAT = (TYPE = 'PARQUET')\n    PATTERN = '.*[.]parquet'",
+    },
+}
 
-    s3_policy_document = s3_bucket_name.apply(
-        lambda arn: json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Action": [
-                            "s3:GetBucketLocation",
-                            "s3:GetObject",
-                            "s3:GetObjectVersion",
-                            "s3:ListBucket",
-                        ],
-                        "Resource": [f"arn:aws:s3:::{arn}/*", f"arn:aws:s3:::{arn}"],
-                    }
-                ],
-            }
-        )
-    )
+# "append" loads the output straight into each table. "merge" lands it in a
+# staging table and a task merges the new staging rows into the table on the
+# registry key, so re-uploaded or overlapping files update rows in place
+# instead of adding duplicates. Tables without a key are always appended to.
+LOAD_MODES = ("append", "merge")
 
-    # Create the IAM policy with the dynamically created policy document
-    s3_policy = aws.iam.Policy("s3Policy", policy=s3_policy_document)
+# "snowpipe" loads each output file as it arrives through an auto-ingest pipe.
+# "copy_task" loads on a schedule with COPY INTO on the warehouse, which
+# costs less than Snowpipe's per-file overhead for large backfills of big
+# files; COPY's load metadata skips files loaded by earlier runs.
+INGESTION_MODES = ("snowpipe", "copy_task")
+
+
+def merge_statement(target, stream, columns, key, version_column=None):
+    # Latest row per key among the new rows, merged into the target. With a
+    # version column an older row never overwrites a newer one.
+    names = [f'"{column["name"]}"' for column in columns]
+    keys = [f'"{name}"' for name in key]
+    order = f'"{version_column}" DESC NULLS LAST' if version_column else ", ".join(keys)
+    matched = "WHEN MATCHED"
+    if version_column:
+        matched += f' AND source."{version_column}" >= target."{version_column}"'
+    return f"""
+    MERGE INTO {target} AS target
+    USING (
+        SELECT {", ".join(names)} FROM {stream}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY {", ".join(keys)} ORDER BY {order}) = 1
+    ) AS source
+    ON {" AND ".join(f"target.{k} = source.{k}" for k in keys)}
+    {matched} THEN UPDATE SET {", ".join(f"target.{n} = source.{n}" for n in names)}
+    WHEN NOT MATCHED THEN INSERT ({", ".join(names)})
+        VALUES ({", ".join(f"source.{n}" for n in names)})
+    """
+
+
+def merge_task_statement(target, stream, staging, columns, key, version_column=None):
+    # The MERGE and the deletion of the staging rows it merged commit
+    # together. Every query of the stream within the transaction returns the
+    # same rows, so rows the pipe loads meanwhile stay for the next run.
+    names = [f'"{column["name"]}"' for column in columns]
+    merge = merge_statement(target, stream, columns, key, version_column).strip()
+    return f"""
+BEGIN
+    BEGIN TRANSACTION;
+    {merge};
+    DELETE FROM {staging} AS staging
+    USING (SELECT DISTINCT {", ".join(names)} FROM {stream}) AS merged
+    WHERE {" AND ".join(f"EQUAL_NULL(staging.{n}, merged.{n})" for n in names)};
+    COMMIT;
+END;
+    """
 
-    # Attach policy to the user
-    user_policy_attachment = aws.iam.UserPolicyAttachment(
-        "userPolicyAttachment", user=snowflake_user.name, policy_arn=s3_policy.arn
-    )
+
+def setup_snowflake_resources(s3_bucket_name, tables, output_format="json"):
+    file_format = FILE_FORMATS[output_format]
+
+    load_mode = config.get("snowflake_load_mode") or "append"
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"Unknown Snowflake load mode: {load_mode}")
+
+    ingestion = config.get("snowflake_ingestion") or "snowpipe"
+    if ingestion not in INGESTION_MODES:
+        raise ValueError(f"Unknown Snowflake ingestion mode: {ingestion}")
+
+    snowflake_user = aws.iam.User("snowflakeUser")
 
     # Create access key for the user
     snowflake_user_key = aws.iam.AccessKey("snowflakeUserKey", user=snowflake_user.name)
@@ -55,13 +102,26 @@ def setup_snowflake_resources(s3_bucket_name):
         role="ACCOUNTADMIN",
     )
 
-    # Define resources using provider
+    # Define resources using provider. The warehouse runs the merge and COPY
+    # tasks; Snowpipe loads on serverless compute.
+    auto_suspend = config.get_int("snowflake_auto_suspend")
+    max_cluster_count = config.get_int("snowflake_max_cluster_count") or 1
+    multi_cluster = {}
+    if max_cluster_count > 1:
+        # Multi-cluster warehouses need the Enterprise edition, so these are
+        # only set when asked for
+        multi_cluster = {
+            "min_cluster_count": config.get_int("snowflake_min_cluster_count") or 1,
+            "max_cluster_count": max_cluster_count,
+            "scaling_policy": config.get("snowflake_scaling_policy") or "STANDARD",
+        }
     warehouse = snowflake.Warehouse(
         "warehouse",
         name="customers_wh",
-        warehouse_size="X-SMALL",
-        auto_suspend=120,
+        warehouse_size=config.get("snowflake_warehouse_size") or "X-SMALL",
+        auto_suspend=120 if auto_suspend is None else auto_suspend,
         auto_resume=True,
+        **multi_cluster,
         opts=pulumi.ResourceOptions(provider=snowflake_provider),
     )
 
@@ -78,110 +138,241 @@ def setup_snowflake_resources(s3_bucket_name):
         opts=pulumi.ResourceOptions(provider=snowflake_provider),
     )
 
+    # Create an Amazon SQS queue
+    sqs_queue = aws.sqs.Queue("sqsQueue")
+
+    # The stages read the output bucket with the user's key, and SNS
+    # messages are sent to the queue
+    aws.iam.UserPolicy(
+        "snowflakeUserPolicy",
+        user=snowflake_user.name,
+        policy=policy_document(
+            [
+                statement(
+                    [
+                        "s3:GetBucketLocation",
+                        "s3:GetObject",
+                        "s3:GetObjectVersion",
+                        "s3:ListBucket",
+                    ],
+                    [s3_objects_arn(s3_bucket_name), s3_bucket_arn(s3_bucket_name)],
+                ),
+                statement(["SQS:SendMessage"], [sqs_queue.arn]),
+            ]
+        ),
+    )
+
+    # One table, stage and pipe per entry of the table registry
+    loaded_tables = {}
+    for table_config in tables:
+        loaded_tables[table_config["name"]] = setup_loaded_table(
+            table_config,
+            s3_bucket_name,
+            file_format,
+            snowflake_user_key,
+            database,
+            schema,
+            warehouse,
+            snowflake_provider,
+            load_mode,
+            ingestion,
+        )
+
+    # Auto-ingest pipes of an account share one notification channel, and
+    # each pipe only loads the files under its own stage's prefix. The
+    # caller adds it to the output bucket's notification.
+    notifications = []
+    if ingestion == "snowpipe":
+        snowpipe = next(iter(loaded_tables.values()))["snowpipe"]
+        notifications.append(
+            {
+                "queue_arn": snowpipe.notification_channel,
+                "events": ["s3:ObjectCreated:*"],
+            }
+        )
+
+    return {
+        "warehouse": warehouse,
+        "database": database,
+        "schema": schema,
+        "tables": loaded_tables,
+        "notifications": notifications,
+    }
+
+
+def setup_loaded_table(
+    table_config,
+    s3_bucket_name,
+    file_format,
+    snowflake_user_key,
+    database,
+    schema,
+    warehouse,
+    snowflake_provider,
+    load_mode="append",
+    ingestion="snowpipe",
+):
+    name = table_config["name"]
+    merge = load_mode == "merge" and table_config["key"]
+
+    # Transforms and dropped columns are handled by the Glue job, the tables
+    # only take the types of the columns it keeps
+    columns = [
+        {"name": column["name"], "type": column["type"]}
+        for column in loaded_columns(table_config)
+    ]
+
+    # The customers resources predate the table registry and keep their state
+    def aliases(legacy_name):
+        return [pulumi.Alias(name=legacy_name)] if name == "customers" else []
+
     table = snowflake.Table(
-        "table",
+        f"{name}Table",
         database=database.name,
         schema=schema.name,
-        name="customers",
-        columns=[
-            {"name": "customerid", "type": "NUMBER"},
-            {"name": "namestyle", "type": "BOOLEAN"},
-            {"name": "title", "type": "STRING"},
-            {"name": "firstname", "type": "STRING"},
-            {"name": "middlename", "type": "STRING"},
-            {"name": "lastname", "type": "STRING"},
-            {"name": "suffix", "type": "STRING"},
-            {"name": "companyname", "type": "STRING"},
-            {"name": "salesperson", "type": "STRING"},
-            {"name": "emailaddress", "type": "STRING"},
-            {"name": "phone", "type": "STRING"},
-            {"name": "passwordhash", "type": "STRING"},
-            {"name": "passwordsalt", "type": "STRING"},
-            {"name": "rowguid", "type": "STRING"},
-            {"name": "modifieddate", "type": "TIMESTAMP"},
-        ],
-        opts=pulumi.ResourceOptions(provider=snowflake_provider),
+        name=table_config["snowflake_table"],
+        columns=columns,
+        opts=pulumi.ResourceOptions(
+            provider=snowflake_provider, aliases=aliases("table")
+        ),
     )
 
     stage = snowflake.Stage(
-        "Stage",
-        name="stage",
+        f"{name}Stage",
+        name=f"{name}_stage",
         database=database.name,
         schema=schema.name,
-        file_format="TYPE = JSON",
+        file_format=file_format["stage"],
         credentials=pulumi.Output.all(
             snowflake_user_key.id, snowflake_user_key.secret
         ).apply(lambda args: f"AWS_KEY_ID='{args[0]}' AWS_SECRET_KEY='{args[1]}'"),
-        url=pulumi.Output.format("s3://{0}", s3_bucket_name),
-        opts=pulumi.ResourceOptions(provider=snowflake_provider),
+        url=pulumi.Output.format(
+            "s3://{0}/{1}", s3_bucket_name, table_config["output_prefix"]
+        ),
+        opts=pulumi.ResourceOptions(
+            provider=snowflake_provider, aliases=aliases("Stage")
+        ),
     )
 
-    # Create an Amazon SQS queue
-    sqs_queue = aws.sqs.Queue("sqsQueue")
-
-    # Create a policy for the SQS queue to allow SNS to send messages
-    sqs_queue_policy_document = sqs_queue.arn.apply(
-        lambda arn: json.dumps(
-            {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Action": "SQS:SendMessage",
-                        "Resource": arn,
-                    }
-                ],
-            }
+    # In merge mode the pipe loads a staging table the task merges from
+    loaded_table = table
+    if merge:
+        loaded_table = snowflake.Table(
+            f"{name}StagingTable",
+            database=database.name,
+            schema=schema.name,
+            name=f"{table_config['snowflake_table']}_staging",
+            columns=columns,
+            opts=pulumi.ResourceOptions(provider=snowflake_provider),
         )
-    )
-
-    sqs_queue_policy = aws.iam.Policy("SQSPolicy", policy=sqs_queue_policy_document)
-
-    aws.iam.UserPolicyAttachment(
-        "SQSPolicyAttachment", user=snowflake_user.name, policy_arn=sqs_queue_policy.arn
-    )
 
-# Create a Snowpipe to automatically ingest data from the S3 bucket
+    # Create a Snowpipe to automatically ingest data from the S3 bucket
     copy_statement = pulumi.Output.format(
         """
     COPY INTO \"{0}\".\"{1}\".\"{2}\" 
     FROM @\"{0}\".\"{1}\".\"{3}\" 
-    FILE_FORMAT = (TYPE = 'JSON')
+    {4}
     MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
         """,
         database.name,
         schema.name,
-        table.name,
+        loaded_table.name,
         stage.name,
+        file_format["copy"],
     )
 
-    snowpipe = snowflake.Pipe(
-        "pipe",
-        auto_ingest=True,
-        copy_statement=copy_statement,
+    resources = {"table": table, "stage": stage}
+    if ingestion == "copy_task":
+        resources["copy_task"] = snowflake.Task(
+            f"{name}CopyTask",
+            name=f"{table_config['snowflake_table']}_copy",
+            database=database.name,
+            schema=schema.name,
+            warehouse=warehouse.name,
+            schedule=config.get("snowflake_copy_schedule") or "60 MINUTE",
+            sql_statement=copy_statement,
+            enabled=True,
+            opts=pulumi.ResourceOptions(
+                provider=snowflake_provider, depends_on=[loaded_table]
+            ),
+        )
+    else:
+        resources["snowpipe"] = snowflake.Pipe(
+            f"{name}Pipe",
+            auto_ingest=True,
+            copy_statement=copy_statement,
+            database=database.name,
+            schema=schema.name,
+            opts=pulumi.ResourceOptions(
+                provider=snowflake_provider,
+                depends_on=[loaded_table, schema, database, warehouse],
+                aliases=aliases("pipe"),
+            ),
+        )
+
+    if merge:
+        resources.update(
+            setup_merge_task(
+                table_config,
+                table,
+                loaded_table,
+                database,
+                schema,
+                warehouse,
+                snowflake_provider,
+            )
+        )
+    return resources
+
+
+def setup_merge_task(
+    table_config, table, staging_table, database, schema, warehouse, snowflake_provider
+):
+    name = table_config["name"]
+
+    # The stream tracks the rows the pipe appends to the staging table, and
+    # each MERGE that reads it moves it past them. The merged rows are then
+    # deleted, so the staging table only holds the rows still to merge.
+    stream = snowflake.Stream(
+        f"{name}StagingStream",
+        name=f"{table_config['snowflake_table']}_staging_stream",
         database=database.name,
         schema=schema.name,
-        opts=pulumi.ResourceOptions(
-            provider=snowflake_provider, depends_on=[table, schema, database, warehouse]
+        on_table=pulumi.Output.format(
+            "{0}.{1}.{2}", database.name, schema.name, staging_table.name
         ),
+        append_only=True,
+        opts=pulumi.ResourceOptions(provider=snowflake_provider),
     )
 
-    aws.s3.BucketNotification(
-        "SQSbucketNotification",
-        bucket=s3_bucket_name,
-        queues=[
-            {
-                "queue_arn": snowpipe.notification_channel,
-                "events": ["s3:ObjectCreated:*"],
-            }
-        ],
+    def qualified(resource):
+        return pulumi.Output.format(
+            '"{0}"."{1}"."{2}"', database.name, schema.name, resource.name
+        )
+
+    merge_task = snowflake.Task(
+        f"{name}MergeTask",
+        name=f"{table_config['snowflake_table']}_merge",
+        database=database.name,
+        schema=schema.name,
+        warehouse=warehouse.name,
+        schedule=config.get("snowflake_merge_schedule") or "1 MINUTE",
+        # Runs, and resumes the warehouse, only when new rows were loaded
+        when=pulumi.Output.format("SYSTEM$STREAM_HAS_DATA('{0}')", qualified(stream)),
+        sql_statement=pulumi.Output.all(
+            qualified(table), qualified(stream), qualified(staging_table)
+        ).apply(
+            lambda args: merge_task_statement(
+                args[0],
+                args[1],
+                args[2],
+                loaded_columns(table_config),
+                table_config["key"],
+                table_config["version_column"],
+            )
+        ),
+        enabled=True,
+        opts=pulumi.ResourceOptions(provider=snowflake_provider),
     )
 
-    return {
-        "warehouse": warehouse,
-        "database": database,
-        "schema": schema,
-        "table": table,
-        "stage": stage,
-        "snowpipe": snowpipe,
-    }
+    return {"staging_table": staging_table, "stream": stream, "merge_task": merge_task}
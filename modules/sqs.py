@@ -0,0 +1,95 @@
+import json
+import pulumi
+import pulumi_aws as aws
+from modules.policies import policy_document, s3_bucket_arn, statement
+
+
+def setup_dead_letter_queue():
+    # Trigger events the Lambda failed on, kept for 14 days to inspect and
+    # redrive
+    return aws.sqs.Queue(
+        "triggerDeadLetterQueue",
+        message_retention_seconds=14 * 24 * 3600,
+    )
+
+
+def setup_trigger_queue(
+    bucket, visibility_timeout_seconds=300, dead_letter_queue=None, max_receive_count=10
+):
+    # Queue that collects the S3 upload events so the trigger Lambda can
+    # handle them in batches instead of once per object. Messages received
+    # max_receive_count times without being handled, e.g. deferred while job
+    # runs were at their limit, move to the dead-letter queue.
+    redrive_policy = None
+    if dead_letter_queue is not None:
+        redrive_policy = dead_letter_queue.arn.apply(
+            lambda arn: json.dumps(
+                {"deadLetterTargetArn": arn, "maxReceiveCount": max_receive_count}
+            )
+        )
+    queue = aws.sqs.Queue(
+        "triggerQueue",
+        visibility_timeout_seconds=visibility_timeout_seconds,
+        redrive_policy=redrive_policy,
+    )
+
+    # Allow the data lake bucket to send its notifications to the queue. The
+    # bucket's notification has to wait for this policy.
+    queue_policy = aws.sqs.QueuePolicy(
+        "triggerQueuePolicy",
+        queue_url=queue.id,
+        policy=policy_document(
+            [
+                statement(
+                    ["sqs:SendMessage"],
+                    [queue.arn],
+                    principal={"Service": "s3.amazonaws.com"},
+                    condition={"ArnEquals": {"aws:SourceArn": s3_bucket_arn(bucket)}},
+                )
+            ]
+        ),
+    )
+
+    return queue, queue_policy
+
+
+def queue_consumer_statements(queue):
+    # Lets the Lambda poll and delete from the queue
+    return [
+        statement(
+            [
+                "sqs:ReceiveMessage",
+                "sqs:DeleteMessage",
+                "sqs:GetQueueAttributes",
+            ],
+            [queue.arn],
+        )
+    ]
+
+
+def create_sqs_event_source(
+    lambda_function,
+    lambda_policy,
+    queue,
+    batch_size=1000,
+    maximum_batching_window_in_seconds=60,
+    maximum_concurrency=2,
+):
+    # Lambda waits up to the batching window (or until batch_size messages
+    # are available) before it is invoked, and the maximum concurrency keeps
+    # a burst of uploads from fanning out into parallel invocations. Messages
+    # of a batch whose job run could not be started are reported back and
+    # retried after the queue's visibility timeout. The mapping is checked
+    # against the role's policy, which has to allow the polling first.
+    return aws.lambda_.EventSourceMapping(
+        "triggerQueueEventSource",
+        event_source_arn=queue.arn,
+        function_name=lambda_function.arn,
+        batch_size=batch_size,
+        maximum_batching_window_in_seconds=maximum_batching_window_in_seconds,
+        function_response_types=["ReportBatchItemFailures"],
+        scaling_config=aws.lambda_.EventSourceMappingScalingConfigArgs(
+            maximum_concurrency=maximum_concurrency,
+        ),
+        opts=pulumi.ResourceOptions(depends_on=[lambda_policy]),
+    )
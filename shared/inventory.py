@@ -0,0 +1,197 @@
+# Inventory of the data lake's input files, kept by the trigger Lambda as
+# uploads arrive, so the Glue job reads the files it has to process from an
+# index instead of listing the data lake, whose listing grows with every
+# object ever uploaded. Each file is recorded with its table, size, ETag,
+# arrival time and processing status. Pending files are also in a sparse
+# index on (table, arrival time) that only holds them, so finding the work of
+# a run costs the same at a thousand objects as at millions.
+#
+# DynamoInventory is the deployed store, a DynamoDB table created by
+# modules/inventory.py; SqliteInventory has the same methods for local runs
+# and benchmarks. Stdlib only, the DynamoDB client is passed in.
+
+import datetime
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PENDING = "pending"
+PROCESSED = "processed"
+QUARANTINED = "quarantined"
+# Uploaded outside the input layout the Glue job reads
+SKIPPED = "skipped"
+
+# Sparse index of the pending files and its key, as in modules/inventory.py
+PENDING_INDEX = "pending"
+PENDING_ATTRIBUTE = "pending_table"
+
+# Processed and quarantined records are expired by DynamoDB after this long.
+# A file uploaded again is recorded anew either way.
+RECORD_TTL_SECONDS = 90 * 24 * 3600
+
+# Concurrent PutItem requests of one record call. Puts are conditional,
+# which BatchWriteItem does not support, and sent in parallel instead.
+RECORD_WORKERS = 10
+
+
+def epoch_millis(event_time):
+    # "2024-01-01T00:00:00.000Z" of an S3 event record
+    parsed = datetime.datetime.fromisoformat(event_time.replace("Z", "+00:00"))
+    return int(parsed.timestamp() * 1000)
+
+
+def new_file(url, table, size, etag, arrived_at):
+    # One pending input file; the Glue job identifies files by key, size and
+    # modification time, the arrival time stands in for the latter
+    return {
+        "key": url,
+        "table": table,
+        "size": size,
+        "etag": etag,
+        "modified": arrived_at,
+        "status": PENDING,
+    }
+
+
+class DynamoInventory:
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+
+    def record(self, files):
+        # Writes files as pending, replacing earlier records of the same keys
+        # from other uploads. A record of the same upload, by ETag, is kept
+        # as it is, so an event delivered again does not re-pend a file a
+        # run has already processed.
+        def put(f):
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "key": {"S": f["key"]},
+                        "table": {"S": f["table"]},
+                        "size": {"N": str(f["size"])},
+                        "etag": {"S": f["etag"]},
+                        "arrived_at": {"N": str(f["modified"])},
+                        "status": {"S": PENDING},
+                        PENDING_ATTRIBUTE: {"S": f["table"]},
+                    },
+                    ConditionExpression="attribute_not_exists(#key) OR etag <> :etag",
+                    ExpressionAttributeNames={"#key": "key"},
+                    ExpressionAttributeValues={":etag": {"S": f["etag"]}},
+                )
+            except self.client.exceptions.ConditionalCheckFailedException:
+                pass
+
+        with ThreadPoolExecutor(max_workers=RECORD_WORKERS) as pool:
+            list(pool.map(put, files))
+
+    def pending(self, table):
+        # The table's pending files, oldest first
+        files = []
+        kwargs = {
+            "TableName": self.table_name,
+            "IndexName": PENDING_INDEX,
+            "KeyConditionExpression": "#pending = :table",
+            "ExpressionAttributeNames": {"#pending": PENDING_ATTRIBUTE},
+            "ExpressionAttributeValues": {":table": {"S": table}},
+        }
+        while True:
+            response = self.client.query(**kwargs)
+            for item in response["Items"]:
+                files.append(
+                    {
+                        "key": item["key"]["S"],
+                        "table": item["table"]["S"],
+                        "size": int(item["size"]["N"]),
+                        "etag": item["etag"]["S"],
+                        "modified": int(item["arrived_at"]["N"]),
+                        "status": item["status"]["S"],
+                    }
+                )
+            if "LastEvaluatedKey" not in response:
+                return files
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def mark(self, files, status):
+        # Takes files out of the pending index. A record whose ETag changed
+        # since it was read belongs to a newer upload and stays pending.
+        now = int(time.time())
+        for f in files:
+            try:
+                self.client.update_item(
+                    TableName=self.table_name,
+                    Key={"key": {"S": f["key"]}},
+                    UpdateExpression=(
+                        "SET #status = :status, processed_at = :now, "
+                        "expires_at = :expires REMOVE #pending"
+                    ),
+                    ConditionExpression="etag = :etag",
+                    ExpressionAttributeNames={
+                        "#status": "status",
+                        "#pending": PENDING_ATTRIBUTE,
+                    },
+                    ExpressionAttributeValues={
+                        ":status": {"S": status},
+                        ":now": {"N": str(now)},
+                        ":expires": {"N": str(now + RECORD_TTL_SECONDS)},
+                        ":etag": {"S": f["etag"]},
+                    },
+                )
+            except self.client.exceptions.ConditionalCheckFailedException:
+                pass
+
+
+class SqliteInventory:
+    # The same records in a SQLite file, with a partial index in place of
+    # DynamoDB's sparse one
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS inventory (
+                key TEXT PRIMARY KEY,
+                "table" TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT NOT NULL,
+                arrived_at INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                processed_at INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS pending
+                ON inventory ("table", arrived_at) WHERE status = 'pending';
+            """)
+
+    def record(self, files):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO inventory "
+                '(key, "table", size, etag, arrived_at, status) '
+                "VALUES (?, ?, ?, ?, ?, 'pending') "
+                'ON CONFLICT (key) DO UPDATE SET "table" = excluded."table", '
+                "size = excluded.size, etag = excluded.etag, "
+                "arrived_at = excluded.arrived_at, status = 'pending', "
+                "processed_at = NULL WHERE etag <> excluded.etag",
+                [
+                    (f["key"], f["table"], f["size"], f["etag"], f["modified"])
+                    for f in files
+                ],
+            )
+
+    def pending(self, table):
+        rows = self.connection.execute(
+            'SELECT key, "table", size, etag, arrived_at, status FROM inventory '
+            "WHERE \"table\" = ? AND status = 'pending' ORDER BY arrived_at",
+            (table,),
+        )
+        return [
+            dict(zip(("key", "table", "size", "etag", "modified", "status"), row))
+            for row in rows
+        ]
+
+    def mark(self, files, status):
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE inventory SET status = ?, processed_at = ? "
+                "WHERE key = ? AND etag = ?",
+                [(status, int(time.time()), f["key"], f["etag"]) for f in files],
+            )
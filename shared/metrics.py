@@ -0,0 +1,91 @@
+# Timing spans and counters shared by the trigger Lambda and the Glue job,
+# printed to stdout as CloudWatch Embedded Metric Format (EMF) lines. Lambda
+# turns these lines into metrics on its own; the Glue job's lines are turned
+# into metrics by the log metric filters in modules/monitoring.py. Every line
+# carries the correlation ID of the upload that started the work, so one
+# search in CloudWatch Logs Insights follows it from the S3 event to the job.
+
+import contextlib
+import json
+import sys
+import time
+import uuid
+
+NAMESPACE = "EtlPipeline"
+
+# Units by a word of the metric name, anything else is a count
+UNITS = {"Seconds": "Seconds", "Milliseconds": "Milliseconds", "Bytes": "Bytes"}
+
+CORRELATION_ID_ARGUMENT = "--correlation_id"
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+def s3_correlation_id(s3_records):
+    # The request ID S3 gave the upload, when one upload started the work.
+    # Batches of uploads get an ID of their own.
+    request_ids = {
+        r.get("responseElements", {}).get("x-amz-request-id") for r in s3_records
+    }
+    if len(request_ids) == 1 and None not in request_ids:
+        return request_ids.pop()
+    return new_correlation_id()
+
+
+def metric_unit(name):
+    for word, unit in UNITS.items():
+        if word in name:
+            return unit
+    return "Count"
+
+
+def emf_record(metrics, dimensions, properties=None, namespace=NAMESPACE):
+    # dimensions name the series, e.g. {"Component": "glue_job", "Table":
+    # "customers"}; properties are searchable in the logs but not metrics
+    return {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [sorted(dimensions)],
+                    "Metrics": [
+                        {"Name": name, "Unit": metric_unit(name)} for name in metrics
+                    ],
+                }
+            ],
+        },
+        **(properties or {}),
+        **dimensions,
+        **metrics,
+    }
+
+
+def emit(metrics, dimensions, properties=None, stream=None):
+    # Metrics without a value are left out, an empty record is not printed
+    metrics = {name: value for name, value in metrics.items() if value is not None}
+    if not metrics:
+        return None
+    record = emf_record(metrics, dimensions, properties)
+    # One line per record, which is how CloudWatch Logs reads EMF
+    print(json.dumps(record, separators=(",", ":")), file=stream or sys.stdout)
+    return record
+
+
+@contextlib.contextmanager
+def span(name, dimensions, properties=None, stream=None):
+    # Times the block as <name>Milliseconds. Counters added to the yielded
+    # dict are emitted in the same record; a block that raises is emitted
+    # with <name>Failed set to 1.
+    metrics = {}
+    start = time.perf_counter()
+    try:
+        yield metrics
+    except BaseException:
+        metrics[f"{name}Failed"] = 1
+        raise
+    finally:
+        metrics[f"{name}Milliseconds"] = round((time.perf_counter() - start) * 1000, 3)
+        emit(metrics, dimensions, properties, stream)
@@ -0,0 +1,178 @@
+# Re-chunks large gzip-compressed CSV objects into uncompressed parts that
+# Spark can split. A gzip stream only decompresses from its start, so Spark
+# reads a .csv.gz as a single task, and one core parses, casts and writes a
+# multi-GB upload while the other workers sit idle. The object is fetched
+# with parallel ranged GETs, decompressed as the ranges arrive and cut at
+# line boundaries into parts that each repeat the header. Parts are uploaded
+# while the next ones are decompressed. Used by the Glue job's manifest
+# processing mode; stdlib only, the S3 client is passed in.
+
+import collections
+import itertools
+import os
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SETTINGS = {
+    # Bytes fetched per ranged GET
+    "range_bytes": 16 * 1024 * 1024,
+    # Ranged GETs and part uploads in flight at a time
+    "max_workers": 8,
+    # Uncompressed size of each part, Spark's default split size
+    "part_bytes": 128 * 1024 * 1024,
+}
+
+COMPRESSED_SUFFIX = ".gz"
+
+# Parts are spooled to memory up to this size and to local disk beyond it
+SPOOL_BYTES = 8 * 1024 * 1024
+
+
+def is_compressed(key):
+    return key.endswith(COMPRESSED_SUFFIX)
+
+
+def split_url(url):
+    bucket, _, key = url[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def read_ranges(s3_client, bucket, key, size, range_bytes, max_workers):
+    # Yields the object's bytes in order, with up to max_workers ranges being
+    # fetched ahead of the one consumed
+    def fetch(start):
+        end = min(start + range_bytes, size) - 1
+        response = s3_client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end}"
+        )
+        return response["Body"].read()
+
+    starts = iter(range(0, size, range_bytes))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = collections.deque(
+            pool.submit(fetch, start) for start in itertools.islice(starts, max_workers)
+        )
+        while pending:
+            chunk = pending.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                pending.append(pool.submit(fetch, start))
+            yield chunk
+
+
+def decompress(chunks):
+    # Yields the decompressed bytes of a gzip stream. Files written by
+    # parallel compressors (pigz, bgzip) are several gzip members one after
+    # the other, each is decompressed in turn.
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    started = False
+    for chunk in chunks:
+        while chunk:
+            started = True
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            started = False
+    if started:
+        raise EOFError("the gzip stream ended before its last member did")
+
+
+def new_part(header):
+    part = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    part.write(header)
+    return part
+
+
+def split_lines(blocks, part_bytes):
+    # Yields (part file, size). Parts are cut at the last line boundary
+    # before part_bytes, or the first one after it when a line runs longer,
+    # and each starts with the header line.
+    header = b""
+    part = None
+    for block in blocks:
+        if part is None:
+            header += block
+            newline = header.find(b"\n")
+            if newline < 0:
+                continue
+            header, block = header[: newline + 1], header[newline + 1 :]
+            part = new_part(header)
+
+        while block:
+            room = part_bytes - part.tell()
+            if len(block) < room:
+                part.write(block)
+                break
+            cut = block.rfind(b"\n", 0, max(room, 0)) + 1
+            if not cut:
+                cut = block.find(b"\n", max(room, 0)) + 1
+            if not cut:
+                part.write(block)
+                break
+            part.write(block[:cut])
+            block = block[cut:]
+            yield part, part.tell()
+            part = new_part(header)
+
+    if part is None:
+        # A single line without a line break
+        part = new_part(header)
+    if part.tell() > len(header) or not header.endswith(b"\n"):
+        yield part, part.tell()
+    else:
+        part.close()
+
+
+def part_name(key, index):
+    # customers/2024/customers.csv.gz -> customers-00000.csv
+    name = os.path.basename(key)[: -len(COMPRESSED_SUFFIX)]
+    if name.endswith(".csv"):
+        name = name[: -len(".csv")]
+    return f"{name}-{index:05d}.csv"
+
+
+def rechunk_object(s3_client, url, output_path, settings=None):
+    # Writes the uncompressed parts of the gzip object at url under
+    # output_path. Returns their URLs and total size.
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    bucket, key = split_url(url)
+    output_bucket, output_prefix = split_url(output_path)
+    size = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+
+    def upload(part, part_key):
+        part.seek(0)
+        with part:
+            s3_client.upload_fileobj(part, output_bucket, part_key)
+
+    keys = []
+    total = 0
+    blocks = decompress(
+        read_ranges(
+            s3_client,
+            bucket,
+            key,
+            size,
+            settings["range_bytes"],
+            settings["max_workers"],
+        )
+    )
+    with ThreadPoolExecutor(max_workers=settings["max_workers"]) as pool:
+        uploads = collections.deque()
+        for index, (part, part_size) in enumerate(
+            split_lines(blocks, settings["part_bytes"])
+        ):
+            # Bounds the parts waiting on local disk to the upload workers
+            if len(uploads) >= settings["max_workers"]:
+                uploads.popleft().result()
+            part_key = f"{output_prefix}{part_name(key, index)}"
+            uploads.append(pool.submit(upload, part, part_key))
+            keys.append(f"s3://{output_bucket}/{part_key}")
+            total += part_size
+        for future in uploads:
+            future.result()
+    return {"keys": keys, "bytes": total}
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# The Glue job, the Lambda and their shared modules import each other by
+# module name, as they do when deployed
+for directory in ("shared", "lambda", "glue"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+# The Pulumi program's modules are imported as the modules package
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(autouse=True)
+def aws_environment(monkeypatch):
+    # Fake credentials, so a test that misses a mock cannot reach an account
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+
+@pytest.fixture(scope="session")
+def spark():
+    import glue_job
+    from pyspark.sql import SparkSession
+
+    session = (
+        SparkSession.builder.master("local[2]")
+        .config("spark.ui.enabled", False)
+        .config("spark.sql.shuffle.partitions", 4)
+        .getOrCreate()
+    )
+    session.sparkContext.setLogLevel("ERROR")
+    # Set up as the job sets up its session
+    glue_job.configure_session(session)
+    yield session
+    session.stop()
@@ -0,0 +1,379 @@
+import gzip
+import json
+import os
+import re
+
+import boto3
+import pytest
+from moto import mock_aws
+from pyspark.sql import functions as F
+
+import glue_job
+
+MB = 1024 * 1024
+
+CSV = "CustomerID,FirstName,ModifiedDate\n1,Orlando,2005-08-01 00:00:00\n"
+COLUMN_TYPES = "customerid:NUMBER,firstname:STRING,modifieddate:TIMESTAMP"
+
+
+def output_files(path, suffix=".json"):
+    return [
+        os.path.getsize(os.path.join(base, name))
+        for base, _, names in os.walk(path)
+        for name in names
+        if name.endswith(suffix)
+    ]
+
+
+def customers(spark, rows, partitions):
+    # Rows of about the size of a customers record
+    return spark.range(rows, numPartitions=partitions).select(
+        F.col("id").alias("customerid"),
+        F.sha2(F.col("id").cast("string"), 256).alias("companyname"),
+        F.concat(F.lit("c"), F.col("id"), F.lit("@example.com")).alias("email"),
+    )
+
+
+def test_output_file_count_targets_the_file_size():
+    assert glue_job.output_file_count(0, 128 * MB) == 1
+    assert glue_job.output_file_count(10 * MB, 128 * MB) == 1
+    # JSON output is larger than its CSV input, Parquet smaller
+    assert glue_job.output_file_count(1000 * MB, 128 * MB) == 15
+    assert glue_job.output_file_count(1000 * MB, 128 * MB, "parquet") == 3
+
+
+def test_write_output_writes_the_file_count_of_even_size(spark, tmp_path):
+    path = str(tmp_path / "output")
+    glue_job.write_output(customers(spark, 40_000, 16), path, "overwrite", num_files=3)
+
+    sizes = output_files(path)
+    assert len(sizes) == 3
+    mean = sum(sizes) / len(sizes)
+    assert all(0.5 * mean <= size <= 1.5 * mean for size in sizes)
+
+
+@pytest.mark.parametrize("days", [1, 2])
+def test_parquet_days_are_split_towards_the_file_count(spark, tmp_path, days):
+    path = str(tmp_path / "output")
+    df = customers(spark, 40_000, 16).withColumn(
+        "modifieddate",
+        F.expr(
+            f"timestamp'2024-01-01 00:00:00' + make_interval(0, 0, 0, customerid % {days})"
+        ),
+    )
+
+    glue_job.write_output(df, path, "overwrite", "parquet", num_files=4)
+
+    # Each day is split into files of at most about the target size, a
+    # range that spans the end of one day and the start of the next adding
+    # a smaller file to each
+    day_sizes = [
+        output_files(
+            os.path.join(path, f"modified_date=2024-01-0{day + 1}"), ".parquet"
+        )
+        for day in range(days)
+    ]
+    sizes = [size for day in day_sizes for size in day]
+    target = sum(sizes) / 4
+    assert all(len(day) >= 4 // days for day in day_sizes)
+    assert len(sizes) <= 4 + days - 1
+    assert max(sizes) <= 1.5 * target
+
+
+def test_compaction_merges_small_files_towards_the_target(spark, tmp_path):
+    output = str(tmp_path / "output" / "customers")
+    df = customers(spark, 40_000, 20)
+    df.write.json(output)
+    small = output_files(output)
+    assert len(small) == 20
+    target = sum(small) // 4
+
+    compacted = glue_job.compact_output(
+        spark, str(tmp_path / "output"), str(tmp_path / "temp"), target
+    )
+
+    sizes = output_files(output)
+    assert compacted == 20
+    assert len(sizes) == 4
+    assert all(0.5 * target <= size <= 1.5 * target for size in sizes)
+    # Every row is kept once
+    merged = spark.read.json(output)
+    assert merged.count() == 40_000
+    assert merged.select("customerid").distinct().count() == 40_000
+    # Files at the target size are left alone by the next pass
+    assert (
+        glue_job.compact_output(
+            spark, str(tmp_path / "output"), str(tmp_path / "temp"), target
+        )
+        == 0
+    )
+
+
+def write_file(directory, name, body):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(body)
+    return "file://" + path
+
+
+def test_the_csv_scan_leaves_out_the_dropped_columns(spark, tmp_path):
+    key = write_file(tmp_path, "a.csv", CSV.encode())
+    column_types = glue_job.parse_column_types(COLUMN_TYPES)
+    options = dict(glue_job.DEFAULT_OPTIONS, drop_columns="firstname")
+
+    df = glue_job.project_columns(
+        glue_job.read_csv(spark, [key], column_types), options
+    )
+
+    plan = df._jdf.queryExecution().executedPlan().toString()
+    read_schema = re.search(r"ReadSchema: struct<([^>]*)>", plan).group(1)
+    assert "customerid" in read_schema
+    assert "firstname" not in read_schema
+
+
+def test_lines_of_the_wrong_width_are_rejected_with_dropped_columns(spark, tmp_path):
+    # The parser splits every field, so a short line is rejected even though
+    # the scan does not output the column it is missing
+    key = write_file(tmp_path, "a.csv", (CSV + "2,Gee\n").encode())
+    column_types = glue_job.parse_column_types(COLUMN_TYPES)
+    options = dict(glue_job.DEFAULT_OPTIONS, drop_columns="firstname")
+
+    df = glue_job.project_columns(
+        glue_job.read_csv(spark, [key], column_types), options
+    )
+    valid, rejected = glue_job.apply_column_types(df, column_types)
+
+    assert [row.customerid for row in valid.collect()] == [1]
+    assert [row.customerid for row in rejected.collect()] == ["2"]
+
+
+def manifest_options(tmp_path, keys):
+    lake = tmp_path / "lake"
+    return dict(
+        glue_job.DEFAULT_OPTIONS,
+        processing_mode="manifest",
+        name="customers",
+        input_path=f"file://{lake}/",
+        output_path=f"file://{tmp_path}/output/",
+        manifest_path=f"file://{tmp_path}/manifest/",
+        rejected_path=f"file://{tmp_path}/rejected/",
+        quarantine_path=f"file://{tmp_path}/quarantine/",
+        column_types=COLUMN_TYPES,
+        input_keys=json.dumps(keys),
+    )
+
+
+def truncated_gzip():
+    return gzip.compress(CSV.encode() * 1000)[:200]
+
+
+def test_a_single_bad_upload_is_quarantined_without_failing_the_run(spark, tmp_path):
+    lake = tmp_path / "lake"
+    lake.mkdir()
+    key = write_file(lake, "bad.csv.gz", truncated_gzip())
+    metrics = {}
+
+    processed = glue_job.run_manifest(spark, manifest_options(tmp_path, [key]), metrics)
+
+    assert processed == 1
+    assert metrics["FilesQuarantined"] == 1
+    assert os.path.exists(tmp_path / "quarantine" / "files" / "bad.csv.gz")
+    # Recorded, so the next run does not pick it up again
+    manifest = glue_job.load_manifest(spark, f"file://{tmp_path}/manifest/")
+    assert [m[0].rsplit("/", 1)[1] for m in manifest] == ["bad.csv.gz"]
+
+
+def test_bad_files_are_isolated_from_the_good_ones(spark, tmp_path):
+    lake = tmp_path / "lake"
+    lake.mkdir()
+    keys = [
+        write_file(lake, "a.csv", CSV.encode()),
+        write_file(lake, "bad.csv.gz", truncated_gzip()),
+        write_file(lake, "b.csv", CSV.replace("1,", "2,").encode()),
+    ]
+    metrics = {}
+
+    glue_job.run_manifest(spark, manifest_options(tmp_path, keys), metrics)
+
+    assert metrics["FilesQuarantined"] == 1
+    assert metrics["RowsOut"] == 2
+    assert output_files(tmp_path / "quarantine" / "files", ".gz") != []
+    assert output_files(tmp_path / "quarantine" / "files", ".csv") == []
+
+
+def test_several_files_failing_alike_fail_the_run(spark, tmp_path):
+    lake = tmp_path / "lake"
+    lake.mkdir()
+    # Every file misses a declared column, as when the job is deployed with
+    # the wrong registry
+    keys = [
+        write_file(lake, f"{name}.csv", b"CustomerID,FirstName\n1,Orlando\n")
+        for name in "abc"
+    ]
+
+    with pytest.raises(RuntimeError, match="None of the 3 new input files"):
+        glue_job.run_manifest(spark, manifest_options(tmp_path, keys), {})
+
+    assert not os.path.exists(tmp_path / "quarantine")
+    assert glue_job.load_manifest(spark, f"file://{tmp_path}/manifest/") == set()
+
+
+def test_a_failed_attempt_leaves_no_output_behind(spark, tmp_path, monkeypatch):
+    lake = tmp_path / "lake"
+    lake.mkdir()
+    keys = [
+        write_file(lake, "a.csv", CSV.encode()),
+        write_file(lake, "b.csv", CSV.replace("1,", "2,").encode()),
+    ]
+    options = dict(
+        manifest_options(tmp_path, keys), staging_path=f"file://{tmp_path}/staging/"
+    )
+    # The first attempt fails after its output was written
+    write_rejected = glue_job.write_rejected
+    calls = []
+
+    def fail_once(rejected, rejected_path):
+        calls.append(rejected_path)
+        if len(calls) == 1:
+            raise IOError("connection reset")
+        return write_rejected(rejected, rejected_path)
+
+    monkeypatch.setattr(glue_job, "write_rejected", fail_once)
+
+    glue_job.run_manifest(spark, options, {})
+
+    # Written once by the two halves the files were retried in
+    assert len(calls) == 3
+    rows = spark.read.json(f"file://{tmp_path}/output/").collect()
+    assert sorted(row.customerid for row in rows) == [1, 2]
+    assert output_files(tmp_path / "staging", "") == []
+
+
+def quality_options(tmp_path, quality):
+    return dict(
+        glue_job.DEFAULT_OPTIONS,
+        name="customers",
+        output_path=f"file://{tmp_path}/output/",
+        rejected_path=f"file://{tmp_path}/rejected/",
+        quarantine_path=f"file://{tmp_path}/quarantine/",
+        quality_path=f"file://{tmp_path}/quality/",
+        quality=quality,
+    )
+
+
+def test_a_quarantined_batch_counts_no_output(spark, tmp_path):
+    key = write_file(tmp_path, "a.csv", CSV.encode())
+    column_types = glue_job.parse_column_types(COLUMN_TYPES)
+    options = quality_options(tmp_path, json.dumps({"min_rows": 2}))
+    metrics = {}
+
+    df = glue_job.read_csv(spark, [key], column_types)
+    glue_job.write_typed(df, column_types, options, "append", 1, metrics)
+
+    assert metrics["BatchesQuarantined"] == 1
+    assert output_files(tmp_path / "quarantine") != []
+    assert (metrics["FilesWritten"], metrics["BytesWritten"]) == (0, 0)
+    assert (metrics["RowsIn"], metrics["RowsOut"]) == (1, 0)
+
+
+def test_a_table_without_checks_is_not_profiled(spark, tmp_path):
+    key = write_file(tmp_path, "a.csv", CSV.encode())
+    column_types = glue_job.parse_column_types(COLUMN_TYPES)
+    metrics = {}
+
+    df = glue_job.read_csv(spark, [key], column_types)
+    glue_job.write_typed(
+        df, column_types, quality_options(tmp_path, "{}"), "append", 1, metrics
+    )
+
+    assert "BatchesQuarantined" not in metrics
+    assert not os.path.exists(tmp_path / "quality")
+    assert metrics["FilesWritten"] == 1
+
+
+def test_written_files_are_those_of_the_write_only(spark, tmp_path):
+    key = write_file(tmp_path, "a.csv", CSV.encode())
+    column_types = glue_job.parse_column_types(COLUMN_TYPES)
+    options = quality_options(tmp_path, "")
+    runs = []
+
+    for _ in range(2):
+        metrics = {}
+        df = glue_job.read_csv(spark, [key], column_types)
+        glue_job.write_typed(df, column_types, options, "append", 1, metrics)
+        runs.append(metrics)
+
+    # The first write's file is in the output, but not counted again
+    sizes = output_files(tmp_path / "output")
+    assert len(sizes) == 2
+    assert [m["FilesWritten"] for m in runs] == [1, 1]
+    assert runs[1]["BytesWritten"] == sizes[0]
+
+
+def test_uploads_of_the_same_name_are_re_chunked_apart():
+    days = ["2024-01-01", "2024-01-02"]
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket="lake")
+        files = []
+        for day in days:
+            body = gzip.compress(CSV.replace("Orlando", day).encode())
+            key = f"raw/{day}/customers.csv.gz"
+            s3.put_object(Bucket="lake", Key=key, Body=body)
+            files.append({"key": f"s3://lake/{key}", "size": len(body)})
+        options = dict(glue_job.DEFAULT_OPTIONS, rechunk_min_bytes="1")
+
+        inputs, failures = glue_job.rechunk_inputs(
+            files, options, "s3://lake/staging/run/"
+        )
+
+        assert failures == []
+        parts = {}
+        for i in inputs:
+            (key,) = i["keys"]
+            body = s3.get_object(Bucket="lake", Key=key.split("/", 3)[3])["Body"]
+            parts[i["file"]["key"]] = body.read().decode()
+    # Neither day's parts overwrote the other's
+    assert [day in parts[f["key"]] for f, day in zip(files, days)] == [True, True]
+
+
+class FailingCatalog:
+    # Reads each table from its CSV file, failing the reads of the tables
+    # named in fail
+    def __init__(self, spark, files, fail=()):
+        self.spark_session = spark
+        self.files = files
+        self.fail = fail
+
+    def read_table(self, options):
+        if options["name"] in self.fail:
+            raise IOError(f"Could not read {options['name']}")
+        return self.spark_session.read.csv(self.files[options["name"]], header=True)
+
+
+def test_a_failed_table_leaves_no_output_of_the_others_to_duplicate(spark, tmp_path):
+    names = ["customers", "orders"]
+    files = {name: write_file(tmp_path, f"{name}.csv", CSV.encode()) for name in names}
+    tables = [
+        dict(
+            glue_job.DEFAULT_OPTIONS,
+            name=name,
+            processing_mode="incremental",
+            output_path=f"file://{tmp_path}/output/{name}/",
+            staging_path=f"file://{tmp_path}/staging/{name}/",
+            column_types=COLUMN_TYPES,
+        )
+        for name in names
+    ]
+
+    with pytest.raises(RuntimeError, match="Failed tables: orders"):
+        glue_job.run_tables(FailingCatalog(spark, files, ["orders"]), tables, 2)
+
+    # Without committed bookmarks the retry reads both tables again
+    assert output_files(tmp_path / "output") == []
+    glue_job.run_tables(FailingCatalog(spark, files), tables, 2)
+
+    for name in names:
+        rows = spark.read.json(f"file://{tmp_path}/output/{name}/").collect()
+        assert [row.customerid for row in rows] == [1]
+    assert output_files(tmp_path / "staging", "") == []
@@ -0,0 +1,92 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from inventory import (
+    PENDING_ATTRIBUTE,
+    PENDING_INDEX,
+    PROCESSED,
+    DynamoInventory,
+    SqliteInventory,
+    new_file,
+)
+
+
+def dynamo_inventory():
+    # The table and sparse index of modules/inventory.py
+    client = boto3.client("dynamodb")
+    client.create_table(
+        TableName="inputInventory",
+        BillingMode="PAY_PER_REQUEST",
+        KeySchema=[{"AttributeName": "key", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "key", "AttributeType": "S"},
+            {"AttributeName": PENDING_ATTRIBUTE, "AttributeType": "S"},
+            {"AttributeName": "arrived_at", "AttributeType": "N"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": PENDING_INDEX,
+                "KeySchema": [
+                    {"AttributeName": PENDING_ATTRIBUTE, "KeyType": "HASH"},
+                    {"AttributeName": "arrived_at", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }
+        ],
+    )
+    return DynamoInventory(client, "inputInventory")
+
+
+@pytest.fixture(params=["dynamodb", "sqlite"])
+def inventory(request, tmp_path):
+    if request.param == "sqlite":
+        yield SqliteInventory(str(tmp_path / "inventory.db"))
+        return
+    with mock_aws():
+        yield dynamo_inventory()
+
+
+def upload(name, etag="etag-1", arrived_at=1_700_000_000_000):
+    return new_file(f"s3://lake/customers/{name}", "customers", 1024, etag, arrived_at)
+
+
+def pending_keys(inventory):
+    return [f["key"] for f in inventory.pending("customers")]
+
+
+def test_pending_files_are_listed_oldest_first(inventory):
+    inventory.record([upload("b.csv", arrived_at=2), upload("a.csv", arrived_at=1)])
+    assert pending_keys(inventory) == [
+        "s3://lake/customers/a.csv",
+        "s3://lake/customers/b.csv",
+    ]
+
+
+def test_an_event_delivered_again_does_not_re_pend_a_processed_file(inventory):
+    files = [upload("a.csv"), upload("b.csv")]
+    inventory.record(files)
+    inventory.mark(files, PROCESSED)
+
+    # An SQS redelivery, a Lambda retry or a duplicate S3 event
+    inventory.record(files)
+
+    assert pending_keys(inventory) == []
+
+
+def test_a_new_upload_of_a_processed_file_is_pending_again(inventory):
+    inventory.record([upload("a.csv")])
+    inventory.mark([upload("a.csv")], PROCESSED)
+
+    inventory.record([upload("a.csv", etag="etag-2")])
+
+    assert pending_keys(inventory) == ["s3://lake/customers/a.csv"]
+
+
+def test_a_run_that_read_an_earlier_upload_leaves_the_new_one_pending(inventory):
+    inventory.record([upload("a.csv")])
+    inventory.record([upload("a.csv", etag="etag-2")])
+
+    inventory.mark([upload("a.csv")], PROCESSED)
+
+    assert pending_keys(inventory) == ["s3://lake/customers/a.csv"]
@@ -0,0 +1,61 @@
+import pytest
+
+from job_sizing import DEFAULT_SIZING, GB, MB, input_bytes, size_job_run
+
+
+def test_unknown_size_keeps_the_job_defaults():
+    assert size_job_run(None) == {}
+
+
+@pytest.mark.parametrize("total_bytes", [0, 1 * MB, 256 * MB])
+def test_small_loads_run_as_flex_on_the_minimum_workers(total_bytes):
+    assert size_job_run(total_bytes) == {
+        "WorkerType": "G.1X",
+        "NumberOfWorkers": 2,
+        "ExecutionClass": "FLEX",
+    }
+
+
+@pytest.mark.parametrize(
+    "total_bytes, worker_type, workers",
+    [
+        # Just above the Flex threshold, still on the minimum
+        (256 * MB + 1, "G.1X", 2),
+        (10 * GB, "G.1X", 5),
+        (10 * GB + 1, "G.1X", 6),
+        (99 * GB, "G.1X", 30),
+        # G.2X workers take twice the input each
+        (100 * GB, "G.2X", 25),
+        (500 * GB, "G.2X", 30),
+    ],
+)
+def test_larger_loads_get_workers_for_their_size(total_bytes, worker_type, workers):
+    assert size_job_run(total_bytes) == {
+        "WorkerType": worker_type,
+        "NumberOfWorkers": workers,
+        "ExecutionClass": "STANDARD",
+    }
+
+
+def test_workers_grow_with_the_input_within_the_bounds():
+    runs = [size_job_run(n * GB) for n in range(1, 600)]
+    workers = [run["NumberOfWorkers"] for run in runs]
+    assert min(workers) == DEFAULT_SIZING["min_workers"]
+    assert max(workers) == DEFAULT_SIZING["max_workers"]
+    # Per worker type, as the switch to G.2X halves the number of workers
+    for worker_type in ("G.1X", "G.2X"):
+        of_type = [r["NumberOfWorkers"] for r in runs if r["WorkerType"] == worker_type]
+        assert of_type == sorted(of_type)
+
+
+def test_thresholds_can_be_overridden():
+    sizing = {"flex_max_bytes": 0, "bytes_per_worker": GB, "max_workers": 8}
+    assert size_job_run(1 * MB, sizing)["ExecutionClass"] == "STANDARD"
+    assert size_job_run(5 * GB, sizing)["NumberOfWorkers"] == 5
+    assert size_job_run(50 * GB, sizing)["NumberOfWorkers"] == 8
+
+
+def test_gzip_inputs_count_as_their_uncompressed_size():
+    sizes = {"s3://lake/a.csv": 100, "s3://lake/b.csv.gz": 100}
+    assert input_bytes(sizes) == 100 + 100 * DEFAULT_SIZING["gzip_ratio"]
+    assert input_bytes(sizes, {"gzip_ratio": 5}) == 600
@@ -0,0 +1,112 @@
+import csv
+import datetime
+import os
+
+import pytest
+
+from modules.load_telemetry import (
+    GB,
+    copy_task_credits,
+    file_loads,
+    load_metrics,
+    parse_timestamp,
+    pipe_usage,
+    recommend_ingestion,
+)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures")
+
+PIPE = "CUSTOMERS_DB.CUSTOMERS_SCHEMA.CUSTOMERS_PIPE"
+
+
+def read_rows(name):
+    # Rows of a CSV export, as benchmarks/load_telemetry.py reads them
+    with open(os.path.join(FIXTURES, name), newline="", encoding="utf-8-sig") as f:
+        return [{k.upper(): v for k, v in row.items()} for row in csv.DictReader(f)]
+
+
+@pytest.fixture
+def files():
+    return file_loads(read_rows("copy_history.csv"))
+
+
+@pytest.fixture
+def pipes():
+    return pipe_usage(read_rows("pipe_usage_history.csv"))
+
+
+def test_exported_timestamps_keep_their_offset():
+    assert parse_timestamp("2026-10-01 08:00:20.000 -0700") == datetime.datetime(
+        2026, 10, 1, 15, 0, 20, tzinfo=datetime.timezone.utc
+    )
+    assert parse_timestamp("") is None
+
+
+def test_each_file_is_timed_from_the_pipe_receiving_it(files):
+    assert len(files) == 40
+    first = files[0]
+    assert (first["file"], first["pipe"], first["status"]) == (
+        "output/part-00000-c000.json",
+        PIPE,
+        "Loaded",
+    )
+    assert (first["bytes"], first["rows"], first["errors"]) == (1028004, 4469, 0)
+    assert first["latency_seconds"] == 44
+
+    failed = [f for f in files if f["status"] == "Load failed"]
+    assert [(f["file"], f["rows"], f["errors"]) for f in failed] == [
+        ("output/part-00017-c000.json", 0, 1)
+    ]
+
+
+def test_pipe_usage_adds_up_the_hours_of_each_pipe(pipes):
+    assert list(pipes) == [PIPE]
+    pipe = pipes[PIPE]
+    assert pipe["credits"] == pytest.approx(0.185789)
+    assert (pipe["bytes"], pipe["files"]) == (2456054471, 39)
+    assert pipe["end"] - pipe["start"] == datetime.timedelta(hours=2)
+    assert pipe["credits_per_gb"] == pytest.approx(0.185789 / (2456054471 / GB))
+
+
+def test_load_metrics_leave_the_failed_file_out_of_the_bytes(files, pipes):
+    metrics = load_metrics(files, pipes)
+
+    assert (metrics["files"], metrics["failed_files"]) == (40, 1)
+    assert metrics["rows"] == 10678477
+    # The failed file's 118710461 bytes are not counted as loaded
+    assert metrics["bytes"] == 2456054471
+    assert (
+        metrics["latency_p50_seconds"],
+        metrics["latency_p95_seconds"],
+        metrics["latency_max_seconds"],
+    ) == (68, 100, 109)
+    assert metrics["credits_per_gb"] == pytest.approx(0.0812, abs=1e-4)
+    assert metrics["credits_per_1000_files"] == pytest.approx(0.185789 / 39 * 1000)
+    assert metrics["window_hours"] == 2
+
+
+def test_copy_task_credits_bill_a_minute_and_the_idle_time_per_run():
+    # Two hourly runs too short to bill more than the minimum
+    assert copy_task_credits(GB, 2, 60, gb_per_credit=100) == pytest.approx(
+        2 * (60 + 120) / 3600
+    )
+    # A medium warehouse loads as many GB per credit in a quarter of the time
+    assert copy_task_credits(100 * GB, 1, 60, "MEDIUM") == pytest.approx(
+        (10 / 4 * 3600 + 120) / 3600 * 4
+    )
+
+
+def test_the_cheaper_ingestion_within_the_latency_target_is_recommended(files, pipes):
+    metrics = load_metrics(files, pipes)
+
+    measured = recommend_ingestion(metrics)
+    assert measured["ingestion"] == "snowpipe"
+    assert measured["copy_task_credits"] == pytest.approx(0.2954, abs=1e-4)
+
+    assert recommend_ingestion(metrics, gb_per_credit=100)["ingestion"] == "copy_task"
+    assert (
+        recommend_ingestion(metrics, gb_per_credit=100, max_latency_seconds=1800)[
+            "ingestion"
+        ]
+        == "snowpipe"
+    )
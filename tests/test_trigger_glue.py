@@ -0,0 +1,388 @@
+import datetime
+import gzip
+import json
+import threading
+
+import boto3
+import pytest
+from botocore.stub import ANY, Stubber
+from moto import mock_aws
+from moto.moto_api import state_manager
+
+import trigger_glue
+
+HEADER = "CustomerID,FirstName,LastName,EmailAddress,ModifiedDate\n"
+ROW = "1,Orlando,Gee,orlando0@adventure-works.com,2005-08-01 00:00:00.000\n"
+COLUMNS = ["customerid", "firstname", "lastname", "emailaddress", "modifieddate"]
+
+# The same table in the dated layout, cataloged with a dt partition
+DATED_TABLES = [
+    {"name": "customers", "input_prefix": "raw/customers/", "table_name": "customers"}
+]
+
+TABLES = [
+    {"name": "customers", "input_prefix": "customers/", "table_name": "customers"}
+]
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    # The trigger's settings and cached clients and state, against moto with
+    # a data lake bucket, a catalog table of the customers columns and a job
+    # allowing one run at a time
+    monkeypatch.setenv("GLUE_CRAWLER_NAME", "crawler")
+    monkeypatch.setenv("GLUE_SCHEMA_CRAWLER_NAME", "schema-crawler")
+    monkeypatch.setenv("GLUE_JOB_NAME", "job")
+    monkeypatch.setenv("GLUE_DATABASE_NAME", "lake")
+    monkeypatch.setenv("GLUE_TABLES", json.dumps(TABLES))
+    # Retries of the Glue API do not wait
+    monkeypatch.setattr(trigger_glue.time, "sleep", lambda seconds: None)
+    # Job runs stay running, moto finishes them on the first look otherwise
+    state_manager.set_transition(
+        "glue::job_run", {"progression": "manual", "times": 1000}
+    )
+    with mock_aws():
+        trigger_glue.get_settings.cache_clear()
+        trigger_glue._clients.clear()
+        trigger_glue._schema_cache.clear()
+        trigger_glue._crawler_state_cache.clear()
+        trigger_glue._partition_cache.clear()
+        trigger_glue.load_fast_path_tables.cache_clear()
+
+        s3 = boto3.client("s3")
+        s3.create_bucket(Bucket="lake")
+        glue = boto3.client("glue")
+        glue.create_database(DatabaseInput={"Name": "lake"})
+        glue.create_table(
+            DatabaseName="lake",
+            TableInput={
+                "Name": "customers",
+                "StorageDescriptor": {
+                    "Columns": [{"Name": c, "Type": "string"} for c in COLUMNS]
+                },
+            },
+        )
+        glue.create_job(
+            Name="job",
+            Role="role",
+            Command={"Name": "glueetl", "ScriptLocation": "s3://scripts/job.py"},
+            ExecutionProperty={"MaxConcurrentRuns": 1},
+        )
+        for name in ("crawler", "schema-crawler"):
+            glue.create_crawler(
+                Name=name,
+                Role="role",
+                DatabaseName="lake",
+                Targets={"S3Targets": [{"Path": "s3://lake/"}]},
+            )
+        yield {"s3": s3, "glue": glue}
+    state_manager.unset_transition("glue::job_run")
+    trigger_glue.get_settings.cache_clear()
+    trigger_glue._clients.clear()
+
+
+def upload(s3, key, body=HEADER + ROW):
+    if key.endswith(".gz"):
+        body = gzip.compress(body.encode())
+    elif isinstance(body, str):
+        body = body.encode()
+    s3.put_object(Bucket="lake", Key=key, Body=body)
+    return {
+        "eventSource": "aws:s3",
+        "eventTime": "2024-01-01T00:00:00.000Z",
+        "responseElements": {"x-amz-request-id": f"request-{key}"},
+        "s3": {
+            "bucket": {"name": "lake"},
+            "object": {"key": key, "size": len(body), "eTag": f"etag-{key}"},
+        },
+    }
+
+
+def sqs_event(*messages):
+    # One SQS message per list of S3 records, as the trigger queue delivers
+    # them in a batch
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:sqs",
+                "messageId": f"message-{i}",
+                "body": json.dumps({"Records": records}),
+            }
+            for i, records in enumerate(messages)
+        ]
+    }
+
+
+@pytest.fixture
+def stubbed_glue(aws):
+    # A Glue client answering only the calls a test expects, any other call
+    # (start_crawler included) fails the test
+    glue = boto3.client("glue")
+    trigger_glue._clients["glue"] = glue
+    with Stubber(glue) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
+
+
+def catalog_table(columns):
+    return {
+        "Table": {
+            "Name": "customers",
+            "DatabaseName": "lake",
+            "StorageDescriptor": {
+                "Columns": [{"Name": c, "Type": "string"} for c in columns]
+            },
+        }
+    }
+
+
+def s3_event(*records):
+    return {"Records": list(records)}
+
+
+def job_runs(glue):
+    return glue.get_job_runs(JobName="job")["JobRuns"]
+
+
+def test_a_batch_of_uploads_starts_one_run_with_their_keys(aws):
+    event = sqs_event(
+        [upload(aws["s3"], "customers/a.csv"), upload(aws["s3"], "customers/b.csv")],
+        [upload(aws["s3"], "customers/c.csv")],
+    )
+
+    response = trigger_glue.handler(event, None)
+
+    assert response["statusCode"] == 200
+    (run,) = job_runs(aws["glue"])
+    assert json.loads(run["Arguments"]["--input_keys"]) == [
+        "s3://lake/customers/a.csv",
+        "s3://lake/customers/b.csv",
+        "s3://lake/customers/c.csv",
+    ]
+
+
+def test_a_batch_is_deferred_while_a_run_is_going(aws):
+    trigger_glue.handler(sqs_event([upload(aws["s3"], "customers/a.csv")]), None)
+
+    response = trigger_glue.handler(
+        sqs_event(
+            [upload(aws["s3"], "customers/b.csv")],
+            [upload(aws["s3"], "customers/c.csv")],
+        ),
+        None,
+    )
+
+    # Both messages go back to the queue for a later run to pick up
+    assert response == {
+        "batchItemFailures": [
+            {"itemIdentifier": "message-0"},
+            {"itemIdentifier": "message-1"},
+        ]
+    }
+    assert len(job_runs(aws["glue"])) == 1
+
+
+def test_test_events_are_consumed_without_a_run():
+    event = {
+        "Records": [
+            {
+                "eventSource": "aws:sqs",
+                "messageId": "message-0",
+                "body": json.dumps({"Event": "s3:TestEvent"}),
+            }
+        ]
+    }
+    assert list(trigger_glue.extract_s3_records(event)) == []
+
+
+def test_too_many_keys_leave_input_discovery_to_the_job():
+    keys = [f"s3://lake/customers/{i:06d}.csv" for i in range(10)]
+    assert json.loads(trigger_glue.job_arguments(keys)["--input_keys"]) == keys
+
+    many = [f"s3://lake/customers/{i:06d}.csv" for i in range(5000)]
+    assert trigger_glue.job_arguments(many) == {}
+
+
+def test_an_unchanged_schema_starts_the_job_without_crawling(aws, stubbed_glue):
+    stubbed_glue.add_response(
+        "get_table",
+        catalog_table(COLUMNS),
+        {"DatabaseName": "lake", "Name": "customers"},
+    )
+    stubbed_glue.add_response(
+        "start_job_run",
+        {"JobRunId": "jr_stubbed"},
+        {
+            "JobName": "job",
+            "Arguments": {
+                "--input_keys": json.dumps(["s3://lake/customers/a.csv"]),
+                "--correlation_id": ANY,
+            },
+            "WorkerType": ANY,
+            "NumberOfWorkers": ANY,
+            "ExecutionClass": ANY,
+        },
+    )
+
+    response = trigger_glue.handler(
+        s3_event(upload(aws["s3"], "customers/a.csv")), None
+    )
+
+    assert response["statusCode"] == 200
+
+
+def test_the_catalog_schema_is_cached_across_uploads(aws, stubbed_glue):
+    stubbed_glue.add_response("get_table", catalog_table(COLUMNS))
+    for _ in range(2):
+        stubbed_glue.add_response("start_job_run", {"JobRunId": "jr_stubbed"})
+
+    # The second upload is gzip-compressed, its header is read all the same
+    for key in ("customers/a.csv", "customers/b.csv.gz"):
+        trigger_glue.handler(s3_event(upload(aws["s3"], key)), None)
+
+
+def test_a_changed_header_starts_the_full_crawl_instead(aws, stubbed_glue):
+    stubbed_glue.add_response("get_table", catalog_table(COLUMNS))
+    # Never crawled in full, then started
+    stubbed_glue.add_response("get_crawler", {"Crawler": {"State": "READY"}})
+    stubbed_glue.add_response("get_crawler", {"Crawler": {"State": "READY"}})
+    stubbed_glue.add_response("start_crawler", {}, {"Name": "schema-crawler"})
+
+    response = trigger_glue.handler(
+        s3_event(upload(aws["s3"], "customers/a.csv", "CustomerID,Phone\n1,555\n")),
+        None,
+    )
+
+    assert response["statusCode"] == 202
+
+
+def test_a_header_a_full_crawl_did_not_take_is_not_crawled_again(aws, stubbed_glue):
+    stubbed_glue.add_response("get_table", catalog_table(COLUMNS))
+    record = upload(aws["s3"], "customers/a.csv", "CustomerID,Phone\n1,555\n")
+    written = aws["s3"].head_object(Bucket="lake", Key="customers/a.csv")
+    last_crawl = {
+        "Status": "SUCCEEDED",
+        "StartTime": written["LastModified"] + datetime.timedelta(minutes=1),
+    }
+    stubbed_glue.add_response(
+        "get_crawler", {"Crawler": {"State": "READY", "LastCrawl": last_crawl}}
+    )
+    stubbed_glue.add_response("start_job_run", {"JobRunId": "jr_stubbed"})
+
+    response = trigger_glue.handler(s3_event(record), None)
+
+    assert response["statusCode"] == 200
+
+
+def test_an_unknown_table_starts_the_crawler(aws, stubbed_glue):
+    stubbed_glue.add_client_error("get_table", "EntityNotFoundException")
+    stubbed_glue.add_response("get_crawler", {"Crawler": {"State": "READY"}})
+    stubbed_glue.add_response("start_crawler", {}, {"Name": "crawler"})
+
+    response = trigger_glue.handler(
+        s3_event(upload(aws["s3"], "customers/a.csv")), None
+    )
+
+    assert response["statusCode"] == 202
+
+
+def test_an_upload_to_a_new_partition_is_crawled(aws, monkeypatch):
+    monkeypatch.setenv("GLUE_TABLES", json.dumps(DATED_TABLES))
+
+    response = trigger_glue.handler(
+        s3_event(upload(aws["s3"], "raw/customers/dt=2024-01-02/a.csv")), None
+    )
+
+    # Catalog reads would not see the files until the crawler adds dt=2024-01-02
+    assert response["statusCode"] == 202
+    assert aws["glue"].get_crawler(Name="crawler")["Crawler"]["State"] == "RUNNING"
+    assert job_runs(aws["glue"]) == []
+
+
+def test_an_upload_to_a_registered_partition_starts_the_job(aws, monkeypatch):
+    monkeypatch.setenv("GLUE_TABLES", json.dumps(DATED_TABLES))
+    aws["glue"].create_partition(
+        DatabaseName="lake",
+        TableName="customers",
+        PartitionInput={
+            "Values": ["2024-01-02"],
+            "StorageDescriptor": {"Location": "s3://lake/raw/customers/dt=2024-01-02/"},
+        },
+    )
+
+    response = trigger_glue.handler(
+        s3_event(upload(aws["s3"], "raw/customers/dt=2024-01-02/a.csv")), None
+    )
+
+    assert response["statusCode"] == 200
+    assert len(job_runs(aws["glue"])) == 1
+
+
+def test_a_batch_reads_its_headers_together_and_each_partition_once(
+    aws, stubbed_glue, monkeypatch
+):
+    monkeypatch.setenv("GLUE_TABLES", json.dumps(DATED_TABLES))
+    # Each read waits for another one to be under way
+    read_csv_header = trigger_glue.read_csv_header
+    barrier = threading.Barrier(2, timeout=5)
+
+    def read_together(s3_client, url):
+        barrier.wait()
+        return read_csv_header(s3_client, url)
+
+    monkeypatch.setattr(trigger_glue, "read_csv_header", read_together)
+    stubbed_glue.add_response("get_table", catalog_table(COLUMNS))
+    for day in ("2024-01-02", "2024-01-03"):
+        stubbed_glue.add_response(
+            "get_partition",
+            {"Partition": {"Values": [day]}},
+            {
+                "DatabaseName": "lake",
+                "TableName": "customers",
+                "PartitionValues": [day],
+            },
+        )
+    stubbed_glue.add_response("start_job_run", {"JobRunId": "jr_stubbed"})
+    records = [
+        upload(aws["s3"], f"raw/customers/dt={day}/{i}.csv")
+        for day in ("2024-01-02", "2024-01-03")
+        for i in range(20)
+    ]
+
+    response = trigger_glue.handler(sqs_event(records), None)
+
+    assert response["statusCode"] == 200
+
+
+def test_small_uploads_are_converted_with_the_tables_document(aws, monkeypatch):
+    # The document the Pulumi program uploads for the fast path
+    aws["s3"].put_object(
+        Bucket="lake",
+        Key="registry/tables.json",
+        Body=json.dumps(
+            {
+                "data_lake_bucket": "lake",
+                "output_bucket": "lake",
+                "scripts_bucket": "lake",
+                "tables": {
+                    "customers": {
+                        "input_prefix": "customers/",
+                        "output_prefix": "output/customers/",
+                        "rejected_prefix": "rejected/customers/",
+                        "column_types": ",".join(f"{c}:STRING" for c in COLUMNS),
+                        "drop_columns": "",
+                        "dedup_keys": "",
+                        "dedup_order": "",
+                    }
+                },
+            }
+        ),
+    )
+    monkeypatch.setenv("FAST_PATH", json.dumps({"max_bytes": 1024}))
+    monkeypatch.setenv("FAST_PATH_TABLES", "s3://lake/registry/tables.json")
+
+    trigger_glue.handler(s3_event(upload(aws["s3"], "customers/a.csv")), None)
+
+    output = aws["s3"].list_objects_v2(Bucket="lake", Prefix="output/customers/")
+    assert output["KeyCount"] == 1
+    assert job_runs(aws["glue"]) == []